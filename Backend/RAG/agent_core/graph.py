@@ -1,5 +1,5 @@
 import uuid
-from typing import Dict, Any
+from typing import Any, Callable, Dict, Optional
 from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.memory import MemorySaver
 from .state import MultiRoleAgentState
@@ -105,7 +105,9 @@ class MultiRoleAgentGraph:
             # pipeline fields
             "llm_analysis":        None,
             "required_tools":      [],
+            "speculation_id":      None,
             "tool_results":        [],
+            "tool_timings":        [],
             "final_answer":        None,
         }
 
@@ -120,16 +122,29 @@ class MultiRoleAgentGraph:
             config={"configurable": {"thread_id": thread_id}},
         )
 
-    def run_pipeline_only(self, state: MultiRoleAgentState) -> Dict[str, Any]:
+    def run_pipeline_only(
+        self,
+        state: MultiRoleAgentState,
+        on_stage: Optional[Callable[..., None]] = None,
+    ) -> Dict[str, Any]:
         """
         Chạy pipeline đến hết tool_executor (không gọi llm_response).
         Dùng cho streaming — route sẽ tự gọi synthesizer.stream_run() sau.
+        on_stage(stage, **info): báo tiến độ từng bước (SSE 'progress'):
+          cache_check → cache_hit | analyzing → retrieving(tools) → retrieved(timings)
         """
         from .node import user_input, role_manager, cache_check, task_analyzer, tool_executor
-        for fn in (user_input, role_manager, cache_check):
-            fn(state)
+        notify = on_stage or (lambda stage, **info: None)
+        user_input(state)
+        role_manager(state)
+        notify("cache_check")
+        cache_check(state)
         if state.get('cache_hit'):
+            notify("cache_hit")
             return state
+        notify("analyzing")
         task_analyzer(state)
+        notify("retrieving", tools=[t.get("tool_name") for t in state.get("required_tools") or []])
         tool_executor(state)
+        notify("retrieved", timings=state.get("tool_timings") or [])
         return state
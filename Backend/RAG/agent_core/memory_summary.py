@@ -0,0 +1,139 @@
+"""
+Conversation memory — tóm tắt từng lượt hội thoại MỘT lần, chạy nền
+===================================================================
+
+role_manager trước đây gọi GeminiChatParagraphSummarizer cho 3 lượt gần nhất
+ở MỌI lượt hỏi tiếp theo — thêm một round-trip Gemini trước khi pipeline bắt
+đầu, và tóm tắt lại các lượt đã tóm tắt ở lượt trước.
+
+Giờ mỗi lượt (một dòng conversation_history) được tóm tắt đúng một lần, trên
+thread nền ngay sau khi câu trả lời được ghi (`_log_chat` → `schedule`), và
+lưu vào cột `conversation_history.summary`. Lượt kế tiếp chỉ đọc các summary
+đã lưu theo session_id (`load_history`) — không gọi LLM. Lượt nào chưa có
+summary (tác vụ nền chưa xong / lỗi) dùng bản rút gọn của text gốc.
+
+Tham số cấu hình (biến môi trường):
+  RAG_MEMORY_SUMMARY          : '1' bật (mặc định) / '0' tắt tóm tắt nền
+  RAG_MEMORY_SUMMARY_WORKERS  : int, default 1   — số thread tóm tắt
+  RAG_MEMORY_FALLBACK_CHARS   : int, default 300 — độ dài text gốc khi chưa có summary
+"""
+
+import os
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional, Sequence
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+
+logger = get_logger('rag.memory')
+
+SUMMARY_ENABLED: bool = os.getenv('RAG_MEMORY_SUMMARY', '1').strip() not in ('0', 'false', 'no')
+SUMMARY_WORKERS: int  = int(os.getenv('RAG_MEMORY_SUMMARY_WORKERS', '1'))
+FALLBACK_CHARS:  int  = int(os.getenv('RAG_MEMORY_FALLBACK_CHARS', '300'))
+
+# Cửa sổ lịch sử đưa vào prompt (giữ như _load_memory cũ)
+HISTORY_TURNS = 3
+HISTORY_HOURS = 4
+
+_pool = ThreadPoolExecutor(max_workers=max(1, SUMMARY_WORKERS), thread_name_prefix='rag-memory')
+
+
+def _default_engine():
+    from RAG.connect_SQL.connect_SQL import connect_sql
+    return connect_sql()
+
+
+def _default_summarize(user_message: str, bot_response: str) -> str:
+    from RAG.utils.llm_wrapper import GeminiChatParagraphSummarizer  # lazy — kéo theo google SDK
+    return GeminiChatParagraphSummarizer().summarize_each_exchange(
+        chat_json=[{'user': user_message, 'chatbot': bot_response}],
+    )
+
+
+def _clip(text: str, limit: int) -> str:
+    text = ' '.join((text or '').split())
+    return text if len(text) <= limit else text[:limit].rstrip() + '…'
+
+
+def format_history(rows: Iterable[Sequence[Any]], limit: int = FALLBACK_CHARS) -> str:
+    """
+    rows: (user_message, bot_response, summary) theo thứ tự thời gian tăng dần.
+    Dùng summary đã lưu; lượt chưa có summary dùng text gốc rút gọn.
+    """
+    parts = []
+    for user_msg, bot_msg, summary in rows:
+        if summary and summary.strip():
+            parts.append(summary.strip())
+        else:
+            parts.append(f"User: {_clip(user_msg, limit)}\nAssistant: {_clip(bot_msg, limit)}")
+    return "\n".join(parts)
+
+
+def load_history(session_id: str, engine: Any = None) -> str:
+    """Lịch sử gần đây của session dưới dạng đoạn văn — không gọi LLM."""
+    if not session_id:
+        return ""
+    from sqlalchemy import text  # type: ignore
+    try:
+        engine = engine or _default_engine()
+        if engine is None:
+            return ""
+        with engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT user_message, bot_response, summary
+                FROM conversation_history
+                WHERE session_id = :session_id
+                  AND timestamp >= NOW() - INTERVAL '{HISTORY_HOURS} hours'
+                ORDER BY timestamp DESC
+                LIMIT {HISTORY_TURNS}
+            """), {"session_id": session_id}).fetchall()
+        return format_history(reversed(rows))
+    except Exception as e:
+        logger.warning("Không thể tải memory: %s", e)
+        return ""
+
+
+def _summarize_and_store(
+    conversation_id: int,
+    user_message: str,
+    bot_response: str,
+    summarize: Callable[[str, str], str],
+    engine_factory: Callable[[], Any],
+) -> Optional[str]:
+    summary = (summarize(user_message, bot_response) or '').strip()
+    if not summary:
+        return None
+    from sqlalchemy import text  # type: ignore
+    engine = engine_factory()
+    if engine is None:
+        return None
+    with engine.begin() as conn:
+        conn.execute(
+            text('UPDATE conversation_history SET summary = :summary WHERE id = :id'),
+            {'summary': summary, 'id': conversation_id},
+        )
+    return summary
+
+
+def schedule(
+    conversation_id: Optional[int],
+    user_message: str,
+    bot_response: str,
+    summarize: Callable[[str, str], str] = _default_summarize,
+    engine_factory: Callable[[], Any] = _default_engine,
+) -> Optional[Future]:
+    """Xếp hàng tóm tắt một lượt vừa ghi; không bao giờ chặn request."""
+    if not SUMMARY_ENABLED or conversation_id is None or not (bot_response or '').strip():
+        return None
+
+    def _run() -> Optional[str]:
+        try:
+            return _summarize_and_store(conversation_id, user_message, bot_response,
+                                        summarize, engine_factory)
+        except Exception as exc:
+            logger.debug(f'[memory] tóm tắt lượt {conversation_id} lỗi (non-fatal): {exc}')
+            return None
+
+    return _pool.submit(_run)
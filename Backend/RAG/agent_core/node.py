@@ -5,16 +5,18 @@ from pathlib import Path
 from ..utils.llm_wrapper import (
     GeminiSynthesizerLLM,
     GeminiAnalyzerLLM,
-    GeminiChatParagraphSummarizer,
 )
+from ..utils.prompt_assets import get_assets as get_prompt_assets, render_tool_descriptions
 from ..tools.tool_registry import TOOL_REGISTRY
 from ..cache.semantic_cache import get_cache
+from .tool_router import route as route_tools_locally
+from . import speculation
+from .tool_runner import run_tools, tool_timeouts
+from .memory_summary import load_history as load_conversation_summary
 import yaml
 import re
 import json
-from ..connect_SQL.connect_SQL import connect_sql
 import os
-from sqlalchemy import text
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from logger import get_logger
@@ -29,20 +31,32 @@ def user_input(state: MultiRoleAgentState) -> str:
     return state["user_input"]
 
 
-def _load_base_prompt(state: MultiRoleAgentState) -> str:
-    path = _RAG_DIR / "prompt" / "General_Prompt.docx"
+_FALLBACK_PROMPT = "Bạn là trợ lý hành chính, hỗ trợ người dân với câu trả lời rõ ràng và súc tích."
+
+
+def _read_base_prompt(path: Path) -> str:
     try:
         doc = Document(str(path))
         prompt_text = "\n".join([p.text for p in doc.paragraphs if p.text.strip()])
         return prompt_text
     except FileNotFoundError:
         logger.warning(f'[RAG] General_Prompt.docx không tìm thấy tại {path} — dùng fallback prompt')
-        return "Bạn là trợ lý hành chính, hỗ trợ người dân với câu trả lời rõ ràng và súc tích."
+        return _FALLBACK_PROMPT
     except Exception as e:
         logger.warning(f'[RAG] Không đọc được General_Prompt.docx: {e} — dùng fallback prompt')
-        return "Bạn là trợ lý hành chính, hỗ trợ người dân với câu trả lời rõ ràng và súc tích."
+        return _FALLBACK_PROMPT
+
+
+def _load_base_prompt(state: MultiRoleAgentState) -> str:
+    """Prompt gốc từ General_Prompt.docx — parse lại chỉ khi file thay đổi."""
+    return get_prompt_assets().get(_RAG_DIR / "prompt" / "General_Prompt.docx", _read_base_prompt)
 
 def _load_tool_for_role() -> List[Dict[str, Any]]:
+    """Danh sách tool từ tool.yaml — parse lại chỉ khi file thay đổi."""
+    return list(get_prompt_assets().get(_RAG_DIR / "prompt" / "tool.yaml", _read_tools))
+
+
+def _read_tools(path: Path) -> List[Dict[str, Any]]:
     """
     File YAML có dạng:
     tools:
@@ -55,9 +69,8 @@ def _load_tool_for_role() -> List[Dict[str, Any]]:
             description: "Chuỗi truy vấn hoặc từ khóa mô tả thông tin cần tìm"
             example: "doanh thu Q2 2025 khu vực VN"
         returns: "Danh sách bản ghi phù hợp"
+        timeout: 8          # giây, tuỳ chọn — deadline của tool trong tool_executor
     """
-
-    path = _RAG_DIR / "prompt" / "tool.yaml"
     try:
         if not path.is_file():
             return []
@@ -78,7 +91,8 @@ def _load_tool_for_role() -> List[Dict[str, Any]]:
                 "name": tool.get("name"),
                 "description": tool.get("description", ""),
                 "parameters": tool.get("parameters", {}),
-                "returns": tool.get("returns", "")
+                "returns": tool.get("returns", ""),
+                "timeout": tool.get("timeout"),
             })
         return normalized_tools
 
@@ -86,47 +100,16 @@ def _load_tool_for_role() -> List[Dict[str, Any]]:
         return []
 
 def _load_memory(session_id: str) -> str:
-    if not session_id:
-        return ""
-
-    query = text("""
-        SELECT user_message, bot_response
-        FROM conversation_history
-        WHERE session_id = :session_id
-          AND timestamp >= NOW() - INTERVAL '4 hours'
-        ORDER BY timestamp DESC
-        LIMIT 3
-    """)
-
-    try:
-        engine = connect_sql()
-        if engine is None:
-            return ""
-        with engine.connect() as conn:
-            result = conn.execute(query, {"session_id": session_id})
-            rows = result.fetchall()
-
-        formatted_history = []
-        for user_msg, bot_msg in reversed(rows):
-            formatted_history.append(f"User: {user_msg}")
-            formatted_history.append(f"Assistant: {bot_msg}")
-        return "\n".join(formatted_history)
-
-    except Exception as e:
-        logger.warning("Không thể tải memory: %s", e)
-        return ""
+    """Summary đã lưu của các lượt gần đây (memory_summary) — không gọi LLM."""
+    return load_conversation_summary(session_id)
 
 def role_manager(state: MultiRoleAgentState) -> None:
     state["tools"] = _load_tool_for_role()
     base_prompt = _load_base_prompt(state)
     state["base_prompt"] =  base_prompt
 
-    conversation_history = _load_memory(session_id=state.get("session_id", ""))
-    if conversation_history:
-        summarizer = GeminiChatParagraphSummarizer()
-        summarise_conversation_history = summarizer.summarize_each_exchange(chat_json=conversation_history)
-    else:
-        summarise_conversation_history = ""
+    # Mỗi lượt đã được tóm tắt nền sau khi trả lời (memory_summary.schedule)
+    summarise_conversation_history = _load_memory(session_id=state.get("session_id", ""))
     state["conversation_history"] = summarise_conversation_history
 
     history_section = (
@@ -228,6 +211,7 @@ def task_analyzer(state: MultiRoleAgentState) -> None:
     Node task_analyzer (in-place update).
     - Reads: state['user_question'], state['base_prompt'], state['role_tools']
     - Updates: state['llm_analysis'] (raw text) and state['required_tools'] (List[Dict])
+    - Router cục bộ (tool_router) trả lời trước; chỉ gọi Gemini khi router không chắc.
     """
     user_question = state.get("user_input")
     base_prompt = state.get("full_prompt")
@@ -237,8 +221,37 @@ def task_analyzer(state: MultiRoleAgentState) -> None:
 
     normalized_role_tools = _normalize_role_tools(role_tools_raw)
 
+    # Fast-path: router cục bộ trên query_embedding (đã có từ cache_check) — bỏ qua Gemini khi tự tin
+    local_tools = route_tools_locally(
+        user_question,
+        state.get("query_embedding"),
+        (t["name"] for t in normalized_role_tools),
+    )
+    if local_tools is not None:
+        state["llm_analysis"] = json.dumps(
+            {"analysis": "local router", "router": "local", "required_tools": local_tools},
+            ensure_ascii=False,
+        )
+        state["required_tools"] = local_tools
+        return
+
+    # Khởi chạy trước các tool dễ đoán — retrieval chạy song song với lời gọi Gemini
+    spec_id = speculation.start(user_question, (t["name"] for t in normalized_role_tools))
+    state["speculation_id"] = spec_id
+
     analyzer = GeminiAnalyzerLLM()
-    raw_response = analyzer.analyze_task(base_prompt=base_prompt, user_question=user_question, role_tools=normalized_role_tools)
+    try:
+        raw_response = analyzer.analyze_task(
+            base_prompt=base_prompt,
+            user_question=user_question,
+            role_tools=normalized_role_tools,
+            tool_descriptions=render_tool_descriptions(normalized_role_tools),
+        )
+    except Exception:
+        spec = speculation.claim(spec_id)
+        if spec is not None:
+            spec.discard()
+        raise
 
     state["llm_analysis"] = raw_response
     parsed = _extract_json_from_text(raw_response)
@@ -256,34 +269,24 @@ def task_analyzer(state: MultiRoleAgentState) -> None:
 
 
 def tool_executor(state: MultiRoleAgentState) -> None:
-
-    required_tools = state.get("required_tools", [])
-    tool_results = []
-
-    for tool_info in required_tools:
-        tool_name = tool_info.get("tool_name") or tool_info.get("name")
-        params = tool_info.get("params", {})
-
-        if not tool_name:
-            continue
-        tool_func = TOOL_REGISTRY.get(tool_name)
-
-        if not tool_func:
-            tool_results.append({
-                "tool_name": tool_name,
-                "params": params,
-                "result": None
-            })
-            continue
-
-        try:
-            result = tool_func(**params)
-        except Exception as e:
-            result = f"❌ Lỗi khi thực thi {tool_name}: {str(e)}"
-
-        tool_results.append({"tool_name": tool_name, "params": params, "result": result})
+    """
+    Chạy required_tools song song với deadline theo từng tool (tool_runner).
+    - Updates: state['tool_results'] (chỉ các tool đã xong) và state['tool_timings'].
+    """
+    spec = speculation.claim(state.get("speculation_id"))
+    try:
+        tool_results, timings = run_tools(
+            state.get("required_tools", []),
+            TOOL_REGISTRY,
+            timeouts=tool_timeouts(state.get("tools")),
+            spec=spec,
+        )
+    finally:
+        if spec is not None:
+            spec.discard()
 
     state["tool_results"] = tool_results
+    state["tool_timings"] = timings
 
 def build_synthesis_prompt(state: MultiRoleAgentState) -> str:
     """Xây dựng prompt tổng hợp từ state — dùng chung cho llm_response và streaming."""
@@ -0,0 +1,204 @@
+"""
+Single-flight — gộp các câu hỏi giống nhau đang được xử lý đồng thời
+=====================================================================
+
+Khi một câu hỏi "nóng" (hạn đổi CCCD, …) được gửi hàng loạt trong vài giây,
+mọi request cùng miss SemanticCache và mỗi request chạy trọn pipeline Gemini;
+`store` sau đó chỉ bỏ các bản trùng. Module này cho request đầu tiên (leader)
+chạy pipeline, các request trùng đến sau (follower) chờ kết quả của nó:
+
+  • Khoá = scope + câu hỏi đã chuẩn hoá (NFC + gộp khoảng trắng + casefold);
+    scope (vd. session id) tách các request có ngữ cảnh hội thoại khác nhau.
+  • Tuỳ chọn: coi là trùng nếu embedding có cosine ≥ RAG_COALESCE_SIM với
+    một câu hỏi đang bay cùng scope (chỉ so với các flight đang chạy — vài vector).
+  • Streaming: leader `publish` từng chunk; follower `stream()` nhận lại các
+    chunk đã có rồi tiếp tục nhận chunk mới — cùng một luồng token.
+  • Leader xong / lỗi → flight rời registry; request sau đó đi qua cache như
+    thường. Lỗi của leader được trả cho mọi follower.
+
+Tham số cấu hình (biến môi trường):
+  RAG_COALESCE            : '1' bật (mặc định) / '0' tắt
+  RAG_COALESCE_SIM        : float, default 0 — ngưỡng cosine gộp theo ngữ nghĩa (0 = chỉ gộp trùng khớp)
+  RAG_COALESCE_WAIT_SECS  : float, default 90 — thời gian follower chờ tối đa
+"""
+
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+from ..tools.embedding_service import normalize_text
+
+logger = get_logger('rag.singleflight')
+
+COALESCE_ENABLED: bool  = os.getenv('RAG_COALESCE', '1').strip() not in ('0', 'false', 'no')
+COALESCE_SIM:     float = float(os.getenv('RAG_COALESCE_SIM', '0'))
+COALESCE_WAIT:    float = float(os.getenv('RAG_COALESCE_WAIT_SECS', '90'))
+
+
+class FlightTimeout(TimeoutError):
+    """Follower chờ leader quá RAG_COALESCE_WAIT_SECS."""
+
+
+class Flight:
+    """Một lần xử lý đang chạy; leader ghi, follower đọc."""
+
+    def __init__(self, key: str, unit: Optional[np.ndarray], scope: str = '') -> None:
+        self.key  = key
+        self.unit = unit
+        self.scope = scope
+        self.followers = 0
+        self._cond   = threading.Condition()
+        self._chunks: List[str] = []
+        self._done   = False
+        self._result: Any = None
+        self._error: Optional[BaseException] = None
+
+    # ── leader side ───────────────────────────────────────────────────────────
+
+    def publish(self, chunk: str) -> None:
+        with self._cond:
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+
+    def _settle(self, result: Any, error: Optional[BaseException]) -> None:
+        with self._cond:
+            if self._done:
+                return
+            self._done, self._result, self._error = True, result, error
+            self._cond.notify_all()
+
+    # ── follower side ─────────────────────────────────────────────────────────
+
+    def stream(self, timeout: float = COALESCE_WAIT) -> Iterator[str]:
+        """Các chunk leader đã/đang publish; raise lỗi của leader nếu có."""
+        deadline = time.monotonic() + timeout
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self._chunks) and not self._done:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise FlightTimeout(f'coalesced request timed out after {timeout:.0f}s')
+                    self._cond.wait(remaining)
+                pending = self._chunks[i:]
+                done, error = self._done, self._error
+            for chunk in pending:
+                yield chunk
+            i += len(pending)
+            if done and i >= len(self._chunks):
+                if error is not None:
+                    raise error
+                return
+
+    def wait(self, timeout: float = COALESCE_WAIT) -> Any:
+        """Kết quả cuối của leader (hoặc raise lỗi của leader)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._done, timeout):
+                raise FlightTimeout(f'coalesced request timed out after {timeout:.0f}s')
+            if self._error is not None:
+                raise self._error
+            return self._result
+
+
+class SingleFlight:
+    """Registry các flight đang chạy. Thread-safe."""
+
+    def __init__(self, sim_threshold: float = COALESCE_SIM) -> None:
+        self._sim = sim_threshold
+        self._lock = threading.Lock()
+        self._flights: Dict[str, Flight] = {}
+        self._leaders   = 0
+        self._followers = 0
+
+    @staticmethod
+    def key_of(query: str, scope: str = '') -> str:
+        return f'{scope}\x1f{normalize_text(query or "").casefold()}'
+
+    def join(self, query: str, embedding: Optional[Sequence[float]] = None,
+             scope: str = '') -> Tuple[Flight, bool]:
+        """Trả về (flight, is_leader). Leader PHẢI gọi finish/fail khi xong."""
+        key  = self.key_of(query, scope)
+        unit = _unit(embedding) if self._sim > 0 else None
+        with self._lock:
+            flight = self._flights.get(key) or self._nearest(unit, scope)
+            if flight is not None:
+                flight.followers += 1
+                self._followers  += 1
+                return flight, False
+            flight = Flight(key, unit, scope)
+            self._flights[key] = flight
+            self._leaders += 1
+            return flight, True
+
+    def _nearest(self, unit: Optional[np.ndarray], scope: str) -> Optional[Flight]:
+        if unit is None:
+            return None
+        best, best_sim = None, self._sim
+        for flight in self._flights.values():
+            if flight.scope != scope or flight.unit is None or flight.unit.shape != unit.shape:
+                continue
+            sim = float(flight.unit @ unit)
+            if sim >= best_sim:
+                best, best_sim = flight, sim
+        return best
+
+    def _leave(self, flight: Flight) -> None:
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def finish(self, flight: Flight, result: Any = None) -> None:
+        self._leave(flight)
+        flight._settle(result, None)
+
+    def fail(self, flight: Flight, error: BaseException) -> None:
+        self._leave(flight)
+        flight._settle(None, error)
+
+    def do(self, query: str, fn: Callable[[], Any], embedding: Optional[Sequence[float]] = None,
+           scope: str = '') -> Any:
+        """Chạy fn() một lần cho mọi request trùng đang bay; follower nhận cùng kết quả."""
+        flight, leader = self.join(query, embedding, scope)
+        if not leader:
+            logger.info(f'[singleflight] coalesced: "{query[:60]}" (+{flight.followers})')
+            return flight.wait()
+        try:
+            result = fn()
+        except BaseException as exc:
+            self.fail(flight, exc)
+            raise
+        self.finish(flight, result)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._leaders + self._followers
+            return {
+                'enabled':        COALESCE_ENABLED,
+                'in_flight':      len(self._flights),
+                'leaders':        self._leaders,
+                'followers':      self._followers,
+                'coalesce_rate':  self._followers / total if total else 0.0,
+            }
+
+
+def _unit(embedding: Optional[Sequence[float]]) -> Optional[np.ndarray]:
+    if embedding is None or not len(embedding):
+        return None
+    v = np.asarray(embedding, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n else None
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    return _single_flight
@@ -0,0 +1,168 @@
+"""
+Speculative tool execution — chạy retrieval song song với task_analyzer
+=======================================================================
+
+Pipeline tuần tự task_analyzer → tool_executor bắt retrieval phải đợi một
+round-trip Gemini, trong khi analyzer gần như luôn chọn
+`search_project_documents(query=<câu hỏi>)`. Module này khởi chạy trước các
+lời gọi tool "dễ đoán" trên thread pool riêng ngay khi task_analyzer bắt đầu
+gọi Gemini; tool_executor sau đó:
+
+  • HIT  : required_tools có đúng lời gọi đã đoán (cùng tool, cùng params sau
+           chuẩn hoá) → dùng lại kết quả, thời gian retrieval bị che hoàn toàn
+           sau lời gọi LLM.
+  • MISS : lời gọi đã đoán không được chọn → kết quả bị bỏ (future chưa chạy
+           thì huỷ), tool_executor chạy như bình thường.
+
+Future được giữ trong registry theo `speculation_id` (chỉ id nằm trong state,
+vì state của LangGraph phải serialize được). Registry bị chặn kích thước để
+speculation của request lỗi giữa chừng không rò bộ nhớ.
+
+Tham số cấu hình (biến môi trường):
+  RAG_SPECULATION           : '1' bật (mặc định) / '0' tắt
+  RAG_SPECULATIVE_TOOLS     : danh sách tool đoán trước, phân tách bằng dấu phẩy
+                              (default 'search_project_documents'); params = {query: câu hỏi}
+  RAG_SPECULATION_WORKERS   : int, default 8 — số thread chạy speculation
+"""
+
+import os
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+from ..tools.embedding_service import normalize_text
+
+logger = get_logger('rag.speculation')
+
+SPECULATION_ENABLED: bool = os.getenv('RAG_SPECULATION', '1').strip() not in ('0', 'false', 'no')
+SPECULATIVE_TOOLS: Tuple[str, ...] = tuple(
+    t.strip() for t in os.getenv('RAG_SPECULATIVE_TOOLS', 'search_project_documents').split(',') if t.strip()
+)
+SPECULATION_WORKERS: int = int(os.getenv('RAG_SPECULATION_WORKERS', '8'))
+
+# Số speculation chưa được claim tối đa giữ trong registry
+_MAX_PENDING = 256
+
+_pool = ThreadPoolExecutor(max_workers=max(1, SPECULATION_WORKERS), thread_name_prefix='rag-speculate')
+
+_lock = threading.Lock()
+_registry: 'OrderedDict[str, Speculation]' = OrderedDict()
+_counters: Dict[str, int] = {'started': 0, 'hits': 0, 'misses': 0, 'errors': 0}
+
+
+def _default_lookup(tool_name: str) -> Optional[Callable[..., Any]]:
+    from ..tools.tool_registry import TOOL_REGISTRY  # lazy — kéo theo ChromaDB / model
+    return TOOL_REGISTRY.get(tool_name)
+
+
+def call_key(tool_name: str, params: Dict[str, Any]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    """Khoá so khớp một lời gọi tool: params chuỗi được chuẩn hoá + casefold."""
+    items = []
+    for k, v in sorted((params or {}).items()):
+        if isinstance(v, str):
+            v = normalize_text(v).casefold()
+        items.append((str(k), repr(v)))
+    return tool_name or '', tuple(items)
+
+
+class Speculation:
+    """Các lời gọi tool đã khởi chạy trước cho một câu hỏi."""
+
+    def __init__(self) -> None:
+        self.id = uuid.uuid4().hex
+        self._futures: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Future] = {}
+
+    def submit(self, tool_name: str, params: Dict[str, Any], func: Callable[..., Any]) -> None:
+        self._futures[call_key(tool_name, params)] = _pool.submit(func, **params)
+
+    def __len__(self) -> int:
+        return len(self._futures)
+
+    def take(self, tool_name: str, params: Dict[str, Any]) -> Optional[Future]:
+        """Lấy future khớp lời gọi (mỗi future chỉ lấy được một lần)."""
+        fut = self._futures.pop(call_key(tool_name, params), None)
+        if fut is not None:
+            _count('hits')
+        return fut
+
+    def discard(self) -> int:
+        """Bỏ các lời gọi không được dùng; trả về số lời gọi bị bỏ."""
+        wasted = len(self._futures)
+        for fut in self._futures.values():
+            fut.cancel()
+        self._futures.clear()
+        if wasted:
+            _count('misses', wasted)
+        return wasted
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _lock:
+        _counters[name] += n
+
+
+def start(
+    question: str,
+    available: Iterable[str],
+    lookup: Callable[[str], Optional[Callable[..., Any]]] = _default_lookup,
+) -> Optional[str]:
+    """
+    Khởi chạy các lời gọi tool đoán trước cho `question`.
+    Trả về speculation_id (lưu vào state) hoặc None nếu không có gì để chạy.
+    """
+    if not SPECULATION_ENABLED or not question:
+        return None
+    available = set(available)
+    spec = Speculation()
+    for tool_name in SPECULATIVE_TOOLS:
+        if tool_name not in available:
+            continue
+        try:
+            func = lookup(tool_name)
+            if func is None:
+                continue
+            spec.submit(tool_name, {'query': question}, func)
+        except Exception as exc:
+            _count('errors')
+            logger.debug(f'[speculation] không khởi chạy được {tool_name} (non-fatal): {exc}')
+    if not len(spec):
+        return None
+
+    stale: list = []
+    with _lock:
+        _counters['started'] += len(spec)
+        _registry[spec.id] = spec
+        while len(_registry) > _MAX_PENDING:
+            stale.append(_registry.popitem(last=False)[1])
+    for old in stale:
+        old.discard()
+    return spec.id
+
+
+def claim(speculation_id: Optional[str]) -> Optional[Speculation]:
+    """Lấy speculation khỏi registry (gọi đúng một lần, ở tool_executor)."""
+    if not speculation_id:
+        return None
+    with _lock:
+        return _registry.pop(speculation_id, None)
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        started, hits = _counters['started'], _counters['hits']
+        return {
+            'enabled':  SPECULATION_ENABLED,
+            'tools':    list(SPECULATIVE_TOOLS),
+            'started':  started,
+            'hits':     hits,
+            'misses':   _counters['misses'],
+            'errors':   _counters['errors'],
+            'pending':  len(_registry),
+            'hit_rate': hits / started if started else 0.0,
+        }
@@ -22,9 +22,13 @@ class MultiRoleAgentState(TypedDict):
     # Phân tích của LLM
     llm_analysis: Optional[str]
     required_tools: Optional[List[Dict[str, Any]]]
+    # Id các lời gọi tool chạy trước song song với analyzer (agent_core/speculation.py)
+    speculation_id: Optional[str]
 
     # Kết quả tool
     tool_results: Annotated[List[Dict[str, Any]], add]
+    # Timing từng lời gọi tool: {tool_name, source, status, ms} (agent_core/tool_runner.py)
+    tool_timings: Optional[List[Dict[str, Any]]]
 
     # Câu trả lời cuối cùng
     final_answer: Optional[str]
\ No newline at end of file
@@ -0,0 +1,64 @@
+import RAG.agent_core.memory_summary as ms
+
+
+class _Conn:
+    def __init__(self, log):
+        self.log = log
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, stmt, params):
+        self.log.append((str(stmt), params))
+
+
+class _Engine:
+    def __init__(self):
+        self.log = []
+
+    def begin(self):
+        return _Conn(self.log)
+
+
+def test_format_history_prefers_stored_summaries():
+    rows = [
+        ('Làm CCCD ở đâu?', 'Tại công an xã.', 'Người dùng hỏi nơi làm CCCD; trả lời: công an xã.'),
+        ('Mất bao lâu?', 'Khoảng   7 ngày làm việc.', None),
+    ]
+    assert ms.format_history(rows) == (
+        'Người dùng hỏi nơi làm CCCD; trả lời: công an xã.\n'
+        'User: Mất bao lâu?\nAssistant: Khoảng 7 ngày làm việc.'
+    )
+    assert ms.format_history([('q' * 10, 'a', '')], limit=4) == 'User: qqqq…\nAssistant: a'
+
+
+def test_schedule_summarizes_once_and_stores(monkeypatch):
+    monkeypatch.setattr(ms, 'SUMMARY_ENABLED', True)
+    engine, calls = _Engine(), []
+
+    def summarize(user, bot):
+        calls.append((user, bot))
+        return ' tóm tắt '
+
+    fut = ms.schedule(42, 'hỏi', 'đáp', summarize=summarize, engine_factory=lambda: engine)
+    assert fut.result(timeout=2) == 'tóm tắt'
+    assert calls == [('hỏi', 'đáp')]
+    assert engine.log[0][1] == {'summary': 'tóm tắt', 'id': 42}
+
+
+def test_schedule_skips_and_swallows_errors(monkeypatch):
+    monkeypatch.setattr(ms, 'SUMMARY_ENABLED', True)
+    assert ms.schedule(None, 'q', 'a') is None
+    assert ms.schedule(1, 'q', '  ') is None
+
+    def boom(user, bot):
+        raise RuntimeError('quota')
+
+    assert ms.schedule(1, 'q', 'a', summarize=boom, engine_factory=_Engine).result(timeout=2) is None
+    engine = _Engine()
+    assert ms.schedule(1, 'q', 'a', summarize=lambda u, b: '',
+                       engine_factory=lambda: engine).result(timeout=2) is None
+    assert engine.log == []
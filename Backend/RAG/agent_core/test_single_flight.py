@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+from RAG.agent_core.single_flight import FlightTimeout, SingleFlight
+
+
+def test_concurrent_duplicates_run_once():
+    sf = SingleFlight()
+    calls, started, release = [], threading.Event(), threading.Event()
+
+    def pipeline():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return {'final_answer': 'đáp án'}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(sf.do('Hạn đổi CCCD?', pipeline)))
+    leader.start()
+    started.wait(2)
+    followers = [threading.Thread(target=lambda: results.append(sf.do('  hạn đổi   cccd? ', pipeline)))
+                 for _ in range(3)]
+    for t in followers:
+        t.start()
+    while sf.stats()['followers'] < 3:
+        pass
+    release.set()
+    for t in [leader] + followers:
+        t.join(2)
+    assert calls == [1]
+    assert results == [{'final_answer': 'đáp án'}] * 4
+    stats = sf.stats()
+    assert (stats['leaders'], stats['followers'], stats['in_flight']) == (1, 3, 0)
+
+    # flight đã xong → lần sau chạy lại (đi qua cache như thường)
+    sf.do('Hạn đổi CCCD?', pipeline)
+    assert len(calls) == 2
+
+
+def test_followers_share_token_stream_and_errors():
+    sf = SingleFlight()
+    flight, leader = sf.join('q')
+    assert leader
+    follower, is_leader = sf.join('Q')
+    assert follower is flight and not is_leader
+
+    flight.publish('Xin ')
+    got = []
+    reader = threading.Thread(target=lambda: got.extend(follower.stream(timeout=2)))
+    reader.start()
+    flight.publish('chào')
+    sf.finish(flight, {'intermediate': '{}'})
+    reader.join(2)
+    assert ''.join(got) == 'Xin chào'
+    assert follower.wait(0) == {'intermediate': '{}'}
+
+    failed, _ = sf.join('q2')
+    sf.fail(failed, RuntimeError('quota'))
+    with pytest.raises(RuntimeError):
+        list(failed.stream(timeout=1))
+
+
+def test_semantic_proximity_and_timeout():
+    sf = SingleFlight(sim_threshold=0.95)
+    a, leader = sf.join('thủ tục đổi cccd', embedding=[1.0, 0.0])
+    b, is_leader = sf.join('đổi căn cước làm sao', embedding=[0.99, 0.05])
+    c, c_leader = sf.join('đăng ký kết hôn', embedding=[0.0, 1.0])
+    assert leader and not is_leader and b is a
+    assert c_leader and c is not a
+    with pytest.raises(FlightTimeout):
+        a.wait(timeout=0.05)
+
+
+def test_scope_keeps_conversations_apart():
+    sf = SingleFlight(sim_threshold=0.95)
+    a, leader = sf.join('hạn đổi cccd', embedding=[1.0, 0.0], scope='s1')
+    b, b_leader = sf.join('hạn đổi cccd', embedding=[1.0, 0.0], scope='s2')
+    c, c_leader = sf.join('Hạn đổi CCCD', embedding=[0.99, 0.05], scope='s1')
+    assert leader and b_leader and b is not a
+    assert not c_leader and c is a
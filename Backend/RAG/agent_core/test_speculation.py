@@ -0,0 +1,59 @@
+import threading
+
+import RAG.agent_core.speculation as sp
+
+
+def _reset(monkeypatch):
+    monkeypatch.setattr(sp, 'SPECULATION_ENABLED', True)
+    monkeypatch.setattr(sp, 'SPECULATIVE_TOOLS', ('search_project_documents',))
+    monkeypatch.setattr(sp, '_counters', {'started': 0, 'hits': 0, 'misses': 0, 'errors': 0})
+    monkeypatch.setattr(sp, '_registry', type(sp._registry)())
+
+
+def test_matching_call_reuses_speculative_result(monkeypatch):
+    _reset(monkeypatch)
+    calls = []
+
+    def search(query):
+        calls.append(query)
+        return [f'doc for {query}']
+
+    spec_id = sp.start('Làm  căn cước', ['search_project_documents'], lambda name: search)
+    spec = sp.claim(spec_id)
+    fut = spec.take('search_project_documents', {'query': 'làm căn cước'})
+    assert fut.result(timeout=2) == ['doc for Làm  căn cước']
+    assert spec.discard() == 0
+    assert calls == ['Làm  căn cước']
+    stats = sp.stats()
+    assert (stats['started'], stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0, 1.0)
+
+
+def test_unused_call_is_discarded_and_counted_as_miss(monkeypatch):
+    _reset(monkeypatch)
+    release = threading.Event()
+    spec_id = sp.start('xin chào', ['search_project_documents'],
+                       lambda name: (lambda query: release.wait(2)))
+    spec = sp.claim(spec_id)
+    assert spec.take('search_project_documents', {'query': 'câu khác'}) is None
+    assert spec.discard() == 1
+    release.set()
+    assert sp.claim(spec_id) is None
+    assert sp.stats()['misses'] == 1 and sp.stats()['hit_rate'] == 0.0
+
+
+def test_nothing_started_when_tool_unavailable_or_disabled(monkeypatch):
+    _reset(monkeypatch)
+    assert sp.start('q', ['suggest_procedures'], lambda name: print) is None
+    monkeypatch.setattr(sp, 'SPECULATION_ENABLED', False)
+    assert sp.start('q', ['search_project_documents'], lambda name: print) is None
+    assert sp.stats()['started'] == 0
+
+
+def test_registry_is_bounded(monkeypatch):
+    _reset(monkeypatch)
+    monkeypatch.setattr(sp, '_MAX_PENDING', 2)
+    ids = [sp.start(f'q{i}', ['search_project_documents'], lambda name: (lambda query: query))
+           for i in range(3)]
+    assert sp.claim(ids[0]) is None
+    assert sp.claim(ids[2]) is not None
+    assert sp.stats()['misses'] == 1
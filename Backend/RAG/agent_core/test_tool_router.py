@@ -0,0 +1,72 @@
+import json
+
+import numpy as np
+
+import RAG.agent_core.tool_router as tr
+from RAG.agent_core.tool_router import ToolRouter, tools_from_analysis
+
+_S, _G = 'search_project_documents', 'suggest_procedures'
+
+
+def _router():
+    labels = [(_S,)] * 6 + [(_G, _S)] * 6 + [()] * 2
+    emb = np.array([[1, 0.1 * i, 0] for i in range(6)]
+                   + [[0, 1, 0.1 * i] for i in range(6)]
+                   + [[0, 0, 1]] * 2, dtype=np.float32)
+    return ToolRouter.train(labels, emb)
+
+
+def test_tools_from_analysis_parses_stored_output():
+    raw = '```json\n{"required_tools": [{"tool_name": "suggest_procedures"}, {"tool_name": "search_project_documents"}]}\n```'
+    assert tools_from_analysis(raw) == (_S, _G)
+    assert tools_from_analysis(json.dumps(json.dumps({'required_tools': []}))) == ()
+    assert tools_from_analysis('{"mode": "document_suggestion"}') is None
+    assert tools_from_analysis('{"router": "local", "required_tools": []}') is None
+    assert tools_from_analysis('not json') is None
+
+
+def test_predict_is_confident_only_near_a_centroid():
+    router = _router()
+    label, best, _ = router.predict([1, 0.2, 0])
+    assert label == (_S,) and best > 0.9
+    assert router.predict([1, 1.2, 0.25])[0] is None                  # giữa hai nhãn → margin nhỏ
+    assert router.predict([0, 0, 1])[0] is None                  # nhãn thiếu mẫu (2 < 5)
+    assert router.predict([1, 0])[0] is None                     # sai số chiều
+
+
+def test_save_load_roundtrip(tmp_path):
+    path = tmp_path / 'router.npz'
+    _router().save(path)
+    loaded = ToolRouter.load(path)
+    assert loaded.labels == [(), (_S,), (_S, _G)] and loaded.counts == [2, 6, 6]
+    assert loaded.predict([0, 1, 0.3])[0] == (_S, _G)
+
+
+def test_route_builds_required_tools_or_falls_back(monkeypatch):
+    monkeypatch.setattr(tr, '_router', _router())
+    monkeypatch.setattr(tr, 'ROUTER_ENABLED', True)
+    tools = tr.route('làm giấy khai sinh', [0, 1, 0.2], [_S, _G])
+    assert tools == [{'tool_name': _S, 'params': {'query': 'làm giấy khai sinh'}, 'available': True},
+                     {'tool_name': _G, 'params': {'query': 'làm giấy khai sinh'}, 'available': True}]
+    assert tr.route('q', [0, 1, 0.2], [_S]) is None              # tool không có trong role
+    assert tr.route('q', [1, 1.2, 0.25], [_S, _G]) is None
+    assert tr.route('q', None, [_S, _G]) is None
+
+
+def test_warm_router_builds_once_and_is_non_fatal(monkeypatch):
+    import RAG.tools.rag as rag
+
+    calls = []
+    monkeypatch.setattr(tr, '_router', None)
+    monkeypatch.setattr(tr, 'ROUTER_ENABLED', True)
+    monkeypatch.setattr(tr, 'ROUTER_PATH', tr.Path('/nonexistent/router.npz'))
+    monkeypatch.setattr(rag, 'get_embeddings', lambda texts: calls.append(len(texts)) or
+                        [[1.0, float(i % 3), 0.0] for i, _ in enumerate(texts)])
+    assert tr.warm_router() and tr.warm_router()
+    assert len(calls) == 1                                     # seed chỉ encode một lần
+
+    monkeypatch.setattr(tr, '_router', None)
+    monkeypatch.setattr(rag, 'get_embeddings', lambda texts: (_ for _ in ()).throw(RuntimeError('no model')))
+    assert tr.warm_router() is False
+    monkeypatch.setattr(tr, 'ROUTER_ENABLED', False)
+    assert tr.warm_router() is False
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from RAG.agent_core.tool_runner import run_tools, tool_timeouts
+
+
+def test_tools_run_in_parallel_and_keep_order():
+    barrier = threading.Barrier(2, timeout=2)
+
+    def a(query):
+        barrier.wait()      # chỉ qua được khi b chạy đồng thời
+        return f'a:{query}'
+
+    def b(query):
+        barrier.wait()
+        return f'b:{query}'
+
+    results, timings = run_tools(
+        [{'tool_name': 'a', 'params': {'query': 'x'}},
+         {'tool_name': 'b', 'params': {'query': 'y'}}],
+        {'a': a, 'b': b},
+    )
+    assert [r['result'] for r in results] == ['a:x', 'b:y']
+    assert [(t['tool_name'], t['status'], t['source']) for t in timings] == [
+        ('a', 'ok', 'executed'), ('b', 'ok', 'executed'),
+    ]
+
+
+def test_slow_tool_times_out_and_others_are_kept():
+    release = threading.Event()
+
+    def slow(query):
+        release.wait(2)
+        return 'late'
+
+    def boom(query):
+        raise RuntimeError('db down')
+
+    t0 = time.perf_counter()
+    results, timings = run_tools(
+        [{'tool_name': 'slow', 'params': {'query': 'q'}},
+         {'tool_name': 'fast', 'params': {'query': 'q'}},
+         {'tool_name': 'boom', 'params': {'query': 'q'}},
+         {'tool_name': 'nope', 'params': {}}],
+        {'slow': slow, 'fast': lambda query: 'ok', 'boom': boom},
+        timeouts={'slow': 0.1},
+    )
+    release.set()
+    assert time.perf_counter() - t0 < 1.5
+    assert [r['tool_name'] for r in results] == ['fast', 'boom', 'nope']
+    assert results[1]['result'].startswith('❌') and results[2]['result'] is None
+    assert [t['status'] for t in timings] == ['timeout', 'ok', 'error', 'missing']
+
+
+def test_speculative_result_is_reused():
+    class Spec:
+        def __init__(self):
+            from concurrent.futures import Future
+            self.fut = Future()
+            self.fut.set_result(['cached'])
+
+        def take(self, name, params):
+            fut, self.fut = self.fut, None
+            return fut
+
+    results, timings = run_tools(
+        [{'tool_name': 'search', 'params': {'query': 'q'}}],
+        {'search': lambda query: ['fresh']},
+        spec=Spec(),
+    )
+    assert results[0]['result'] == ['cached']
+    assert timings[0]['source'] == 'speculative' and timings[0]['ms'] < 50
+
+
+def test_tool_timeouts_reads_yaml_field():
+    tools = [{'name': 'a', 'timeout': 3}, {'name': 'b', 'timeout': None},
+             {'name': 'c', 'timeout': 'x'}, {'name': 'd'}]
+    assert tool_timeouts(tools) == {'a': 3.0}
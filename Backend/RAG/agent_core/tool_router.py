@@ -0,0 +1,288 @@
+"""
+Local tool router — chọn required_tools không cần gọi Gemini
+=============================================================
+
+task_analyzer gửi một request Gemini chỉ để nhận JSON kiểu
+`{"required_tools": [{"tool_name": "search_project_documents", ...}]}`. Với
+phần lớn câu hỏi, lựa chọn này lặp lại theo vài mẫu cố định, nên router này
+phân loại câu hỏi bằng nearest-centroid trên embedding đã có sẵn (cache_check
+đã tính `query_embedding`) — không thêm lần encode hay round-trip nào.
+
+  • Nhãn = tập tool được chọn, ví dụ "search_project_documents",
+    "search_project_documents+suggest_procedures", "" (không dùng tool).
+  • Centroid = trung bình embedding (đã chuẩn hoá) của các câu hỏi cùng nhãn,
+    học từ lịch sử query_results.retrieved_docs (output của task_analyzer)
+    bằng scripts/train_tool_router.py; khi chưa có artefact dùng bộ seed nhỏ.
+  • Chỉ trả quyết định khi tự tin: cosine ≥ RAG_ROUTER_MIN_SIM, cách nhãn thứ
+    hai ≥ RAG_ROUTER_MARGIN và nhãn có đủ mẫu. Ngược lại → None (dùng Gemini).
+
+Tham số cấu hình (biến môi trường):
+  RAG_LOCAL_ROUTER        : '1' bật (mặc định) / '0' tắt
+  RAG_ROUTER_PATH         : đường dẫn artefact .npz
+  RAG_ROUTER_MIN_SIM      : float, default 0.60
+  RAG_ROUTER_MARGIN       : float, default 0.05
+  RAG_ROUTER_MIN_SUPPORT  : int,   default 5
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+
+logger = get_logger('rag.router')
+
+_RAG_DIR = Path(__file__).parent.parent
+
+ROUTER_ENABLED:     bool  = os.getenv('RAG_LOCAL_ROUTER', '1').strip() not in ('0', 'false', 'no')
+ROUTER_PATH:        Path  = Path(os.getenv('RAG_ROUTER_PATH', str(_RAG_DIR / 'models' / 'tool_router.npz')))
+ROUTER_MIN_SIM:     float = float(os.getenv('RAG_ROUTER_MIN_SIM', '0.60'))
+ROUTER_MARGIN:      float = float(os.getenv('RAG_ROUTER_MARGIN', '0.05'))
+ROUTER_MIN_SUPPORT: int   = int(os.getenv('RAG_ROUTER_MIN_SUPPORT', '5'))
+
+_SEARCH  = 'search_project_documents'
+_SUGGEST = 'suggest_procedures'
+
+# Bộ seed khi chưa train từ lịch sử — mỗi nhãn đủ ROUTER_MIN_SUPPORT mẫu
+_SEED_EXAMPLES: Dict[Tuple[str, ...], List[str]] = {
+    (_SEARCH,): [
+        'Lệ phí cấp lại thẻ căn cước là bao nhiêu?',
+        'Thời gian giải quyết hồ sơ đăng ký kết hôn mất bao lâu?',
+        'Mất giấy phép lái xe thì phải làm sao?',
+        'Trẻ em dưới 14 tuổi có cần làm căn cước không?',
+        'Quy định về đăng ký tạm trú cho người thuê trọ như thế nào?',
+        'Mức phạt khi không đăng ký tạm trú là bao nhiêu?',
+        'Bảo hiểm y tế hộ gia đình đóng bao nhiêu một năm?',
+        'Sổ đỏ và sổ hồng khác nhau thế nào?',
+    ],
+    (_SEARCH, _SUGGEST): [
+        'Tôi muốn làm giấy khai sinh cho con thì cần thủ tục gì?',
+        'Làm hộ chiếu cần những giấy tờ gì và nộp ở đâu?',
+        'Thủ tục đăng ký kết hôn gồm những bước nào?',
+        'Tôi muốn đăng ký thường trú cho gia đình thì làm thế nào?',
+        'Xin cấp giấy phép xây dựng nhà ở cần hồ sơ gì?',
+        'Thủ tục sang tên sổ đỏ khi mua bán đất?',
+        'Muốn đăng ký kinh doanh hộ cá thể thì làm thủ tục gì?',
+        'Đổi giấy phép lái xe hết hạn cần làm thủ tục gì?',
+    ],
+    (): [
+        'Xin chào',
+        'Cảm ơn bạn nhiều',
+        'Bạn là ai?',
+        'Chào buổi sáng',
+        'Ok cảm ơn',
+        'Tạm biệt',
+    ],
+}
+
+
+def label_of(tools: Iterable[str]) -> Tuple[str, ...]:
+    return tuple(sorted({t for t in tools if t}))
+
+
+def tools_from_analysis(raw: Any) -> Optional[Tuple[str, ...]]:
+    """
+    Trích nhãn (tập tool) từ output task_analyzer đã lưu ở query_results.retrieved_docs.
+    None nếu không parse được (không dùng làm mẫu train).
+    """
+    if isinstance(raw, str):
+        text = re.sub(r'^```[a-zA-Z]*\s*|\s*```$', '', raw.strip())
+        try:
+            raw = json.loads(text)
+            if isinstance(raw, str):               # retrieved_docs có thể bị json.dumps 2 lần
+                raw = json.loads(re.sub(r'^```[a-zA-Z]*\s*|\s*```$', '', raw.strip()))
+        except (json.JSONDecodeError, TypeError):
+            return None
+    if not isinstance(raw, dict) or 'required_tools' not in raw:
+        return None
+    if raw.get('router') == 'local':               # không tự học lại từ chính router
+        return None
+    names = []
+    for item in raw.get('required_tools') or []:
+        if isinstance(item, str):
+            names.append(item)
+        elif isinstance(item, dict):
+            names.append(item.get('tool_name') or item.get('name') or item.get('tool') or '')
+    return label_of(names)
+
+
+class ToolRouter:
+    """Nearest-centroid classifier trên embedding câu hỏi (đã chuẩn hoá)."""
+
+    def __init__(self, labels: Sequence[Tuple[str, ...]], centroids: np.ndarray, counts: Sequence[int]) -> None:
+        self.labels    = [tuple(l) for l in labels]
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.counts    = [int(c) for c in counts]
+
+    # ── train / persist ───────────────────────────────────────────────────────
+
+    @classmethod
+    def train(cls, labels: Sequence[Tuple[str, ...]], embeddings: np.ndarray) -> 'ToolRouter':
+        labels = [label_of(l) for l in labels]
+        emb = np.asarray(embeddings, dtype=np.float32)
+        emb = emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+        uniq = sorted(set(labels))
+        lab_arr = np.array(['+'.join(l) for l in labels])
+        centroids, counts = [], []
+        for label in uniq:
+            rows = emb[lab_arr == '+'.join(label)]
+            c = rows.mean(axis=0)
+            centroids.append(c / max(float(np.linalg.norm(c)), 1e-12))
+            counts.append(len(rows))
+        return cls(uniq, np.stack(centroids) if centroids else np.zeros((0, emb.shape[1] if emb.ndim == 2 else 0)), counts)
+
+    def save(self, path: Path = ROUTER_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.stem + '.tmp.npz')
+        np.savez(tmp, labels=np.array(['+'.join(l) for l in self.labels]),
+                 centroids=self.centroids, counts=np.array(self.counts))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path = ROUTER_PATH) -> Optional['ToolRouter']:
+        path = Path(path)
+        if not path.is_file():
+            return None
+        try:
+            with np.load(path) as data:
+                labels = [label_of(str(l).split('+')) for l in data['labels']]
+                return cls(labels, data['centroids'], data['counts'].tolist())
+        except Exception as exc:
+            logger.warning('[router] Không nạp được %s: %s', path, exc)
+            return None
+
+    # ── predict ───────────────────────────────────────────────────────────────
+
+    def predict(self, embedding: Sequence[float]) -> Tuple[Optional[Tuple[str, ...]], float, float]:
+        """Trả về (nhãn | None nếu không tự tin, cosine tốt nhất, margin)."""
+        if not len(self.labels):
+            return None, 0.0, 0.0
+        q = np.asarray(embedding, dtype=np.float32)
+        if q.shape[0] != self.centroids.shape[1]:
+            return None, 0.0, 0.0
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        sims = self.centroids @ q
+        order = np.argsort(-sims)
+        best = float(sims[order[0]])
+        margin = best - float(sims[order[1]]) if len(order) > 1 else best
+        idx = int(order[0])
+        confident = (
+            best >= ROUTER_MIN_SIM
+            and margin >= ROUTER_MARGIN
+            and self.counts[idx] >= ROUTER_MIN_SUPPORT
+        )
+        return (self.labels[idx] if confident else None), best, margin
+
+
+# ── training from history ─────────────────────────────────────────────────────
+
+def history_examples(engine, limit: int = 20000) -> List[Tuple[str, Tuple[str, ...]]]:
+    """(câu hỏi, nhãn) từ query_results — chỉ các dòng có output task_analyzer."""
+    from sqlalchemy import text  # type: ignore
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT query_text, retrieved_docs
+            FROM public.query_results
+            WHERE retrieved_docs LIKE '%required_tools%'
+            ORDER BY timestamp DESC
+            LIMIT :limit
+        """), {'limit': limit}).fetchall()
+    out = []
+    for query, docs in rows:
+        label = tools_from_analysis(docs)
+        if query and label is not None:
+            out.append((str(query), label))
+    return out
+
+
+def seed_examples() -> List[Tuple[str, Tuple[str, ...]]]:
+    return [(q, label) for label, qs in _SEED_EXAMPLES.items() for q in qs]
+
+
+def train_router(
+    examples: List[Tuple[str, Tuple[str, ...]]],
+    embed_many: Callable[[List[str]], List[List[float]]],
+) -> ToolRouter:
+    vectors = embed_many([q for q, _ in examples])
+    keep = [i for i, v in enumerate(vectors) if v]
+    return ToolRouter.train([examples[i][1] for i in keep], np.asarray([vectors[i] for i in keep]))
+
+
+# ── singleton ─────────────────────────────────────────────────────────────────
+
+_router: Optional[ToolRouter] = None
+_router_lock = threading.Lock()
+_stats = {'local': 0, 'fallback': 0}
+
+
+def get_router() -> Optional[ToolRouter]:
+    """Artefact đã train nếu có, nếu không thì router từ bộ seed (encode một lần)."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                router = ToolRouter.load(ROUTER_PATH)
+                if router is None:
+                    from ..tools.rag import get_embeddings
+                    router = train_router(seed_examples(), get_embeddings)
+                    logger.info('[router] Dùng seed router (%d nhãn)', len(router.labels))
+                else:
+                    logger.info('[router] Nạp %s (%d nhãn)', ROUTER_PATH, len(router.labels))
+                _router = router
+    return _router
+
+
+def warm_router() -> bool:
+    """
+    Dựng router ngay lúc khởi động (server.py gọi trên thread nền) để request
+    đầu tiên không phải chờ encode bộ seed. Non-fatal; True nếu đã sẵn sàng.
+    """
+    if not ROUTER_ENABLED:
+        return False
+    try:
+        return get_router() is not None
+    except Exception as exc:
+        logger.warning('[router] warm-up lỗi (non-fatal): %s', exc)
+        return False
+
+
+def route(
+    question: str,
+    embedding: Optional[Sequence[float]],
+    available: Iterable[str],
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    required_tools theo router cục bộ, hoặc None nếu phải hỏi Gemini.
+    Mọi tool được chọn nhận `query` = câu hỏi gốc (giống output task_analyzer).
+    """
+    if not ROUTER_ENABLED or not embedding:
+        return None
+    try:
+        router = get_router()
+        label, best, margin = router.predict(embedding) if router else (None, 0.0, 0.0)
+    except Exception as exc:
+        logger.debug('[router] lỗi (non-fatal): %s', exc)
+        label, best, margin = None, 0.0, 0.0
+
+    available = set(available)
+    if label is None or not set(label).issubset(available):
+        _stats['fallback'] += 1
+        logger.debug('[router] không chắc (cos=%.3f, margin=%.3f) → Gemini', best, margin)
+        return None
+
+    _stats['local'] += 1
+    logger.info('[router] local → %s (cos=%.3f, margin=%.3f)', list(label) or '[]', best, margin)
+    return [{'tool_name': name, 'params': {'query': question}, 'available': True} for name in label]
+
+
+def router_stats() -> Dict[str, Any]:
+    total = _stats['local'] + _stats['fallback']
+    return {**_stats, 'local_rate': _stats['local'] / total if total else 0.0}
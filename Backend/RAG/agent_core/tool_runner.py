@@ -0,0 +1,127 @@
+"""
+Tool runner — chạy song song các lời gọi tool với deadline theo từng tool
+=========================================================================
+
+tool_executor trước đây gọi lần lượt từng tool trong required_tools, không có
+timeout: plan nhiều tool cộng dồn latency và một tool chậm treo cả request.
+Module này gửi mọi lời gọi (độc lập với nhau — params do analyzer điền sẵn)
+vào một thread pool có giới hạn rồi chờ từng kết quả tới deadline của nó:
+
+  deadline(tool) = lúc bắt đầu + timeout(tool)
+  timeout(tool)  = trường `timeout` (giây) trong prompt/tool.yaml,
+                   mặc định RAG_TOOL_TIMEOUT_SECS
+
+Tool quá hạn bị bỏ khỏi kết quả (future chưa chạy thì huỷ; thread đang chạy
+không thể dừng nên kết quả muộn bị bỏ qua) — build_synthesis_prompt nhận các
+tool đã xong. Lời gọi đã được speculation khởi chạy trước được dùng lại.
+
+Mỗi lời gọi sinh một bản ghi timing:
+  {tool_name, source: executed|speculative, status: ok|error|timeout|missing, ms}
+  ms = thời gian từ lúc tool_executor bắt đầu tới khi tool xong (0 nếu
+       speculation đã xong trước đó — latency bị che hoàn toàn).
+
+Tham số cấu hình (biến môi trường):
+  RAG_TOOL_WORKERS        : int,   default 8  — số thread chạy tool
+  RAG_TOOL_TIMEOUT_SECS   : float, default 10 — timeout mặc định mỗi tool
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+
+logger = get_logger('rag.tools')
+
+TOOL_WORKERS: int   = int(os.getenv('RAG_TOOL_WORKERS', '8'))
+TOOL_TIMEOUT: float = float(os.getenv('RAG_TOOL_TIMEOUT_SECS', '10'))
+
+_pool = ThreadPoolExecutor(max_workers=max(1, TOOL_WORKERS), thread_name_prefix='rag-tool')
+
+
+def tool_timeouts(tools: Optional[List[Dict[str, Any]]]) -> Dict[str, float]:
+    """Đọc `timeout` (giây) của từng tool từ danh sách tool.yaml đã chuẩn hoá."""
+    out: Dict[str, float] = {}
+    for t in tools or []:
+        if not isinstance(t, dict) or not t.get('name'):
+            continue
+        try:
+            if t.get('timeout') is not None:
+                out[t['name']] = float(t['timeout'])
+        except (TypeError, ValueError):
+            logger.debug(f"[tools] timeout không hợp lệ cho {t.get('name')}: {t.get('timeout')!r}")
+    return out
+
+
+def run_tools(
+    required_tools: List[Dict[str, Any]],
+    registry: Mapping[str, Callable[..., Any]],
+    timeouts: Optional[Mapping[str, float]] = None,
+    spec: Any = None,
+    default_timeout: float = TOOL_TIMEOUT,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Chạy required_tools song song. Trả về (tool_results, timings), cả hai giữ
+    thứ tự của required_tools; tool quá hạn không có trong tool_results.
+    `spec`: Speculation (agent_core/speculation.py) hoặc None.
+    """
+    t0 = time.perf_counter()
+    timeouts = timeouts or {}
+    done_at: Dict[int, float] = {}
+    jobs: List[Tuple[str, Dict[str, Any], Optional[Future], str]] = []
+
+    for tool_info in required_tools or []:
+        tool_name = tool_info.get("tool_name") or tool_info.get("name")
+        params = tool_info.get("params", {})
+        if not tool_name:
+            continue
+        tool_func = registry.get(tool_name)
+        if not tool_func:
+            jobs.append((tool_name, params, None, 'executed'))
+            continue
+
+        # Dùng lại kết quả speculation nếu analyzer chọn đúng lời gọi đã đoán
+        fut = spec.take(tool_name, params) if spec is not None else None
+        source = 'speculative'
+        if fut is None:
+            fut, source = _pool.submit(tool_func, **params), 'executed'
+        fut.add_done_callback(lambda f: done_at.setdefault(id(f), time.perf_counter()))
+        jobs.append((tool_name, params, fut, source))
+
+    results: List[Dict[str, Any]] = []
+    timings: List[Dict[str, Any]] = []
+    for tool_name, params, fut, source in jobs:
+        timing = {"tool_name": tool_name, "source": source, "status": "ok", "ms": 0.0}
+        timings.append(timing)
+        if fut is None:
+            timing["status"] = "missing"
+            results.append({"tool_name": tool_name, "params": params, "result": None})
+            continue
+
+        timeout = timeouts.get(tool_name, default_timeout)
+        remaining = max(0.0, t0 + timeout - time.perf_counter())
+        try:
+            result = fut.result(timeout=remaining)
+        except FutureTimeout:
+            fut.cancel()
+            timing["status"] = "timeout"
+            timing["ms"] = round(timeout * 1000, 1)
+            logger.warning(f'[tools] {tool_name} quá hạn {timeout:.1f}s — bỏ qua kết quả')
+            continue
+        except Exception as e:
+            timing["status"] = "error"
+            result = f"❌ Lỗi khi thực thi {tool_name}: {str(e)}"
+
+        finished = done_at.get(id(fut), time.perf_counter())
+        timing["ms"] = round(max(0.0, finished - t0) * 1000, 1)
+        results.append({"tool_name": tool_name, "params": params, "result": result})
+
+    if timings:
+        logger.debug('[tools] ' + ', '.join(
+            f"{t['tool_name']}={t['status']}/{t['source']} {t['ms']}ms" for t in timings
+        ))
+    return results, timings
@@ -0,0 +1,382 @@
+"""
+CAG — Pre-warm SemanticCache từ lịch sử hỏi đáp
+================================================
+
+Sau mỗi lần deploy SemanticCache bắt đầu rỗng (hoặc chỉ còn top
+RAG_CACHE_MAX_SIZE entry nạp lại từ PostgreSQL) và đầy dần theo từng miss —
+giờ đầu tiên hit rate gần 0%. Job này dựng sẵn cache từ query_results
+(mỗi lượt chat được `_log_chat` ghi cả câu hỏi lẫn câu trả lời):
+
+  1. Đọc các cặp (câu hỏi, câu trả lời) trong RAG_PREWARM_DAYS ngày gần nhất,
+     gộp các câu trùng khớp sau chuẩn hoá (NFC + khoảng trắng + casefold).
+  2. Embed các câu khác nhau, gom cụm greedy theo cosine ≥ RAG_PREWARM_SIM
+     (mặc định = ngưỡng hit của cache): duyệt theo tần suất giảm dần, câu
+     nào không đủ gần leader nào thì thành leader mới. Leader (cách hỏi phổ
+     biến nhất) là câu đại diện; câu trả lời = bản mới nhất trong cụm.
+  3. Cụm có ≥ RAG_PREWARM_MIN_COUNT lượt hỏi được đưa vào cache (nhiều nhất
+     RAG_PREWARM_LIMIT cụm, lớn trước). Cụm đã có entry gần đủ ngưỡng trong
+     cache thì bỏ qua (`SemanticCache.peek` — không làm lệch thống kê hit).
+  4. Câu trả lời cũ hơn RAG_PREWARM_STALE_HOURS không nạp nguyên trạng: chỉ
+     được sinh lại qua pipeline (Gemini) trong khung giờ thấp điểm
+     RAG_PREWARM_OFFPEAK, hoặc khi chạy CLI với --refresh.
+
+Chạy:
+  • CLI:    python -X utf8 -m scripts.prewarm_cache   (từ Backend/)
+  • Nền:    server.py khởi động `run_prewarm_loop` — một lượt sau
+            RAG_PREWARM_DELAY_SECS, sau đó mỗi RAG_PREWARM_INTERVAL_HOURS giờ
+            và luôn thức dậy đúng đầu khung RAG_PREWARM_OFFPEAK để sinh lại
+            câu trả lời cũ (tối đa một lần mỗi khung). Mọi worker gunicorn
+            đều gọi, nhưng chỉ process giữ được flock RAG_PREWARM_LOCK chạy;
+            entry tới các worker khác qua shared tier (RAG_CACHE_SHARED_DIR),
+            nên không bật shared tier thì thread nền bỏ qua — dùng CLI (ghi
+            PostgreSQL, worker nạp lại khi khởi động).
+
+Tham số cấu hình (biến môi trường):
+  RAG_PREWARM                  : '1' bật thread nền (mặc định) / '0' tắt
+  RAG_PREWARM_DAYS             : int,   default 30   — cửa sổ lịch sử (ngày)
+  RAG_PREWARM_SIM              : float, default = RAG_CACHE_THRESHOLD — ngưỡng gom cụm
+  RAG_PREWARM_MIN_COUNT        : int,   default 2    — số lượt hỏi tối thiểu của một cụm
+  RAG_PREWARM_LIMIT            : int,   default RAG_CACHE_MAX_SIZE/2 — số cụm tối đa được nạp
+  RAG_PREWARM_STALE_HOURS      : float, default 72   — tuổi tối đa của câu trả lời nạp nguyên trạng
+  RAG_PREWARM_OFFPEAK          : str,   default '1-5' — khung giờ thấp điểm (giờ VN, [đầu, cuối))
+  RAG_PREWARM_DELAY_SECS       : float, default 30   — trễ lượt đầu sau khi server khởi động
+  RAG_PREWARM_INTERVAL_HOURS   : float, default 6    — chu kỳ chạy lại
+  RAG_PREWARM_LOCK             : str,   default <tmp>/rag_prewarm.lock — file khoá chọn process chạy
+"""
+
+import os
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows — không có flock, process nào gọi cũng chạy
+    fcntl = None  # type: ignore
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+from ..tools.embedding_service import normalize_text
+from .semantic_cache import CACHE_MAX_SIZE, CACHE_THRESHOLD
+
+log = get_logger('rag.cache')
+
+PREWARM_ENABLED:  bool  = os.getenv('RAG_PREWARM', '1').strip() not in ('0', 'false', 'no')
+PREWARM_DAYS:     int   = int(os.getenv('RAG_PREWARM_DAYS', '30'))
+PREWARM_SIM:      float = float(os.getenv('RAG_PREWARM_SIM', str(CACHE_THRESHOLD)))
+PREWARM_MIN:      int   = int(os.getenv('RAG_PREWARM_MIN_COUNT', '2'))
+PREWARM_LIMIT:    int   = int(os.getenv('RAG_PREWARM_LIMIT', str(max(1, CACHE_MAX_SIZE // 2))))
+STALE_HOURS:      float = float(os.getenv('RAG_PREWARM_STALE_HOURS', '72'))
+OFFPEAK:          str   = os.getenv('RAG_PREWARM_OFFPEAK', '1-5')
+PREWARM_DELAY:    float = float(os.getenv('RAG_PREWARM_DELAY_SECS', '30'))
+PREWARM_INTERVAL: float = float(os.getenv('RAG_PREWARM_INTERVAL_HOURS', '6'))
+PREWARM_LOCK:     str   = os.getenv('RAG_PREWARM_LOCK', '').strip() or \
+    os.path.join(tempfile.gettempdir(), 'rag_prewarm.lock')
+
+_HISTORY_LIMIT   = 20000
+_MIN_ANSWER_CHARS = 20
+_VN_TZ = timezone(timedelta(hours=7))
+
+
+@dataclass
+class Cluster:
+    """Một nhóm câu hỏi gần nhau; `question` là câu đại diện."""
+    question:  str
+    answer:    str
+    age_hours: float          # tuổi câu trả lời mới nhất trong cụm
+    count:     int            # tổng số lượt hỏi của cả cụm
+    embedding: List[float]
+
+
+# ── history ───────────────────────────────────────────────────────────────────
+
+def _default_engine():
+    from RAG.connect_SQL.connect_SQL import connect_sql
+    return connect_sql()
+
+
+def _usable(answer: Optional[str]) -> bool:
+    answer = (answer or '').strip()
+    return len(answer) >= _MIN_ANSWER_CHARS and not answer.startswith('❌')
+
+
+def history_rows(engine: Any = None, days: int = PREWARM_DAYS,
+                 limit: int = _HISTORY_LIMIT) -> List[Tuple[str, str, float]]:
+    """(câu hỏi, câu trả lời, tuổi theo giờ) mới nhất trước, từ query_results."""
+    from sqlalchemy import text  # type: ignore
+    engine = engine or _default_engine()
+    if engine is None:
+        return []
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT query_text, response_text,
+                   EXTRACT(EPOCH FROM (NOW() - timestamp)) / 3600.0 AS age_hours
+            FROM query_results
+            WHERE timestamp >= NOW() - INTERVAL '{int(days)} days'
+              AND query_text IS NOT NULL AND response_text IS NOT NULL
+            ORDER BY timestamp DESC
+            LIMIT :limit
+        """), {'limit': int(limit)}).fetchall()
+    return [(q, a, max(0.0, float(age or 0.0))) for q, a, age in rows]
+
+
+# ── clustering ────────────────────────────────────────────────────────────────
+
+def _unit_rows(vectors: Sequence[Sequence[float]]) -> np.ndarray:
+    mat = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def cluster_history(
+    rows: Iterable[Tuple[str, str, float]],
+    embed_many: Callable[[List[str]], List[List[float]]],
+    sim: float = PREWARM_SIM,
+    min_count: int = PREWARM_MIN,
+) -> List[Cluster]:
+    """
+    rows: (câu hỏi, câu trả lời, tuổi giờ) — mới nhất trước.
+    Trả về các cụm có ≥ min_count lượt hỏi, lớn trước.
+    """
+    # 1. Gộp trùng khớp: đếm số lượt, giữ câu trả lời mới nhất dùng được
+    groups: Dict[str, List[Any]] = {}          # key → [question, answer, age, count]
+    for question, answer, age in rows:
+        key = normalize_text(question or '').casefold()
+        if not key:
+            continue
+        g = groups.get(key)
+        if g is None:
+            g = groups[key] = [normalize_text(question), None, None, 0]
+        g[3] += 1
+        if g[1] is None and _usable(answer):
+            g[1], g[2] = answer.strip(), age
+    if not groups:
+        return []
+
+    # 2. Gom cụm greedy theo tần suất giảm dần; leader = cách hỏi phổ biến nhất
+    ordered = sorted(groups.values(), key=lambda g: -g[3])
+    embedded = [(g, v) for g, v in zip(ordered, embed_many([g[0] for g in ordered])) if len(v)]
+    if not embedded:
+        return []
+    ordered, vectors = [g for g, _ in embedded], [v for _, v in embedded]
+    units = _unit_rows(vectors)
+
+    leaders = np.empty((0, units.shape[1]), dtype=np.float32)
+    clusters: List[List[Any]] = []             # [leader group, count, answer, age, embedding]
+    for g, u, v in zip(ordered, units, vectors):
+        if len(clusters):
+            scores = leaders @ u
+            best = int(np.argmax(scores))
+            if scores[best] >= sim:
+                c = clusters[best]
+                c[1] += g[3]
+                if g[1] is not None and (c[2] is None or g[2] < c[3]):
+                    c[2], c[3] = g[1], g[2]
+                continue
+        leaders = np.vstack([leaders, u[None, :]])
+        clusters.append([g, g[3], g[1], g[2], list(map(float, v))])
+
+    out = [
+        Cluster(question=g[0], answer=answer, age_hours=float(age), count=count, embedding=emb)
+        for g, count, answer, age, emb in clusters
+        if count >= min_count and answer is not None
+    ]
+    out.sort(key=lambda c: -c.count)
+    return out
+
+
+# ── warm-up ───────────────────────────────────────────────────────────────────
+
+def _parse_window(window: str) -> Optional[Tuple[int, int]]:
+    try:
+        start, end = (int(x) % 24 for x in window.split('-', 1))
+    except (ValueError, AttributeError):
+        return None
+    return (start, end) if start != end else None
+
+
+def in_offpeak(now: Optional[datetime] = None, window: str = OFFPEAK) -> bool:
+    """window 'a-b' (giờ VN, [a, b)); hỗ trợ khung qua nửa đêm, vd '22-5'."""
+    bounds = _parse_window(window)
+    if bounds is None:
+        return False
+    start, end = bounds
+    hour = (now or datetime.now(_VN_TZ)).hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def offpeak_start(now: Optional[datetime] = None, window: str = OFFPEAK) -> Optional[datetime]:
+    """
+    Đầu khung thấp điểm đang diễn ra (≤ now) hoặc khung kế tiếp (> now);
+    None nếu window không hợp lệ.
+    """
+    bounds = _parse_window(window)
+    if bounds is None:
+        return None
+    now = now or datetime.now(_VN_TZ)
+    start = now.replace(hour=bounds[0], minute=0, second=0, microsecond=0)
+    if in_offpeak(now, window):
+        return start if start <= now else start - timedelta(days=1)
+    return start if start > now else start + timedelta(days=1)
+
+
+def acquire_scheduler_lock(path: str = PREWARM_LOCK) -> Optional[Any]:
+    """
+    flock(LOCK_EX | LOCK_NB) trên `path`; trả về file đang giữ khoá (giữ suốt
+    đời process) hoặc None nếu process khác đã giữ. Không có fcntl: luôn được.
+    """
+    if fcntl is None:
+        return open(os.devnull, 'rb')
+    try:
+        f = open(path, 'a+b')
+    except OSError as exc:
+        log.warning(f'[prewarm] không mở được {path}: {exc} — vẫn chạy')
+        return open(os.devnull, 'rb')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def default_answer_fn() -> Callable[[str], str]:
+    """Sinh lại câu trả lời qua pipeline đầy đủ, bỏ qua bước cache."""
+    from RAG.agent_core.graph import MultiRoleAgentGraph  # lazy — kéo theo LangGraph + Gemini
+    from RAG.agent_core.node import (
+        llm_response, role_manager, task_analyzer, tool_executor, user_input,
+    )
+    graph = MultiRoleAgentGraph()
+
+    def _answer(question: str) -> str:
+        state = graph.create_new_state(question, '')
+        for node in (user_input, role_manager, task_analyzer, tool_executor, llm_response):
+            node(state)
+        return (state.get('final_answer') or '').strip()
+
+    return _answer
+
+
+def prewarm(
+    cache: Any,
+    clusters: Sequence[Cluster],
+    answer_fn: Optional[Callable[[str], str]] = None,
+    refresh: bool = False,
+    stale_hours: float = STALE_HOURS,
+    limit: int = PREWARM_LIMIT,
+) -> Dict[str, int]:
+    """
+    Nạp các cụm vào cache. refresh=True (và có answer_fn): câu trả lời cũ
+    được sinh lại; ngược lại cụm có câu trả lời cũ bị hoãn tới lượt sau.
+    """
+    stats = {'clusters': len(clusters), 'stored': 0, 'refreshed': 0,
+             'present': 0, 'deferred': 0, 'errors': 0}
+    for c in list(clusters)[:max(0, limit)]:
+        if cache.peek(c.embedding) is not None:
+            stats['present'] += 1
+            continue
+        answer = c.answer
+        if c.age_hours > stale_hours:
+            if not (refresh and answer_fn):
+                stats['deferred'] += 1
+                continue
+            try:
+                answer = answer_fn(c.question)
+            except Exception as exc:
+                stats['errors'] += 1
+                log.debug(f'[prewarm] sinh lại "{c.question[:60]}" lỗi (non-fatal): {exc}')
+                continue
+            if not _usable(answer):
+                stats['errors'] += 1
+                continue
+            stats['refreshed'] += 1
+        cache.store(query=c.question, query_embedding=c.embedding, answer=answer)
+        stats['stored'] += 1
+    return stats
+
+
+def run_once(
+    cache: Any = None,
+    engine: Any = None,
+    embed_many: Optional[Callable[[List[str]], List[List[float]]]] = None,
+    answer_fn: Optional[Callable[[str], str]] = None,
+    refresh: Optional[bool] = None,
+    days: int = PREWARM_DAYS,
+    limit: int = PREWARM_LIMIT,
+) -> Dict[str, int]:
+    """Một lượt đầy đủ: đọc lịch sử → gom cụm → nạp cache. refresh=None: theo giờ thấp điểm."""
+    if cache is None:
+        from .semantic_cache import get_cache
+        cache = get_cache()
+    if embed_many is None:
+        from ..tools.rag import get_embeddings
+        embed_many = get_embeddings
+    if refresh is None:
+        refresh = in_offpeak()
+
+    t0 = time.perf_counter()
+    rows = history_rows(engine, days=days)
+    clusters = cluster_history(rows, embed_many)
+    if refresh and answer_fn is None and any(c.age_hours > STALE_HOURS for c in clusters[:limit]):
+        answer_fn = default_answer_fn()
+    stats = prewarm(cache, clusters, answer_fn=answer_fn, refresh=refresh, limit=limit)
+    stats['rows'] = len(rows)
+    log.info(
+        f'[prewarm] {len(rows)} lượt → {len(clusters)} cụm  '
+        f"stored={stats['stored']} (refreshed={stats['refreshed']})  "
+        f"present={stats['present']}  deferred={stats['deferred']}  "
+        f"errors={stats['errors']}  {time.perf_counter() - t0:.1f}s"
+    )
+    return stats
+
+
+def run_prewarm_loop() -> None:
+    """
+    Daemon: một lượt sau khi khởi động, rồi mỗi PREWARM_INTERVAL giờ hoặc
+    sớm hơn nếu tới đầu khung thấp điểm. Lượt đầu tiên rơi vào một khung thì
+    sinh lại câu trả lời cũ; các lượt sau trong cùng khung chỉ nạp câu mới.
+    Chỉ một process trên node chạy (flock PREWARM_LOCK) và cần shared tier để
+    entry tới được các worker còn lại. Không bao giờ crash.
+    """
+    from .semantic_cache import get_cache
+    try:
+        shared = get_cache().stats()['shared']
+    except Exception as exc:
+        log.warning(f'[prewarm] không đọc được cấu hình cache: {exc} — bỏ qua')
+        return
+    if not shared:
+        log.warning('[prewarm] RAG_CACHE_SHARED_DIR chưa bật — prewarm nền chỉ làm ấm một '
+                    'worker nên bị bỏ qua; chạy `python -m scripts.prewarm_cache` thay thế')
+        return
+    lock = acquire_scheduler_lock()
+    if lock is None:
+        log.debug('[prewarm] process khác đang giữ scheduler — bỏ qua')
+        return
+    time.sleep(max(0.0, PREWARM_DELAY))
+    refreshed = None                                    # đầu khung đã refresh gần nhất
+    while True:
+        window = offpeak_start(datetime.now(_VN_TZ))
+        refresh = window is not None and window <= datetime.now(_VN_TZ) and window != refreshed
+        try:
+            run_once(refresh=refresh)
+            if refresh:
+                refreshed = window
+        except Exception as exc:
+            log.warning(f'[prewarm] Failed: {exc}')
+        now = datetime.now(_VN_TZ)
+        wait = max(60.0, PREWARM_INTERVAL * 3600)
+        nxt = offpeak_start(now)
+        if nxt is not None:
+            if nxt <= now:                              # vẫn trong khung vừa chạy
+                nxt += timedelta(days=1)
+            wait = min(wait, max(60.0, (nxt - now).total_seconds()))
+        time.sleep(wait)
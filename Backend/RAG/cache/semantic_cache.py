@@ -4,26 +4,34 @@ CAG — Semantic Cache Engine
 
 Kiến trúc CAG (Cache Augmented Generation) tối ưu hóa RAG bằng cách:
   1. Embed câu hỏi của người dùng thành vector nhiều chiều.
-  2. Tính Cosine Similarity giữa vector đó và các câu hỏi đã cache.
+  2. Tính Cosine Similarity giữa vector đó và các câu hỏi đã cache — toàn bộ
+     embedding cache nằm trong một ma trận float32 đã chuẩn hoá, nên một lần
+     lookup chỉ là một phép nhân ma trận-vector + argmax (NumPy/BLAS).
   3. Nếu similarity ≥ threshold → trả ngay câu trả lời từ cache (bỏ qua
      toàn bộ pipeline: task_analyzer + tool_executor + llm_response).
   4. Nếu miss → chạy pipeline đầy đủ, rồi lưu kết quả vào cache.
 
 Luồng xử lý:
-  Query ──► [Embed] ──► [Cosine Search] ──► HIT ──► Return cached answer
-                                         └── MISS ──► Full RAG ──► [Store] ──► Return
+  Query ──► [Embed] ──► [M·q argmax] ──► HIT ──► Return cached answer
+                                        └── MISS ──► Full RAG ──► [Store] ──► Return
 
 Tham số cấu hình (biến môi trường):
   RAG_CACHE_THRESHOLD  : float, default 0.92  — ngưỡng cosine để coi là hit
   RAG_CACHE_TTL_HOURS  : int,   default 24    — thời gian sống của mỗi entry (giờ)
-  RAG_CACHE_MAX_SIZE   : int,   default 1000  — số entry tối đa trong bộ nhớ (LRU)
+  RAG_CACHE_MAX_SIZE   : int,   default 1000  — số entry tối đa trong bộ nhớ (LRU);
+                         ma trận tăng dần theo nhu cầu nên đặt 100k+ vẫn ổn
+  RAG_CACHE_VECTOR_DTYPE: str,  default float16 — kiểu lưu vector trong cột BYTEA
+                         (float16 | float32); sai số cosine của float16 ~1e-3
+
+Ghi xuống PostgreSQL (entry mới, hit counter) đi qua WriteBehindQueue — không
+có round-trip DB nào trên thread của request. Khi đặt RAG_CACHE_SHARED_DIR,
+các worker trên cùng node chia sẻ entry / invalidation qua SharedCacheJournal.
 
 Lưu ý: toàn bộ output chỉ ghi ra terminal qua logger 'rag.cache'.
 """
 
 import hashlib
 import json
-import math
 import os
 import sys
 import threading
@@ -31,10 +39,14 @@ from collections import OrderedDict
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Tuple
+
+import numpy as np
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from logger import get_logger
+from .shared_tier import OP_CLEAR, OP_INVALIDATE, OP_PUT, SharedCacheJournal
+from .write_behind import WriteBehindQueue
 
 log = get_logger('rag.cache')
 
@@ -42,6 +54,12 @@ log = get_logger('rag.cache')
 CACHE_THRESHOLD: float = float(os.getenv('RAG_CACHE_THRESHOLD', '0.92'))
 CACHE_TTL_HOURS: int   = int(os.getenv('RAG_CACHE_TTL_HOURS', '24'))
 CACHE_MAX_SIZE:  int   = int(os.getenv('RAG_CACHE_MAX_SIZE', '1000'))
+CACHE_VECTOR_DTYPE: str = os.getenv('RAG_CACHE_VECTOR_DTYPE', 'float16').strip().lower()
+if CACHE_VECTOR_DTYPE not in ('float16', 'float32'):
+    CACHE_VECTOR_DTYPE = 'float16'
+
+# Số dòng mỗi lô khi warm-load từ PostgreSQL (server-side cursor)
+_LOAD_BATCH = 2000
 
 # ANSI helpers (terminal only)
 _G = '\033[92m'; _Y = '\033[93m'; _R = '\033[91m'
@@ -53,7 +71,6 @@ _C = '\033[96m'; _B = '\033[1m';  _D = '\033[2m'; _X = '\033[0m'
 @dataclass
 class CacheEntry:
     query:           str
-    query_embedding: List[float]
     answer:          str
     created_at:      datetime
     last_hit_at:     datetime
@@ -61,33 +78,204 @@ class CacheEntry:
     expires_at:      datetime = field(default_factory=lambda: (
         datetime.utcnow() + timedelta(hours=CACHE_TTL_HOURS)
     ))
+    # Hàng của entry trong ma trận embedding (_VectorIndex)
+    slot:            int = -1
 
 
 # ─────────────────────────── math primitives ─────────────────────────────────
 
-def _cosine(a: List[float], b: List[float]) -> float:
-    """Cosine similarity: dot(A,B) / (‖A‖·‖B‖)  ∈ [-1, 1]."""
-    dot  = sum(x * y for x, y in zip(a, b))
-    na   = math.sqrt(sum(x * x for x in a))
-    nb   = math.sqrt(sum(x * x for x in b))
-    if na == 0.0 or nb == 0.0:
-        return 0.0
-    return dot / (na * nb)
+_EPOCH = datetime(1970, 1, 1)
 
 
-def _euclidean(a: List[float], b: List[float]) -> float:
-    """Euclidean (L2) distance: √Σ(Aᵢ-Bᵢ)²  ∈ [0, ∞)."""
-    return math.sqrt(sum((x - y) ** 2 for x, y in zip(a, b)))
+def _naive(dt: datetime) -> datetime:
+    """Strip timezone info so naive/aware datetimes compare safely."""
+    return dt.replace(tzinfo=None) if dt.tzinfo is not None else dt
 
 
-def _dot(a: List[float], b: List[float]) -> float:
-    """Raw dot product: Σ(Aᵢ·Bᵢ)."""
-    return sum(x * y for x, y in zip(a, b))
+def _ts(dt: datetime) -> float:
+    """datetime (UTC, naive hoặc aware) → epoch seconds để so sánh vector hoá."""
+    return (_naive(dt) - _EPOCH).total_seconds()
 
 
-def _naive(dt: datetime) -> datetime:
-    """Strip timezone info so naive/aware datetimes compare safely."""
-    return dt.replace(tzinfo=None) if dt.tzinfo is not None else dt
+def _as_unit(vec) -> Optional[np.ndarray]:
+    """Chuyển embedding → vector float32 độ dài 1. None nếu rỗng / norm = 0."""
+    arr = np.asarray(vec, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(arr)) if arr.size else 0.0
+    if norm == 0.0:
+        return None
+    return arr / norm
+
+
+def _encode_vector(unit: np.ndarray) -> bytes:
+    """Vector đã chuẩn hoá → bytes little-endian theo CACHE_VECTOR_DTYPE."""
+    return unit.astype(np.dtype(CACHE_VECTOR_DTYPE).newbyteorder('<')).tobytes()
+
+
+def _decode_rows(rows: list) -> Tuple[List[int], Optional[np.ndarray]]:
+    """
+    Giải mã vector của một lô dòng DB → (chỉ số dòng hợp lệ, ma trận đã chuẩn hoá).
+
+    Mỗi dòng có (..., query_vector_bin, vector_dtype, query_vector) ở 3 cột cuối.
+    Khi cả lô là BYTEA cùng dtype/độ dài (trường hợp thường gặp), toàn bộ lô được
+    ghép thành một buffer và đọc bằng một lần np.frombuffer; dòng JSON cũ
+    (trước khi có cột BYTEA) được parse riêng.
+    """
+    blobs  = [r[-3] for r in rows]
+    dtypes = {r[-2] for r in rows}
+    if all(b is not None for b in blobs) and len(dtypes) == 1 and len({len(b) for b in blobs}) == 1:
+        dt  = np.dtype(dtypes.pop() or 'float16').newbyteorder('<')
+        mat = np.frombuffer(b''.join(bytes(b) for b in blobs), dtype=dt)
+        mat = mat.reshape(len(rows), -1).astype(np.float32)
+        idx = list(range(len(rows)))
+    else:
+        vecs, idx = [], []
+        for i, r in enumerate(rows):
+            try:
+                if r[-3] is not None:
+                    dt = np.dtype(r[-2] or 'float16').newbyteorder('<')
+                    v = np.frombuffer(bytes(r[-3]), dtype=dt).astype(np.float32)
+                elif r[-1]:
+                    v = np.asarray(json.loads(r[-1]), dtype=np.float32)
+                else:
+                    continue
+            except Exception:
+                continue
+            if vecs and v.shape != vecs[0].shape:
+                continue
+            vecs.append(v)
+            idx.append(i)
+        if not vecs:
+            return [], None
+        mat = np.stack(vecs)
+
+    norms = np.linalg.norm(mat, axis=1)
+    ok = norms > 0
+    mat = mat[ok] / norms[ok, None]
+    idx = [i for i, good in zip(idx, ok.tolist()) if good]
+    return idx, mat
+
+
+# ─────────────────────────── vector index ────────────────────────────────────
+
+class _VectorIndex:
+    """
+    Ma trận embedding liên tục (float32, mỗi hàng đã chuẩn hoá L2) + slot map.
+
+      _mat[slot]     : vector của entry
+      _expires[slot] : epoch seconds hết hạn; -inf cho slot trống
+      _keys[slot]    : query_hash đang chiếm slot (None = trống)
+
+    Cosine của mọi entry = _mat[:n] @ q  (một lần gọi BLAS), TTL được lọc bằng
+    mask trên _expires. Dung lượng tăng gấp đôi khi đầy, tối đa `max_size`.
+    Không tự khoá — SemanticCache giữ lock khi thay đổi index.
+    """
+
+    _INITIAL_CAPACITY = 256
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max(1, max_size)
+        self.dim: Optional[int] = None
+        self._mat     = np.zeros((0, 0), dtype=np.float32)
+        self._expires = np.zeros(0, dtype=np.float64)
+        self._keys: List[Optional[str]] = []
+        self._free: List[int] = []
+        self._n = 0  # high-water mark: các hàng [0, _n) đã từng được dùng
+
+    def __len__(self) -> int:
+        return self._n - len(self._free)
+
+    def _grow(self) -> None:
+        cap = self._mat.shape[0]
+        new_cap = min(self.max_size, max(self._INITIAL_CAPACITY, cap * 2))
+        mat = np.zeros((new_cap, self.dim), dtype=np.float32)
+        if cap:
+            mat[:cap] = self._mat
+        expires = np.full(new_cap, -np.inf, dtype=np.float64)
+        expires[:cap] = self._expires
+        # Thay tham chiếu (không sửa tại chỗ) để view cũ vẫn hợp lệ cho reader
+        self._mat, self._expires = mat, expires
+        self._keys.extend([None] * (new_cap - cap))
+
+    def add(self, key: str, unit_vec: np.ndarray, expires_ts: float) -> int:
+        if self.dim is None:
+            self.dim = int(unit_vec.shape[0])
+        if self._free:
+            slot = self._free.pop()
+        else:
+            if self._n >= self._mat.shape[0]:
+                self._grow()
+            slot = self._n
+            self._n += 1
+        self._mat[slot] = unit_vec
+        self._expires[slot] = expires_ts
+        self._keys[slot] = key
+        return slot
+
+    def add_many(
+        self,
+        keys: List[str],
+        units: np.ndarray,
+        expires_ts: np.ndarray,
+    ) -> List[int]:
+        """
+        Chèn một khối vector: slot trống được tái dùng trước, phần còn lại ghi
+        liền một lát cắt cuối ma trận. Dừng khi đạt max_size.
+        """
+        if self.dim is None:
+            self.dim = int(units.shape[1])
+        slots: List[int] = []
+        i = 0
+        while self._free and i < len(keys):
+            slots.append(self.add(keys[i], units[i], float(expires_ts[i])))
+            i += 1
+        rest = len(keys) - i
+        while self._n + rest > self._mat.shape[0] and self._mat.shape[0] < self.max_size:
+            self._grow()
+        rest = min(rest, self._mat.shape[0] - self._n)
+        a, b = self._n, self._n + rest
+        self._mat[a:b]     = units[i:i + rest]
+        self._expires[a:b] = expires_ts[i:i + rest]
+        self._keys[a:b]    = keys[i:i + rest]
+        self._n = b
+        return slots + list(range(a, b))
+
+    def remove(self, slot: int) -> None:
+        if 0 <= slot < self._n and self._keys[slot] is not None:
+            self._keys[slot] = None
+            self._expires[slot] = -np.inf
+            self._free.append(slot)
+
+    def key_at(self, slot: int) -> Optional[str]:
+        return self._keys[slot] if 0 <= slot < self._n else None
+
+    def row(self, slot: int) -> np.ndarray:
+        return self._mat[slot]
+
+    def view(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Snapshot (ma trận, expires) của các hàng đang dùng — đọc được ngoài lock."""
+        return self._mat[:self._n], self._expires[:self._n]
+
+    @staticmethod
+    def best(
+        mat: np.ndarray,
+        expires: np.ndarray,
+        q: np.ndarray,
+        now_ts: float,
+    ) -> Tuple[int, float, np.ndarray]:
+        """
+        Trả về (slot tốt nhất, cosine, các slot đã hết hạn).
+        slot = -1 nếu không còn entry sống.
+        """
+        if mat.shape[0] == 0:
+            return -1, -1.0, np.empty(0, dtype=np.int64)
+        live = expires >= now_ts
+        expired = np.flatnonzero(~live & np.isfinite(expires))
+        if not live.any():
+            return -1, -1.0, expired
+        scores = mat @ q
+        scores[~live] = -np.inf
+        slot = int(np.argmax(scores))
+        return slot, float(scores[slot]), expired
 
 
 # ─────────────────────────── cache engine ────────────────────────────────────
@@ -99,13 +287,19 @@ class SemanticCache:
     queries across sessions.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, persistent: bool = True) -> None:
+        """persistent=False: chỉ trong bộ nhớ — không đọc/ghi PostgreSQL, không shared journal."""
         self._store:  OrderedDict[str, CacheEntry] = OrderedDict()
+        self._index   = _VectorIndex(CACHE_MAX_SIZE)
         self._lock    = threading.Lock()
         self._hits    = 0
         self._misses  = 0
         self._evicted = 0
-        self._db_loaded = False
+        self._persistent = persistent
+        self._db_loaded = not persistent      # chỉ True sau khi index đã được nạp xong
+        self._load_lock = threading.Lock()
+        self._writer  = WriteBehindQueue()
+        self._shared  = SharedCacheJournal.from_env() if persistent else None
 
         log.info(
             f'{_B}[CAG]{_X} SemanticCache ready — '
@@ -126,39 +320,58 @@ class SemanticCache:
 
         Trả về CacheEntry nếu similarity ≥ threshold, ngược lại None.
 
-        Độ phức tạp: O(n·d) với n = số entry, d = chiều vector.
-        Trong thực tế n ≤ 1000 và d = 768, đủ nhanh cho realtime.
+        Mọi entry được chấm điểm bằng một phép nhân ma trận-vector trên
+        snapshot của index, chạy ngoài lock (BLAS nhả GIL) nên các lookup
+        đồng thời không chặn nhau; chỉ slot thắng được kiểm tra lại dưới lock.
         """
-        if not self._db_loaded:
-            self._load_from_db()
+        self._ensure_loaded()
+        self._sync_shared()
 
         thr = threshold if threshold is not None else CACHE_THRESHOLD
         now = datetime.utcnow()
 
-        best_key: Optional[str]       = None
+        q = _as_unit(np.asarray(query_embedding, dtype=np.float32).reshape(-1))
+
+        with self._lock:
+            dim = self._index.dim
+            mat, expires = self._index.view()
+
+        if q is None or (dim is not None and q.shape[0] != dim):
+            if q is not None:
+                log.warning(f'[CAG] Embedding dim {q.shape[0]} ≠ cache dim {dim} — bỏ qua cache')
+            with self._lock:
+                self._misses += 1
+            return None
+
+        slot, best_cos, expired = _VectorIndex.best(mat, expires, q, _ts(now))
+
+        best_key:   Optional[str]        = None
         best_entry: Optional[CacheEntry] = None
-        best_cos  = -1.0
-        best_l2   = float('inf')
-        best_dot  = float('-inf')
+        best_l2  = float('inf')
+        best_dot = float('-inf')
 
         with self._lock:
-            expired_keys = []
-            for key, entry in self._store.items():
-                if _naive(entry.expires_at) < now:
-                    expired_keys.append(key)
-                    continue
-                cos = _cosine(query_embedding, entry.query_embedding)
-                if cos > best_cos:
-                    best_cos   = cos
-                    best_l2    = _euclidean(query_embedding, entry.query_embedding)
-                    best_dot   = _dot(query_embedding, entry.query_embedding)
+            for s in expired.tolist():
+                key = self._index.key_at(s)
+                entry = self._store.get(key) if key else None
+                if entry is not None and entry.slot == s and _naive(entry.expires_at) < now:
+                    del self._store[key]
+                    self._index.remove(s)
+                    self._evicted += 1
+
+            if slot >= 0:
+                # slot có thể đã bị evict/ghi đè giữa snapshot và lúc này → kiểm tra lại
+                key = self._index.key_at(slot)
+                entry = self._store.get(key) if key else None
+                if entry is not None and entry.slot == slot:
+                    row        = self._index.row(slot)
+                    best_cos   = float(row @ q)
+                    # hàng trong index đã chuẩn hoá → so với q (đơn vị), không phải vector thô
+                    best_dot   = best_cos
+                    best_l2    = float(np.linalg.norm(q - row))
                     best_key   = key
                     best_entry = entry
 
-            for k in expired_keys:
-                del self._store[k]
-                self._evicted += 1
-
         # ── log distance metrics regardless of hit/miss ───────────────────
         self._log_lookup_metrics(best_cos, best_l2, best_dot, thr, best_entry)
 
@@ -168,13 +381,42 @@ class SemanticCache:
                 best_entry.last_hit_at = now
                 if best_key in self._store:
                     self._store.move_to_end(best_key)
-            self._hits += 1
+                self._hits += 1
             self._persist_hit(best_key, best_entry)
             return best_entry
 
-        self._misses += 1
+        with self._lock:
+            self._misses += 1
         return None
 
+    def peek(
+        self,
+        query_embedding: List[float],
+        threshold: Optional[float] = None,
+    ) -> Optional[CacheEntry]:
+        """
+        Như lookup nhưng chỉ đọc: không đếm hit/miss, không cập nhật LRU /
+        hit_count, không ghi DB. Dùng cho job nền (prewarm) kiểm tra cache.
+        """
+        self._ensure_loaded()
+        self._sync_shared()
+
+        thr = threshold if threshold is not None else CACHE_THRESHOLD
+        q = _as_unit(np.asarray(query_embedding, dtype=np.float32).reshape(-1))
+        with self._lock:
+            dim = self._index.dim
+            mat, expires = self._index.view()
+        if q is None or (dim is not None and q.shape[0] != dim):
+            return None
+
+        slot, best_cos, _ = _VectorIndex.best(mat, expires, q, _ts(datetime.utcnow()))
+        if slot < 0 or best_cos < thr:
+            return None
+        with self._lock:
+            key = self._index.key_at(slot)
+            entry = self._store.get(key) if key else None
+            return entry if entry is not None and entry.slot == slot else None
+
     def store(
         self,
         query: str,
@@ -182,10 +424,12 @@ class SemanticCache:
         answer: str,
     ) -> None:
         """Cache một cặp (query, answer) kèm vector embedding."""
+        unit = _as_unit(query_embedding)
+        if unit is None:
+            return
         key   = self._hash(query)
         entry = CacheEntry(
             query=query,
-            query_embedding=query_embedding,
             answer=answer,
             created_at=datetime.utcnow(),
             last_hit_at=datetime.utcnow(),
@@ -195,16 +439,14 @@ class SemanticCache:
             if key in self._store:
                 # already cached (concurrent request) — skip
                 return
-            if len(self._store) >= CACHE_MAX_SIZE:
-                evicted_key, evicted = next(iter(self._store.items()))
-                del self._store[evicted_key]
-                self._evicted += 1
-                log.debug(
-                    f'{_D}[CAG] LRU evict: "{evicted.query[:55]}…"{_X}'
+            if self._index.dim is not None and unit.shape[0] != self._index.dim:
+                log.warning(
+                    f'[CAG] Bỏ qua store: dim {unit.shape[0]} ≠ cache dim {self._index.dim}'
                 )
-            self._store[key] = entry
+                return
+            self._insert_locked(key, entry, unit)
 
-        dim = len(query_embedding)
+        dim = len(unit)
         log.info(
             f'{_B}[CAG]{_X} {_G}STORED{_X}  '
             f'size={_C}{len(self._store)}{_X}  '
@@ -212,24 +454,136 @@ class SemanticCache:
             f'ttl={CACHE_TTL_HOURS}h  '
             f'"{query[:60]}"'
         )
-        self._persist_to_db(key, entry)
+        self._persist_to_db(key, entry, unit)
+        if self._shared is not None:
+            try:
+                self._shared.put(key, unit, query, answer,
+                                 _ts(entry.created_at), _ts(entry.expires_at))
+            except Exception as exc:
+                log.debug(f'[CAG] Shared journal write failed (non-fatal): {exc}')
+
+    def invalidate(self, query: Optional[str] = None) -> int:
+        """
+        Xoá một câu hỏi (hoặc toàn bộ cache nếu query=None) khỏi process này,
+        mọi worker cùng node (qua shared journal) và PostgreSQL.
+        Trả về số entry đã xoá ở process hiện tại.
+        """
+        key = self._hash(query) if query else None
+        with self._lock:
+            removed = self._drop_locked(key) if key else self._clear_locked()
+        if self._persistent:
+            self._writer.put_delete(key)
+        if self._shared is not None:
+            try:
+                if key:
+                    self._shared.invalidate(key)
+                else:
+                    self._shared.clear()
+            except Exception as exc:
+                log.debug(f'[CAG] Shared journal invalidate failed (non-fatal): {exc}')
+        log.info(
+            f'{_B}[CAG]{_X} INVALIDATED  '
+            f'{("query " + repr(query[:60])) if query else "all entries"}  removed={removed}'
+        )
+        return removed
+
+    def stats(self) -> dict:
+        """Số liệu cache + hàng đợi write-behind (dùng cho log / health check)."""
+        with self._lock:
+            hits, misses, evicted, entries = self._hits, self._misses, self._evicted, len(self._store)
+        total = hits + misses
+        return {
+            'entries':  entries,
+            'hits':     hits,
+            'misses':   misses,
+            'evicted':  evicted,
+            'hit_rate': hits / total if total > 0 else 0.0,
+            'persist':  self._writer.stats(),
+            'shared':   str(self._shared.dir) if self._shared is not None else None,
+        }
 
     def log_stats(self) -> None:
         """Ghi thống kê tổng hợp ra terminal."""
-        total    = self._hits + self._misses
-        hit_rate = self._hits / total if total > 0 else 0.0
+        st       = self.stats()
+        hit_rate = st['hit_rate']
+        wb       = st['persist']
         color    = _G if hit_rate >= 0.5 else (_Y if hit_rate >= 0.2 else _R)
         log.info(
             f'{_B}[CAG] Cache Stats{_X}  '
-            f'entries={_C}{len(self._store)}{_X}  '
-            f'hits={_G}{self._hits}{_X}  '
-            f'misses={_R}{self._misses}{_X}  '
-            f'evicted={self._evicted}  '
-            f'hit_rate={color}{hit_rate:.1%}{_X}'
+            f'entries={_C}{st["entries"]}{_X}  '
+            f'hits={_G}{st["hits"]}{_X}  '
+            f'misses={_R}{st["misses"]}{_X}  '
+            f'evicted={st["evicted"]}  '
+            f'hit_rate={color}{hit_rate:.1%}{_X}  '
+            f'{_D}persist: queue={wb["queue_depth"]} '
+            f'flush={wb["last_flush_ms"]}ms (avg {wb["avg_flush_ms"]}ms) '
+            f'dropped={wb["dropped"]}{_X}'
         )
 
     # ── internal helpers ──────────────────────────────────────────────────────
 
+    def _insert_locked(self, key: str, entry: CacheEntry, unit: np.ndarray) -> None:
+        """Thêm entry vào store + index (evict LRU nếu đầy). Gọi khi đang giữ lock."""
+        if len(self._store) >= CACHE_MAX_SIZE:
+            evicted_key, evicted = next(iter(self._store.items()))
+            del self._store[evicted_key]
+            self._index.remove(evicted.slot)
+            self._evicted += 1
+            log.debug(
+                f'{_D}[CAG] LRU evict: "{evicted.query[:55]}…"{_X}'
+            )
+        entry.slot = self._index.add(key, unit, _ts(entry.expires_at))
+        self._store[key] = entry
+
+    def _drop_locked(self, key: str) -> int:
+        entry = self._store.pop(key, None)
+        if entry is None:
+            return 0
+        self._index.remove(entry.slot)
+        return 1
+
+    def _clear_locked(self) -> int:
+        removed = len(self._store)
+        self._store.clear()
+        # Index mới: snapshot cũ đang được đọc ngoài lock sẽ không khớp key → miss
+        self._index = _VectorIndex(CACHE_MAX_SIZE)
+        return removed
+
+    def _sync_shared(self) -> None:
+        """Áp dụng các thay đổi do worker khác ghi vào shared journal."""
+        if self._shared is None:
+            return
+        try:
+            records = self._shared.poll()
+        except Exception as exc:
+            log.debug(f'[CAG] Shared journal poll failed (non-fatal): {exc}')
+            return
+        if not records:
+            return
+        now_ts = _ts(datetime.utcnow())
+        with self._lock:
+            for rec in records:
+                op = rec['op']
+                if op == OP_CLEAR:
+                    self._clear_locked()
+                elif op == OP_INVALIDATE:
+                    self._drop_locked(rec['key'])
+                elif op == OP_PUT:
+                    key = rec['key']
+                    if key in self._store or rec['expires_ts'] < now_ts:
+                        continue
+                    unit = _as_unit(rec['vector'])
+                    if unit is None or (self._index.dim is not None
+                                        and unit.shape[0] != self._index.dim):
+                        continue
+                    created = _EPOCH + timedelta(seconds=rec['created_ts'])
+                    entry = CacheEntry(
+                        query=rec['query'], answer=rec['answer'],
+                        created_at=created, last_hit_at=created,
+                        expires_at=_EPOCH + timedelta(seconds=rec['expires_ts']),
+                    )
+                    self._insert_locked(key, entry, unit)
+
     @staticmethod
     def _hash(query: str) -> str:
         return hashlib.sha256(query.strip().lower().encode('utf-8')).hexdigest()
@@ -247,7 +601,8 @@ class SemanticCache:
 
         Cosine Similarity  = dot(Q,C) / (‖Q‖·‖C‖)   — đo góc ngữ nghĩa
         Euclidean Distance = √Σ(Qᵢ-Cᵢ)²             — khoảng cách hình học
-        Dot Product        = Σ(Qᵢ·Cᵢ)               — tích vô hướng thô
+        Dot Product        = Σ(Qᵢ·Cᵢ)               — tích vô hướng
+        (Q, C đều đã chuẩn hoá về vector đơn vị: dot = cos, L2 = √(2 − 2·cos))
         """
         if entry is None:
             log.info(
@@ -292,34 +647,58 @@ class SemanticCache:
 
     # ── PostgreSQL persistence (non-fatal) ────────────────────────────────────
 
+    def _ensure_loaded(self) -> None:
+        """
+        Warm-load đúng một lần. Các request đầu tiên đồng thời chờ nhau ở đây thay
+        vì tra trên index còn rỗng (miss giả); cờ chỉ bật sau khi nạp xong.
+        """
+        if self._db_loaded:
+            return
+        with self._load_lock:
+            if self._db_loaded:
+                return
+            try:
+                self._load_from_db()
+            finally:
+                self._db_loaded = True
+
     def _load_from_db(self) -> None:
-        self._db_loaded = True
+        """
+        Warm-load tối đa CACHE_MAX_SIZE entry nóng nhất từ PostgreSQL.
+
+        Đọc qua server-side cursor theo lô `_LOAD_BATCH` dòng, thứ tự
+        last_hit_at tăng dần (đúng thứ tự LRU); vector mỗi lô đi thẳng từ bytes
+        BYTEA vào ma trận bằng _decode_rows + _VectorIndex.add_many.
+        """
+        # Entry cũ trong shared journal cũng đã (hoặc sắp) nằm trong PostgreSQL →
+        # bắt đầu từ cuối journal; chỉ phát lại journal nếu không đọc được DB
+        if self._shared is not None:
+            try:
+                self._shared.seek_tail()
+            except Exception as exc:
+                log.debug(f'[CAG] Shared journal seek failed (non-fatal): {exc}')
         try:
             from models.db import db
             from sqlalchemy import text  # type: ignore
-            rows = db.session.execute(text("""
-                SELECT query_hash, query_text, query_vector, answer_text,
-                       hit_count, created_at, last_hit_at, expires_at
-                FROM public.rag_semantic_cache
-                WHERE expires_at > now()
-                ORDER BY last_hit_at DESC
-                LIMIT :lim
-            """), {'lim': CACHE_MAX_SIZE}).fetchall()
+            result = db.session.execute(text("""
+                SELECT query_hash, query_text, answer_text, hit_count,
+                       created_at, last_hit_at, expires_at,
+                       query_vector_bin, vector_dtype, query_vector
+                FROM (
+                    SELECT * FROM public.rag_semantic_cache
+                    WHERE expires_at > now()
+                    ORDER BY last_hit_at DESC
+                    LIMIT :lim
+                ) hot
+                ORDER BY last_hit_at ASC
+            """).execution_options(stream_results=True), {'lim': CACHE_MAX_SIZE})
 
             count = 0
-            for row in rows:
-                try:
-                    vec = json.loads(row[2])
-                    entry = CacheEntry(
-                        query=row[1], query_embedding=vec,
-                        answer=row[3], created_at=row[5],
-                        last_hit_at=row[6], hit_count=row[4],
-                        expires_at=row[7],
-                    )
-                    self._store[row[0]] = entry
-                    count += 1
-                except Exception:
-                    pass
+            while True:
+                rows = result.fetchmany(_LOAD_BATCH)
+                if not rows:
+                    break
+                count += self._bulk_insert(rows)
 
             if count:
                 log.info(
@@ -328,53 +707,64 @@ class SemanticCache:
                 )
         except Exception as exc:
             log.debug(f'[CAG] DB load skipped ({exc})')
-
-    def _persist_to_db(self, key: str, entry: CacheEntry) -> None:
-        try:
-            from models.db import db
-            from sqlalchemy import text  # type: ignore
-            db.session.execute(text("""
-                INSERT INTO public.rag_semantic_cache
-                    (query_hash, query_text, query_vector, answer_text,
-                     hit_count, created_at, last_hit_at, expires_at)
-                VALUES
-                    (:key, :query, :vec, :answer,
-                     :hits, :created, :last_hit, :expires)
-                ON CONFLICT (query_hash) DO UPDATE SET
-                    hit_count   = EXCLUDED.hit_count,
-                    last_hit_at = EXCLUDED.last_hit_at,
-                    expires_at  = EXCLUDED.expires_at
-            """), {
-                'key':      key,
-                'query':    entry.query,
-                'vec':      json.dumps(entry.query_embedding),
-                'answer':   entry.answer,
-                'hits':     entry.hit_count,
-                'created':  entry.created_at,
-                'last_hit': entry.last_hit_at,
-                'expires':  entry.expires_at,
-            })
-            db.session.commit()
-        except Exception as exc:
-            log.debug(f'[CAG] DB persist failed (non-fatal): {exc}')
-            try:
-                from models.db import db as _db
-                _db.session.rollback()
-            except Exception:
-                pass
+            if self._shared is not None:
+                try:
+                    self._shared.rewind()
+                except Exception as rewind_exc:
+                    log.debug(f'[CAG] Shared journal rewind failed (non-fatal): {rewind_exc}')
+
+    def _bulk_insert(self, rows: list) -> int:
+        """Chèn một lô dòng DB vào store + index. Trả về số entry đã thêm."""
+        idx, units = _decode_rows(rows)
+        if units is None:
+            return 0
+        with self._lock:
+            if self._index.dim is not None and units.shape[1] != self._index.dim:
+                return 0
+            keep = [
+                (i, j) for j, i in enumerate(idx) if rows[i][0] not in self._store
+            ][:max(0, CACHE_MAX_SIZE - len(self._store))]
+            if not keep:
+                return 0
+            entries = [
+                CacheEntry(
+                    query=rows[i][1], answer=rows[i][2],
+                    hit_count=rows[i][3], created_at=rows[i][4],
+                    last_hit_at=rows[i][5], expires_at=rows[i][6],
+                )
+                for i, _ in keep
+            ]
+            slots = self._index.add_many(
+                [rows[i][0] for i, _ in keep],
+                units[[j for _, j in keep]],
+                np.array([_ts(e.expires_at) for e in entries], dtype=np.float64),
+            )
+            for (i, _), entry, slot in zip(keep, entries, slots):
+                entry.slot = slot
+                self._store[rows[i][0]] = entry
+            return len(slots)
+
+    def _persist_to_db(self, key: str, entry: CacheEntry, unit: np.ndarray) -> None:
+        """Xếp hàng upsert entry — thread nền (WriteBehindQueue) sẽ ghi theo lô."""
+        if not self._persistent:
+            return
+        self._writer.put_entry(key, {
+            'key':      key,
+            'query':    entry.query,
+            'vec':      _encode_vector(unit),
+            'dtype':    CACHE_VECTOR_DTYPE,
+            'answer':   entry.answer,
+            'hits':     entry.hit_count,
+            'created':  entry.created_at,
+            'last_hit': entry.last_hit_at,
+            'expires':  entry.expires_at,
+        })
 
     def _persist_hit(self, key: str, entry: CacheEntry) -> None:
-        try:
-            from models.db import db
-            from sqlalchemy import text  # type: ignore
-            db.session.execute(text("""
-                UPDATE public.rag_semantic_cache
-                SET hit_count = :hits, last_hit_at = now()
-                WHERE query_hash = :key
-            """), {'hits': entry.hit_count, 'key': key})
-            db.session.commit()
-        except Exception:
-            pass
+        """Cộng dồn hit counter trong bộ nhớ — không round-trip DB trên đường HIT."""
+        if not self._persistent:
+            return
+        self._writer.put_hit(key, _naive(entry.last_hit_at))
 
 
 # ── module-level singleton (one cache per process) ────────────────────────────
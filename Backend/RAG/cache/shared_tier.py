@@ -0,0 +1,225 @@
+"""
+CAG — Shared cache tier cho nhiều worker trên cùng một node
+============================================================
+
+Mỗi worker (gunicorn / nhiều process) vẫn giữ ma trận embedding riêng trong
+RAM, nhưng mọi thay đổi được ghi vào một journal nhị phân append-only đặt trên
+tmpfs (mặc định nên dùng /dev/shm). Trước mỗi lookup, worker đọc phần journal
+mới kể từ offset lần trước (một os.stat + một read) và áp dụng:
+
+  PUT        : thêm entry (vector float32 + query/answer) vào cache cục bộ
+  INVALIDATE : xoá một query_hash khỏi mọi worker
+  CLEAR      : xoá toàn bộ cache của mọi worker
+  ROTATE     : journal đã đầy, chuyển sang thế hệ mới (đọc file CURRENT)
+
+Nhờ vậy entry do worker A sinh ra được worker B dùng ngay ở request kế tiếp,
+hit rate không còn giảm tuyến tính theo số worker, và invalidation tới được
+tất cả process.
+
+Ghi: một record = một lần write() dưới flock(LOCK_EX) trên file `lock`.
+Đọc: không khoá; record dở dang (đang ghi) được bỏ qua tới lần poll sau.
+
+Tham số cấu hình (biến môi trường):
+  RAG_CACHE_SHARED_DIR       : str,  default ''   — thư mục journal; rỗng = tắt
+  RAG_CACHE_SHARED_MAX_MB    : int,  default 256  — kích thước journal trước khi xoay
+"""
+
+import json
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows — tier bị tắt, cache vẫn chạy theo từng process
+    fcntl = None  # type: ignore
+
+log = get_logger('rag.cache')
+
+SHARED_DIR:    str = os.getenv('RAG_CACHE_SHARED_DIR', '').strip()
+SHARED_MAX_MB: int = int(os.getenv('RAG_CACHE_SHARED_MAX_MB', '256'))
+
+OP_PUT        = 1
+OP_INVALIDATE = 2
+OP_CLEAR      = 3
+OP_ROTATE     = 4
+
+# magic, op, query_hash (hex, 64 byte), expires_ts, created_ts, dim, payload_len
+_HEADER = struct.Struct('<4sB64sddHI')
+_MAGIC  = b'CAG1'
+
+
+class SharedCacheJournal:
+    """Journal append-only dùng chung giữa các process trên một node."""
+
+    def __init__(self, directory: str, max_bytes: int = SHARED_MAX_MB * 1024 * 1024) -> None:
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max(_HEADER.size * 16, max_bytes)
+        self._lock_path    = self.dir / 'lock'
+        self._current_path = self.dir / 'CURRENT'
+        self._gen    = self._read_current()
+        # Mặc định đọc từ đầu thế hệ hiện tại; SemanticCache gọi seek_tail() khi
+        # warm-load PostgreSQL thành công để worker mới không phát lại cả journal
+        self._offset = 0
+
+    @classmethod
+    def from_env(cls) -> Optional['SharedCacheJournal']:
+        """Tạo journal theo RAG_CACHE_SHARED_DIR; None nếu tắt hoặc không hỗ trợ."""
+        if not SHARED_DIR:
+            return None
+        if fcntl is None:
+            log.warning('[CAG] Shared cache tier cần fcntl (POSIX) — bỏ qua')
+            return None
+        try:
+            journal = cls(SHARED_DIR)
+            log.info(f'[CAG] Shared cache tier: {SHARED_DIR} (gen {journal._gen})')
+            return journal
+        except Exception as exc:
+            log.warning(f'[CAG] Shared cache tier disabled: {exc}')
+            return None
+
+    # ── paths / generation ────────────────────────────────────────────────────
+
+    def _journal_path(self, gen: int) -> Path:
+        return self.dir / f'journal.{gen}'
+
+    def _read_current(self) -> int:
+        try:
+            return int(self._current_path.read_text().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    # ── writer side ───────────────────────────────────────────────────────────
+
+    def _append(self, record: bytes) -> None:
+        with open(self._lock_path, 'a+b') as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            try:
+                gen  = self._read_current()
+                path = self._journal_path(gen)
+                size = path.stat().st_size if path.exists() else 0
+                if size + len(record) > self.max_bytes and size > 0:
+                    with open(path, 'ab') as f:
+                        f.write(_pack(OP_ROTATE, '', 0.0, 0.0, None, b''))
+                    gen += 1
+                    path = self._journal_path(gen)
+                    open(path, 'wb').close()
+                    tmp = self._current_path.with_suffix('.tmp')
+                    tmp.write_text(str(gen))
+                    os.replace(tmp, self._current_path)
+                    old = self._journal_path(gen - 2)
+                    if old.exists():
+                        old.unlink()
+                with open(path, 'ab') as f:
+                    f.write(record)
+            finally:
+                fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+    def put(
+        self,
+        key: str,
+        unit: np.ndarray,
+        query: str,
+        answer: str,
+        created_ts: float,
+        expires_ts: float,
+    ) -> None:
+        payload = json.dumps({'q': query, 'a': answer}, ensure_ascii=False).encode('utf-8')
+        self._append(_pack(OP_PUT, key, expires_ts, created_ts, unit, payload))
+
+    def invalidate(self, key: str) -> None:
+        self._append(_pack(OP_INVALIDATE, key, 0.0, 0.0, None, b''))
+
+    def clear(self) -> None:
+        self._append(_pack(OP_CLEAR, '', 0.0, 0.0, None, b''))
+
+    # ── reader side ───────────────────────────────────────────────────────────
+
+    def seek_tail(self) -> None:
+        """Bỏ qua phần journal đã có — chỉ nhận record ghi sau thời điểm này."""
+        with open(self._lock_path, 'a+b') as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_SH)            # không đứng giữa một record đang ghi
+            try:
+                self._gen = self._read_current()
+                path = self._journal_path(self._gen)
+                self._offset = path.stat().st_size if path.exists() else 0
+            finally:
+                fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+    def rewind(self) -> None:
+        """Đọc lại từ đầu thế hệ hiện tại (khi không có nguồn warm-load nào khác)."""
+        self._gen, self._offset = self._read_current(), 0
+
+    def poll(self) -> List[Dict[str, Any]]:
+        """Đọc các record mới kể từ lần poll trước (kể cả record do chính process này ghi)."""
+        records: List[Dict[str, Any]] = []
+        while True:
+            path = self._journal_path(self._gen)
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                newer = self._read_current()
+                if newer != self._gen:
+                    self._gen, self._offset = newer, 0
+                    continue
+                return records
+            if size <= self._offset:
+                return records
+            with open(path, 'rb') as f:
+                f.seek(self._offset)
+                buf = f.read(size - self._offset)
+            consumed, rotated = _unpack_all(buf, records)
+            self._offset += consumed
+            if not rotated:
+                return records
+            self._gen, self._offset = self._gen + 1, 0
+
+
+def _pack(
+    op: int,
+    key: str,
+    expires_ts: float,
+    created_ts: float,
+    unit: Optional[np.ndarray],
+    payload: bytes,
+) -> bytes:
+    vec = b'' if unit is None else np.asarray(unit, dtype='<f4').tobytes()
+    dim = 0 if unit is None else int(unit.shape[0])
+    head = _HEADER.pack(_MAGIC, op, key.encode('ascii').ljust(64, b'\0'),
+                        expires_ts, created_ts, dim, len(payload))
+    return head + vec + payload
+
+
+def _unpack_all(buf: bytes, out: List[Dict[str, Any]]) -> tuple:
+    """Giải mã các record đầy đủ trong buf. Trả về (số byte đã dùng, gặp ROTATE?)."""
+    pos = 0
+    while pos + _HEADER.size <= len(buf):
+        magic, op, key, expires_ts, created_ts, dim, plen = _HEADER.unpack_from(buf, pos)
+        if magic != _MAGIC:
+            log.warning('[CAG] Shared journal hỏng — bỏ qua phần còn lại')
+            return len(buf), False
+        end = pos + _HEADER.size + dim * 4 + plen
+        if end > len(buf):
+            break  # record đang được ghi dở
+        body = pos + _HEADER.size
+        pos = end
+        if op == OP_ROTATE:
+            return pos, True
+        rec: Dict[str, Any] = {'op': op, 'key': key.rstrip(b'\0').decode('ascii')}
+        if op == OP_PUT:
+            rec['vector']     = np.frombuffer(buf, dtype='<f4', count=dim, offset=body).astype(np.float32)
+            meta              = json.loads(buf[body + dim * 4:end].decode('utf-8'))
+            rec['query']      = meta.get('q', '')
+            rec['answer']     = meta.get('a', '')
+            rec['created_ts'] = created_ts
+            rec['expires_ts'] = expires_ts
+        out.append(rec)
+    return pos, False
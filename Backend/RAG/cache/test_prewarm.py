@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta
+
+from RAG.cache.prewarm import (
+    Cluster, acquire_scheduler_lock, cluster_history, in_offpeak, offpeak_start, prewarm,
+)
+from RAG.cache.semantic_cache import SemanticCache
+
+_VECS = {
+    'hạn đổi cccd':           [1.0, 0.0, 0.0],
+    'hạn đổi căn cước':       [0.99, 0.05, 0.0],
+    'đăng ký khai sinh':      [0.0, 1.0, 0.0],
+    'cấp lại hộ chiếu':       [0.0, 0.0, 1.0],
+}
+
+_ANSWER = 'Câu trả lời đủ dài để được cache lại.'
+
+
+def _embed(texts):
+    return [_VECS[t.casefold()] for t in texts]
+
+
+def _cache(monkeypatch):
+    c = SemanticCache()
+    c._db_loaded = True                                   # không chạm PostgreSQL
+    monkeypatch.setattr(c, '_persist_to_db', lambda *a, **k: None)
+    monkeypatch.setattr(c, '_persist_hit', lambda *a, **k: None)
+    return c
+
+
+def test_cluster_merges_near_duplicates_and_keeps_frequent():
+    rows = [
+        ('Hạn đổi  CCCD', _ANSWER + ' (mới)', 1.0),
+        ('hạn đổi cccd', _ANSWER, 5.0),
+        ('hạn đổi căn cước', _ANSWER + ' (cũ)', 9.0),
+        ('đăng ký khai sinh', _ANSWER, 2.0),
+        ('đăng ký khai sinh', '❌ Lỗi', 3.0),
+        ('cấp lại hộ chiếu', _ANSWER, 2.0),             # chỉ hỏi 1 lần → bỏ
+    ]
+    clusters = cluster_history(rows, _embed, sim=0.9, min_count=2)
+    assert [(c.question, c.count) for c in clusters] == [
+        ('Hạn đổi CCCD', 3), ('đăng ký khai sinh', 2),
+    ]
+    assert clusters[0].answer == _ANSWER + ' (mới)' and clusters[0].age_hours == 1.0
+
+
+def test_prewarm_stores_fresh_and_skips_present(monkeypatch):
+    cache = _cache(monkeypatch)
+    cache.store('đã có', [0.0, 1.0, 0.0], _ANSWER)
+    clusters = [
+        Cluster('hạn đổi cccd', _ANSWER, 1.0, 5, [1.0, 0.0, 0.0]),
+        Cluster('khai sinh', _ANSWER, 1.0, 3, [0.0, 1.0, 0.0]),
+    ]
+    stats = prewarm(cache, clusters)
+    assert stats['stored'] == 1 and stats['present'] == 1
+    hit = cache.lookup([1.0, 0.0, 0.0])
+    assert hit is not None and hit.query == 'hạn đổi cccd'
+
+
+def test_stale_answers_refresh_only_when_allowed(monkeypatch):
+    cache = _cache(monkeypatch)
+    stale = [Cluster('hạn đổi cccd', _ANSWER, 500.0, 5, [1.0, 0.0, 0.0])]
+    calls = []
+
+    def answer(q):
+        calls.append(q)
+        return 'Câu trả lời mới sinh lại từ pipeline.'
+
+    assert prewarm(cache, stale, answer_fn=answer, refresh=False)['deferred'] == 1
+    assert calls == [] and cache.peek([1.0, 0.0, 0.0]) is None
+
+    stats = prewarm(cache, stale, answer_fn=answer, refresh=True)
+    assert stats['refreshed'] == 1 and calls == ['hạn đổi cccd']
+    assert cache.peek([1.0, 0.0, 0.0]).answer == 'Câu trả lời mới sinh lại từ pipeline.'
+
+
+def test_peek_does_not_touch_stats(monkeypatch):
+    cache = _cache(monkeypatch)
+    cache.store('a', [1.0, 0.0], _ANSWER)
+    assert cache.peek([1.0, 0.0]).hit_count == 0
+    assert cache.peek([0.0, 1.0]) is None
+    assert cache.stats()['hits'] == 0 and cache.stats()['misses'] == 0
+
+
+def test_offpeak_window():
+    at = lambda h: datetime(2026, 1, 1, h)
+    assert in_offpeak(at(2), '1-5') and not in_offpeak(at(5), '1-5')
+    assert in_offpeak(at(23), '22-5') and in_offpeak(at(3), '22-5')
+    assert not in_offpeak(at(12), '22-5') and not in_offpeak(at(3), 'bad')
+
+
+def test_offpeak_start_is_current_or_next_window():
+    at = lambda d, h, m=0: datetime(2026, 1, d, h, m)
+    assert offpeak_start(at(1, 12), '1-5') == at(2, 1)
+    assert offpeak_start(at(1, 0, 30), '1-5') == at(1, 1)
+    assert offpeak_start(at(1, 3, 15), '1-5') == at(1, 1)          # đang trong khung
+    assert offpeak_start(at(2, 3), '22-5') == at(1, 22)            # khung qua nửa đêm
+    assert offpeak_start(at(1, 23), '22-5') == at(1, 22)
+    assert offpeak_start(at(1, 12), '22-5') - at(1, 12) == timedelta(hours=10)
+    assert offpeak_start(at(1, 12), 'bad') is None and offpeak_start(at(1, 12), '3-3') is None
+
+
+def test_scheduler_lock_admits_one_holder(tmp_path):
+    path = str(tmp_path / 'prewarm.lock')
+    first = acquire_scheduler_lock(path)
+    assert first is not None and acquire_scheduler_lock(path) is None
+    first.close()
+    again = acquire_scheduler_lock(path)
+    assert again is not None
+    again.close()
+
+
+def test_background_loop_needs_shared_tier(monkeypatch):
+    import RAG.cache.prewarm as pw
+    import RAG.cache.semantic_cache as sc
+
+    c = SemanticCache()
+    c._shared = None
+    monkeypatch.setattr(sc, 'get_cache', lambda: c)
+    monkeypatch.setattr(pw, 'acquire_scheduler_lock', lambda *a: (_ for _ in ()).throw(AssertionError('lock')))
+    pw.run_prewarm_loop()                                 # trả về ngay, không giữ lock / không chạy
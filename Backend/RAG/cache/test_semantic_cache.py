@@ -0,0 +1,174 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import RAG.cache.semantic_cache as sc
+from RAG.cache.semantic_cache import SemanticCache, _VectorIndex, _as_unit
+
+
+def _cache(monkeypatch, max_size=1000):
+    monkeypatch.setattr(sc, 'CACHE_MAX_SIZE', max_size)
+    c = SemanticCache()
+    c._db_loaded = True                                   # không chạm PostgreSQL
+    monkeypatch.setattr(c, '_persist_to_db', lambda *a, **k: None)
+    monkeypatch.setattr(c, '_persist_hit', lambda *a, **k: None)
+    return c
+
+
+def _vec(seed, dim=16):
+    return np.random.default_rng(seed).normal(size=dim).tolist()
+
+
+def test_lookup_returns_nearest_entry(monkeypatch):
+    c = _cache(monkeypatch)
+    for i in range(50):
+        c.store(f'câu hỏi {i}', _vec(i), f'trả lời {i}')
+    hit = c.lookup(_vec(7))
+    assert hit is not None and hit.answer == 'trả lời 7'
+    assert hit.hit_count == 1
+
+
+def test_lookup_below_threshold_is_miss(monkeypatch):
+    c = _cache(monkeypatch)
+    c.store('a', [1.0, 0.0, 0.0], 'A')
+    assert c.lookup([0.0, 1.0, 0.0]) is None
+    assert c.lookup([0.0, 1.0, 0.0], threshold=-1.0).answer == 'A'
+
+
+def test_unnormalised_query_matches(monkeypatch):
+    c = _cache(monkeypatch)
+    c.store('a', [3.0, 4.0], 'A')
+    assert c.lookup([30.0, 40.0]).answer == 'A'
+
+
+def test_lookup_metrics_use_normalised_query(monkeypatch):
+    c = _cache(monkeypatch)
+    seen = []
+    monkeypatch.setattr(c, '_log_lookup_metrics', lambda *a: seen.append(a[:3]))
+    c.store('a', [1.0, 0.0], 'A')
+    c.lookup([0.0, 50.0], threshold=-1.0)
+    cos, l2, dot = seen[-1]
+    assert abs(cos) < 1e-6 and abs(dot) < 1e-6 and abs(l2 - 2 ** 0.5) < 1e-6
+
+
+def test_lru_eviction_frees_slot(monkeypatch):
+    c = _cache(monkeypatch, max_size=3)
+    for i in range(3):
+        c.store(f'q{i}', _vec(i), f'a{i}')
+    c.store('q3', _vec(3), 'a3')                          # evict q0
+    assert len(c._store) == 3 and len(c._index) == 3
+    hit = c.lookup(_vec(0))
+    assert hit is None or hit.answer != 'a0'
+    assert c.lookup(_vec(3)).answer == 'a3'
+
+
+def test_expired_entries_are_skipped_and_evicted(monkeypatch):
+    c = _cache(monkeypatch)
+    c.store('cũ', _vec(1), 'old')
+    entry = c._store[c._hash('cũ')]
+    entry.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    c._index._expires[entry.slot] = sc._ts(entry.expires_at)
+    assert c.lookup(_vec(1)) is None
+    assert len(c._store) == 0 and len(c._index) == 0
+
+
+def test_dimension_mismatch_is_miss(monkeypatch):
+    c = _cache(monkeypatch)
+    c.store('a', _vec(1, dim=8), 'A')
+    assert c.lookup(_vec(1, dim=4)) is None
+    c.store('b', _vec(2, dim=4), 'B')                     # bị bỏ qua
+    assert len(c._store) == 1
+
+
+def test_index_grows_and_reuses_slots():
+    idx = _VectorIndex(max_size=1000)
+    for i in range(300):                                  # > _INITIAL_CAPACITY
+        idx.add(f'k{i}', _as_unit(_vec(i)), 1e12)
+    assert len(idx) == 300 and idx._mat.shape[0] == 512
+    idx.remove(5)
+    assert idx.add('new', _as_unit(_vec(999)), 1e12) == 5
+    mat, exp = idx.view()
+    slot, cos, expired = _VectorIndex.best(mat, exp, _as_unit(_vec(999)), 0.0)
+    assert slot == 5 and abs(cos - 1.0) < 1e-5 and expired.size == 0
+
+
+def _db_row(key, vec, dtype='float16', legacy=False):
+    now = datetime.utcnow()
+    unit = _as_unit(vec)
+    bin_ = None if legacy else unit.astype(np.dtype(dtype).newbyteorder('<')).tobytes()
+    json_ = str(list(map(float, vec))) if legacy else None
+    return (key, f'q-{key}', f'a-{key}', 0, now, now, now + timedelta(hours=1),
+            bin_, None if legacy else dtype, json_)
+
+
+def test_encode_vector_is_compact_and_roundtrips():
+    unit = _as_unit(_vec(3, dim=1024))
+    blob = sc._encode_vector(unit)
+    assert len(blob) == 1024 * np.dtype(sc.CACHE_VECTOR_DTYPE).itemsize
+    idx, mat = sc._decode_rows([(None,) * 7 + (blob, sc.CACHE_VECTOR_DTYPE, None)])
+    assert idx == [0] and float(mat[0] @ unit) > 0.999
+
+
+def test_bulk_insert_fast_path_and_legacy_rows(monkeypatch):
+    c = _cache(monkeypatch)
+    rows = [_db_row(f'k{i}', _vec(i)) for i in range(5)]
+    assert c._bulk_insert(rows) == 5
+    mixed = [_db_row('j0', _vec(10), legacy=True), _db_row('j1', _vec(11), dtype='float32')]
+    assert c._bulk_insert(mixed) == 2
+    assert c.lookup(_vec(10)).answer == 'a-j0'
+    assert c.lookup(_vec(3)).answer == 'a-k3'
+
+
+def test_bulk_insert_respects_max_size(monkeypatch):
+    c = _cache(monkeypatch, max_size=3)
+    assert c._bulk_insert([_db_row(f'k{i}', _vec(i)) for i in range(5)]) == 3
+    assert len(c._store) == 3 and len(c._index) == 3
+
+
+def test_concurrent_first_lookups_wait_for_warm_load(monkeypatch):
+    import threading
+    import time
+
+    c = _cache(monkeypatch)
+    c._db_loaded = False
+
+    def slow_load():
+        time.sleep(0.05)
+        c.store('a', [1.0, 0.0], 'A')
+
+    monkeypatch.setattr(c, '_load_from_db', slow_load)
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(c.lookup([1.0, 0.0]))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [e.answer for e in out] == ['A'] * 8
+    assert c.stats()['hits'] == 8 and c.stats()['misses'] == 0 and len(c._store) == 1
+
+
+def test_db_load_failure_is_quiet_with_or_without_shared_tier(monkeypatch):
+    import models.db
+
+    class _Broken:
+        def execute(self, *a, **k):
+            raise RuntimeError('db down')
+
+    monkeypatch.setattr(models.db.db, 'session', _Broken(), raising=False)
+    c = _cache(monkeypatch)
+    c._shared = None
+    c._load_from_db()                                     # tier tắt: không gọi rewind
+
+    class _Journal:
+        rewound = False
+
+        def seek_tail(self):
+            pass
+
+        def rewind(self):
+            _Journal.rewound = True
+            raise OSError('journal gone')
+
+    c._shared = _Journal()
+    c._load_from_db()
+    assert _Journal.rewound
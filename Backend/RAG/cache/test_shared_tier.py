@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from RAG.cache.semantic_cache import SemanticCache
+from RAG.cache.shared_tier import OP_CLEAR, OP_INVALIDATE, OP_PUT, SharedCacheJournal, fcntl
+
+pytestmark = pytest.mark.skipif(fcntl is None, reason='shared tier cần fcntl (POSIX)')
+
+
+def _vec(seed, dim=16):
+    return np.random.default_rng(seed).normal(size=dim).tolist()
+
+
+def _unit(seed, dim=16):
+    v = np.asarray(_vec(seed, dim), dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_put_is_visible_to_other_journal(tmp_path):
+    a, b = SharedCacheJournal(str(tmp_path)), SharedCacheJournal(str(tmp_path))
+    a.put('ab' * 32, _unit(1), 'câu hỏi', 'trả lời', 10.0, 1e12)
+    recs = b.poll()
+    assert len(recs) == 1 and recs[0]['op'] == OP_PUT
+    assert recs[0]['key'] == 'ab' * 32 and recs[0]['answer'] == 'trả lời'
+    assert np.allclose(recs[0]['vector'], _unit(1))
+    assert b.poll() == []                                 # offset đã tiến
+
+
+def test_invalidate_and_clear(tmp_path):
+    a, b = SharedCacheJournal(str(tmp_path)), SharedCacheJournal(str(tmp_path))
+    a.invalidate('k' * 64)
+    a.clear()
+    assert [r['op'] for r in b.poll()] == [OP_INVALIDATE, OP_CLEAR]
+
+
+def test_partial_record_waits_for_next_poll(tmp_path):
+    a, b = SharedCacheJournal(str(tmp_path)), SharedCacheJournal(str(tmp_path))
+    a.put('k' * 64, _unit(1), 'q', 'a', 0.0, 1e12)
+    path = tmp_path / 'journal.0'
+    full = path.read_bytes()
+    path.write_bytes(full[:-3])
+    assert b.poll() == []
+    path.write_bytes(full)
+    assert len(b.poll()) == 1
+
+
+def test_rotation_keeps_readers_in_sync(tmp_path):
+    a = SharedCacheJournal(str(tmp_path), max_bytes=2048)
+    b = SharedCacheJournal(str(tmp_path), max_bytes=2048)
+    for i in range(40):
+        a.put(f'{i:064d}', _unit(i), f'q{i}', f'a{i}', 0.0, 1e12)
+        if i % 7 == 0:
+            b.poll()
+    assert a._read_current() > 1
+    seen = [r['key'] for r in b.poll()]
+    assert seen[-1] == f'{39:064d}'
+    assert not (tmp_path / 'journal.0').exists()          # thế hệ cũ đã bị xoá
+
+
+def _cache(monkeypatch, journal):
+    c = SemanticCache()
+    c._db_loaded = True
+    c._shared = journal
+    monkeypatch.setattr(c, '_persist_to_db', lambda *a, **k: None)
+    monkeypatch.setattr(c, '_persist_hit', lambda *a, **k: None)
+    monkeypatch.setattr(c._writer, 'put_delete', lambda key: None)
+    return c
+
+
+def test_entries_and_invalidation_cross_workers(monkeypatch, tmp_path):
+    w1 = _cache(monkeypatch, SharedCacheJournal(str(tmp_path)))
+    w2 = _cache(monkeypatch, SharedCacheJournal(str(tmp_path)))
+    w1.store('thủ tục cấp CCCD', _vec(1), 'Đến công an phường')
+    hit = w2.lookup(_vec(1))
+    assert hit is not None and hit.answer == 'Đến công an phường'
+
+    assert w2.invalidate('thủ tục cấp CCCD') == 1
+    assert w2.lookup(_vec(1)) is None
+    assert w1.lookup(_vec(1)) is None
+
+    w1.store('a', _vec(2), 'A')
+    w2.store('b', _vec(3), 'B')
+    w1.invalidate()
+    assert w2.lookup(_vec(2)) is None and w2.lookup(_vec(3)) is None
+    assert len(w1._store) == 0 and len(w2._store) == 0
+
+
+def test_dimension_mismatch_from_journal_is_ignored(monkeypatch, tmp_path):
+    w1 = _cache(monkeypatch, SharedCacheJournal(str(tmp_path)))
+    w2 = _cache(monkeypatch, SharedCacheJournal(str(tmp_path)))
+    w2.store('x', _vec(5, dim=8), 'X')
+    w1.store('y', _vec(6, dim=4), 'Y')                    # w1 dùng dim 4
+    w2.lookup(_vec(5, dim=8))
+    assert list(e.answer for e in w2._store.values()) == ['X']
+
+
+def test_seek_tail_skips_existing_records(tmp_path):
+    a, b = SharedCacheJournal(str(tmp_path)), SharedCacheJournal(str(tmp_path))
+    a.put('k' * 64, _unit(1), 'cũ', 'a', 0.0, 1e12)
+    b.seek_tail()
+    a.invalidate('k' * 64)
+    assert [r['op'] for r in b.poll()] == [OP_INVALIDATE]
+    b.rewind()
+    assert [r['op'] for r in b.poll()] == [OP_PUT, OP_INVALIDATE]
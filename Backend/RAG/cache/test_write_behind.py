@@ -0,0 +1,134 @@
+from datetime import datetime
+
+from RAG.cache.write_behind import WriteBehindQueue
+
+
+class _FakeConn:
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, stmt, params):
+        self.log.append((str(stmt), dict(params)))
+
+
+class _FakeEngine:
+    def __init__(self, fail=False):
+        self.statements = []
+        self.fail = fail
+
+    def begin(self):
+        engine = self
+
+        class _Ctx:
+            def __enter__(self):
+                if engine.fail:
+                    raise RuntimeError('db down')
+                return _FakeConn(engine.statements)
+
+            def __exit__(self, *exc):
+                return False
+        return _Ctx()
+
+
+def _params(key):
+    now = datetime.utcnow()
+    return {'key': key, 'query': key, 'vec': b'\x00\x00', 'dtype': 'float16',
+            'answer': 'a', 'hits': 0, 'created': now, 'last_hit': now, 'expires': now}
+
+
+def _queue(engine, **kw):
+    q = WriteBehindQueue(engine_factory=lambda: engine, **kw)
+    q._ensure_started = lambda: None          # flush thủ công, không cần thread nền
+    return q
+
+
+def test_hits_are_coalesced_into_one_update():
+    eng = _FakeEngine()
+    q = _queue(eng)
+    for _ in range(5):
+        q.put_hit('k1', datetime.utcnow())
+    q.put_hit('k2', datetime.utcnow())
+    assert q.stats()['queue_depth'] == 2
+    assert q.flush() == 2
+    assert len(eng.statements) == 1
+    sql, params = eng.statements[0]
+    assert 'UPDATE public.rag_semantic_cache' in sql
+    deltas = {params[f'k{i}']: params[f'd{i}'] for i in range(2)}
+    assert deltas == {'k1': 5, 'k2': 1}
+    assert q.stats()['queue_depth'] == 0 and q.stats()['flushes'] == 1
+
+
+def test_entries_flush_as_multi_row_upsert():
+    eng = _FakeEngine()
+    q = _queue(eng)
+    for i in range(3):
+        q.put_entry(f'k{i}', _params(f'k{i}'))
+    q.put_entry('k0', _params('k0'))          # trùng key → gộp
+    assert q.flush() == 3
+    sql, params = eng.statements[0]
+    assert 'INSERT INTO public.rag_semantic_cache' in sql and 'ON CONFLICT' in sql
+    assert {params['key0'], params['key1'], params['key2']} == {'k0', 'k1', 'k2'}
+
+
+def test_pending_is_bounded():
+    q = _queue(_FakeEngine(), max_pending=2)
+    for i in range(4):
+        q.put_entry(f'k{i}', _params(f'k{i}'))
+    assert list(q._entries) == ['k2', 'k3']
+    assert q.stats()['dropped'] == 2
+
+
+def test_failed_flush_requeues():
+    eng = _FakeEngine(fail=True)
+    q = _queue(eng)
+    q.put_entry('k0', _params('k0'))
+    q.put_hit('k0', datetime.utcnow())
+    assert q.flush() == 0
+    assert q.stats()['failures'] == 1 and q.stats()['queue_depth'] == 2
+    eng.fail = False
+    assert q.flush() == 2
+
+
+def test_close_flushes_remaining():
+    eng = _FakeEngine()
+    q = WriteBehindQueue(engine_factory=lambda: eng, flush_secs=60)
+    q.put_hit('k', datetime.utcnow())
+    q.close()
+    assert q.stats()['queue_depth'] == 0 and len(eng.statements) == 1
+
+
+def test_delete_drops_pending_writes_and_runs_first():
+    eng = _FakeEngine()
+    q = _queue(eng)
+    q.put_entry('k1', _params('k1'))
+    q.put_entry('k2', _params('k2'))
+    q.put_hit('k1', datetime.utcnow())
+    q.put_delete('k1')
+    assert q.flush() == 2                     # 1 delete + 1 entry (k2)
+    assert eng.statements[0][0].strip().startswith('DELETE') and eng.statements[0][1] == {'k0': 'k1'}
+    assert 'INSERT' in eng.statements[1][0] and eng.statements[1][1]['key0'] == 'k2'
+
+
+def test_delete_all_survives_failed_flush():
+    q = _queue(_FakeEngine(fail=True))
+    q.put_entry('k1', _params('k1'))
+    q.put_delete(None)
+    assert q.flush() == 0
+    assert q._delete_all and not q._entries
+
+
+def test_unavailable_engine_backs_off(monkeypatch):
+    import RAG.cache.write_behind as wb
+    calls, now = [], [100.0]
+    monkeypatch.setattr(wb.time, 'monotonic', lambda: now[0])
+    eng = _FakeEngine()
+    q = WriteBehindQueue(engine_factory=lambda: calls.append(1) or (eng if len(calls) > 2 else None),
+                         flush_secs=2, max_backoff=5)
+    q._ensure_started = lambda: None
+    q.put_hit('k', datetime.utcnow())
+    assert q.flush() == 0 and q.flush() == 0 and len(calls) == 1      # chờ backoff, không kết nối lại
+    assert q.stats()['db_backoff_s'] == 2 and q.stats()['queue_depth'] == 1
+    now[0] += 2
+    assert q.flush() == 0 and len(calls) == 2 and q.stats()['db_backoff_s'] == 4
+    now[0] += 4
+    assert q.flush() == 1 and q.stats()['db_backoff_s'] == 0
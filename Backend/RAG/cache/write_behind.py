@@ -0,0 +1,326 @@
+"""
+CAG — Write-behind persistence cho SemanticCache
+=================================================
+
+Đưa PostgreSQL ra khỏi đường đi của request: `store` và mỗi lần HIT chỉ ghi
+vào hàng đợi trong bộ nhớ, một thread nền gom lại và flush định kỳ bằng
+upsert nhiều dòng trong MỘT transaction.
+
+  • Entry mới   : gộp theo query_hash → INSERT … VALUES (…), (…) ON CONFLICT
+  • Hit counter : cộng dồn delta theo query_hash → UPDATE … FROM (VALUES …)
+                  (cộng vào giá trị trong DB nên nhiều worker không ghi đè nhau)
+  • Xoá         : DELETE theo query_hash (hoặc toàn bảng), chạy trước upsert
+
+Bộ nhớ bị chặn bởi RAG_CACHE_WB_MAX_PENDING; khi đầy, entry chờ lâu nhất bị
+bỏ (chỉ là cache — mất vài entry không sai dữ liệu). Hàng đợi được flush lần
+cuối khi process thoát (atexit).
+
+Khi PostgreSQL không kết nối được, hàng đợi được giữ nguyên và lần thử kết nối
+sau cách lần trước theo backoff (x2 mỗi lần, tối đa RAG_CACHE_WB_MAX_BACKOFF
+giây) thay vì mỗi chu kỳ flush; chỉ log một warning cho cả đợt mất kết nối.
+
+Tham số cấu hình (biến môi trường):
+  RAG_CACHE_FLUSH_SECS       : float, default 2.0   — chu kỳ flush
+  RAG_CACHE_WB_MAX_PENDING   : int,   default 10000 — số key chờ tối đa mỗi loại
+  RAG_CACHE_WB_MAX_BACKOFF   : float, default 300   — giây chờ tối đa giữa hai lần thử kết nối lại
+"""
+
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+
+log = get_logger('rag.cache')
+
+FLUSH_SECS:  float = float(os.getenv('RAG_CACHE_FLUSH_SECS', '2.0'))
+MAX_PENDING: int   = int(os.getenv('RAG_CACHE_WB_MAX_PENDING', '10000'))
+MAX_BACKOFF: float = float(os.getenv('RAG_CACHE_WB_MAX_BACKOFF', '300'))
+
+# Số dòng tối đa trong một câu lệnh VALUES
+_ROWS_PER_STATEMENT = 500
+
+
+def _default_engine():
+    from RAG.connect_SQL.connect_SQL import connect_sql
+    return connect_sql()
+
+
+class WriteBehindQueue:
+    """
+    Hàng đợi ghi trễ thread-safe. `put_entry` / `put_hit` chỉ thao tác dict
+    dưới lock (O(1)), không bao giờ chạm DB trên thread gọi.
+    """
+
+    def __init__(
+        self,
+        engine_factory: Callable[[], Any] = _default_engine,
+        flush_secs: float = FLUSH_SECS,
+        max_pending: int = MAX_PENDING,
+        max_backoff: float = MAX_BACKOFF,
+    ) -> None:
+        self._engine_factory = engine_factory
+        self._flush_secs  = max(0.05, flush_secs)
+        self._max_pending = max(1, max_pending)
+        self._max_backoff = max(self._flush_secs, max_backoff)
+        self._backoff     = 0.0            # > 0: DB đang không kết nối được
+        self._retry_at    = 0.0
+
+        self._lock    = threading.Lock()
+        self._entries: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._hits:    Dict[str, Tuple[int, datetime]] = {}
+        self._deletes: set = set()
+        self._delete_all = False
+
+        self._wake    = threading.Event()
+        self._stop    = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._flush_lock = threading.Lock()
+
+        # stats
+        self._flushes        = 0
+        self._failures       = 0
+        self._dropped        = 0
+        self._rows_written   = 0
+        self._last_flush_ms  = 0.0
+        self._total_flush_ms = 0.0
+
+    # ── producer side ─────────────────────────────────────────────────────────
+
+    def put_entry(self, key: str, params: Dict[str, Any]) -> None:
+        """Xếp hàng upsert một entry (params theo cột của rag_semantic_cache)."""
+        with self._lock:
+            self._entries[key] = params
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_pending:
+                self._entries.popitem(last=False)
+                self._dropped += 1
+        self._ensure_started()
+
+    def put_hit(self, key: str, at: datetime) -> None:
+        """Cộng 1 hit cho key; các hit cùng key trong một chu kỳ gộp thành một dòng."""
+        with self._lock:
+            delta, last = self._hits.get(key, (0, at))
+            if key not in self._hits and len(self._hits) >= self._max_pending:
+                self._dropped += 1
+                return
+            self._hits[key] = (delta + 1, max(last, at))
+        self._ensure_started()
+
+    def put_delete(self, key: Optional[str]) -> None:
+        """Xếp hàng xoá một key (key=None → xoá toàn bộ bảng); bỏ các ghi đang chờ của key."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._hits.clear()
+                self._deletes.clear()
+                self._delete_all = True
+            else:
+                self._entries.pop(key, None)
+                self._hits.pop(key, None)
+                self._deletes.add(key)
+        self._ensure_started()
+        self._wake.set()
+
+    # ── lifecycle ─────────────────────────────────────────────────────────────
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='cag-write-behind', daemon=True,
+            )
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self._flush_secs)
+            self._wake.clear()
+            self.flush()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Dừng thread nền và flush phần còn lại (gọi khi shutdown)."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    # ── consumer side ─────────────────────────────────────────────────────────
+
+    def flush(self) -> int:
+        """Ghi toàn bộ hàng đợi hiện tại xuống DB. Trả về số dòng đã ghi."""
+        with self._flush_lock:
+            with self._lock:
+                if not (self._entries or self._hits or self._deletes or self._delete_all):
+                    return 0
+            engine = self._engine()
+            if engine is None:
+                return 0                       # giữ nguyên hàng đợi, chờ lần thử sau
+            with self._lock:
+                entries, self._entries = self._entries, OrderedDict()
+                hits, self._hits = self._hits, {}
+                deletes, self._deletes = self._deletes, set()
+                delete_all, self._delete_all = self._delete_all, False
+
+            t0 = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    rows  = self._write_deletes(conn, deletes, delete_all)
+                    rows += self._write_entries(conn, list(entries.values()))
+                    rows += self._write_hits(conn, hits)
+            except Exception as exc:
+                self._failures += 1
+                self._requeue(entries, hits, deletes, delete_all)
+                log.debug(f'[CAG] write-behind flush failed (non-fatal): {exc}')
+                return 0
+
+            elapsed = (time.perf_counter() - t0) * 1000
+            self._flushes        += 1
+            self._rows_written   += rows
+            self._last_flush_ms   = elapsed
+            self._total_flush_ms += elapsed
+            return rows
+
+    def _engine(self) -> Any:
+        """Engine từ factory, hoặc None khi DB không kết nối được / đang chờ backoff."""
+        if self._backoff and time.monotonic() < self._retry_at:
+            return None
+        try:
+            engine, reason = self._engine_factory(), 'no database engine'
+        except Exception as exc:
+            engine, reason = None, exc
+        if engine is not None:
+            if self._backoff:
+                log.info('[CAG] write-behind: PostgreSQL kết nối lại — tiếp tục flush')
+                self._backoff = 0.0
+            return engine
+        if not self._backoff:
+            log.warning(f'[CAG] write-behind: PostgreSQL không khả dụng ({reason}) — '
+                        f'giữ hàng đợi, thử lại với backoff tối đa {self._max_backoff:.0f}s')
+        self._backoff  = min(self._max_backoff, max(self._flush_secs, self._backoff * 2))
+        self._retry_at = time.monotonic() + self._backoff
+        return None
+
+    def _requeue(
+        self,
+        entries: 'OrderedDict[str, Dict[str, Any]]',
+        hits: Dict[str, Tuple[int, datetime]],
+        deletes: set = frozenset(),
+        delete_all: bool = False,
+    ) -> None:
+        """Trả lại phần chưa ghi vào hàng đợi (dữ liệu mới hơn được ưu tiên)."""
+        with self._lock:
+            # Lệnh xoá luôn được giữ lại; ghi mới hơn của cùng key vẫn đứng sau nó
+            self._delete_all = self._delete_all or delete_all
+            self._deletes.update(deletes)
+            if delete_all:
+                entries, hits = OrderedDict(), {}
+            else:
+                entries = OrderedDict((k, v) for k, v in entries.items() if k not in deletes)
+                hits = {k: v for k, v in hits.items() if k not in deletes}
+            for key, params in entries.items():
+                if key not in self._entries:
+                    self._entries[key] = params
+                    self._entries.move_to_end(key, last=False)
+            while len(self._entries) > self._max_pending:
+                self._entries.popitem(last=False)
+                self._dropped += 1
+            for key, (delta, last) in hits.items():
+                cur_delta, cur_last = self._hits.get(key, (0, last))
+                if key not in self._hits and len(self._hits) >= self._max_pending:
+                    self._dropped += 1
+                    continue
+                self._hits[key] = (cur_delta + delta, max(cur_last, last))
+
+    @staticmethod
+    def _write_deletes(conn, deletes: set, delete_all: bool) -> int:
+        from sqlalchemy import text  # type: ignore
+        if delete_all:
+            conn.execute(text('DELETE FROM public.rag_semantic_cache'))
+            return 1
+        keys = sorted(deletes)
+        for start in range(0, len(keys), _ROWS_PER_STATEMENT):
+            chunk  = keys[start:start + _ROWS_PER_STATEMENT]
+            params = {f'k{i}': k for i, k in enumerate(chunk)}
+            conn.execute(text(
+                'DELETE FROM public.rag_semantic_cache WHERE query_hash IN ('
+                + ', '.join(f':k{i}' for i in range(len(chunk))) + ')'
+            ), params)
+        return len(keys)
+
+    @staticmethod
+    def _write_entries(conn, entries: List[Dict[str, Any]]) -> int:
+        from sqlalchemy import text  # type: ignore
+        cols = ('key', 'query', 'vec', 'dtype', 'answer',
+                'hits', 'created', 'last_hit', 'expires')
+        for start in range(0, len(entries), _ROWS_PER_STATEMENT):
+            chunk  = entries[start:start + _ROWS_PER_STATEMENT]
+            values = []
+            params: Dict[str, Any] = {}
+            for i, e in enumerate(chunk):
+                values.append('(' + ', '.join(f':{c}{i}' for c in cols) + ')')
+                params.update({f'{c}{i}': e[c] for c in cols})
+            conn.execute(text(f"""
+                INSERT INTO public.rag_semantic_cache
+                    (query_hash, query_text, query_vector_bin, vector_dtype,
+                     answer_text, hit_count, created_at, last_hit_at, expires_at)
+                VALUES {', '.join(values)}
+                ON CONFLICT (query_hash) DO UPDATE SET
+                    hit_count        = GREATEST(rag_semantic_cache.hit_count, EXCLUDED.hit_count),
+                    last_hit_at      = EXCLUDED.last_hit_at,
+                    expires_at       = EXCLUDED.expires_at,
+                    query_vector_bin = EXCLUDED.query_vector_bin,
+                    vector_dtype     = EXCLUDED.vector_dtype,
+                    query_vector     = NULL
+            """), params)
+        return len(entries)
+
+    @staticmethod
+    def _write_hits(conn, hits: Dict[str, Tuple[int, datetime]]) -> int:
+        from sqlalchemy import text  # type: ignore
+        items = list(hits.items())
+        for start in range(0, len(items), _ROWS_PER_STATEMENT):
+            chunk  = items[start:start + _ROWS_PER_STATEMENT]
+            values = []
+            params: Dict[str, Any] = {}
+            for i, (key, (delta, last)) in enumerate(chunk):
+                values.append(
+                    f'(:k{i}, CAST(:d{i} AS INTEGER), CAST(:t{i} AS TIMESTAMP))'
+                )
+                params.update({f'k{i}': key, f'd{i}': delta, f't{i}': last})
+            conn.execute(text(f"""
+                UPDATE public.rag_semantic_cache AS c
+                SET hit_count   = c.hit_count + v.delta,
+                    last_hit_at = GREATEST(c.last_hit_at, v.ts AT TIME ZONE 'UTC')
+                FROM (VALUES {', '.join(values)}) AS v(query_hash, delta, ts)
+                WHERE c.query_hash = v.query_hash
+            """), params)
+        return len(items)
+
+    # ── observability ─────────────────────────────────────────────────────────
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            depth = len(self._entries) + len(self._hits) + len(self._deletes)
+        return {
+            'queue_depth':      depth,
+            'db_backoff_s':     round(self._backoff, 2),
+            'flushes':          self._flushes,
+            'failures':         self._failures,
+            'dropped':          self._dropped,
+            'rows_written':     self._rows_written,
+            'last_flush_ms':    round(self._last_flush_ms, 2),
+            'avg_flush_ms':     round(self._total_flush_ms / self._flushes, 2) if self._flushes else 0.0,
+        }
@@ -0,0 +1,94 @@
+"""
+Build lexical (BM25) index cho hybrid retrieval trong RAG/tools/rag.py.
+
+Dùng đúng nguồn + id như ChromaDB để RRF fuse được theo tài liệu:
+  - faqs_collection  : faqs.csv (nếu có) hoặc các xlsx trong RAG/data/
+  - thanhhoa_congan  : embed_thanhhoa.prepare_congan()
+  - thanhhoa_ubnd    : embed_thanhhoa.prepare_ubnd()
+
+Chạy:
+  python Backend/RAG/create_vecto_db/build_lexical_index.py
+  python Backend/RAG/create_vecto_db/build_lexical_index.py --out /tmp/lexical_index.json.gz
+"""
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+_DIR = Path(__file__).parent
+sys.path.insert(0, str(_DIR))
+sys.path.insert(0, str(_DIR.parent.parent))
+
+import embed_thanhhoa                                    # noqa: E402
+from merge_xlsx_to_csv import XLSX_FILES, load_xlsx     # noqa: E402
+from RAG.tools.lexical_index import LexicalIndex        # noqa: E402
+
+_RAG_DIR     = _DIR.parent
+_CSV_PATH    = _DIR / "faqs.csv"
+_DATA_DIR    = _RAG_DIR / "data"
+_TH_DATA_DIR = _RAG_DIR / "Thanh Hóa-20260316T123545Z-3-001" / "Thanh Hóa"
+_OUT_PATH    = _RAG_DIR / "chroma_db" / "lexical_index.json.gz"
+
+
+def faq_docs() -> list[dict]:
+    if _CSV_PATH.exists():
+        df = pd.read_csv(_CSV_PATH, encoding="utf-8").fillna("")
+        rows = zip(df["id"].astype(str), df["title"], df["answer_text"])
+    else:
+        rows = []
+        for name in XLSX_FILES:
+            path = _DATA_DIR / name
+            if not path.exists():
+                continue
+            try:
+                df = load_xlsx(path)
+            except Exception as e:
+                logging.warning(f"{name}: {e}")
+                continue
+            rows.extend(zip(df["id"], df["question"], df["answer"]))
+    docs, seen = [], set()
+    for doc_id, title, answer in rows:
+        if doc_id in seen:
+            continue
+        seen.add(doc_id)
+        docs.append({"id": doc_id, "source": "faqs_collection",
+                     "title": str(title).strip(), "answer_text": str(answer).strip()})
+    logging.info(f"[FAQ] {len(docs)} câu hỏi")
+    return docs
+
+
+def thanhhoa_docs(data_dir: Path) -> list[dict]:
+    embed_thanhhoa.BASE_DATA = str(data_dir)
+    docs = []
+    for source, prepare in (("thanhhoa_congan", embed_thanhhoa.prepare_congan),
+                            ("thanhhoa_ubnd",   embed_thanhhoa.prepare_ubnd)):
+        try:
+            records = prepare()
+        except Exception as e:
+            logging.warning(f"[{source}] bỏ qua: {e}")
+            continue
+        docs.extend({"id": r["id"], "source": source, "title": r["title"],
+                     "answer_text": r["answer_text"]} for r in records)
+    return docs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", type=Path, default=_OUT_PATH)
+    parser.add_argument("--thanhhoa-dir", type=Path, default=_TH_DATA_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    t0 = time.time()
+    docs = faq_docs() + thanhhoa_docs(args.thanhhoa_dir)
+    index = LexicalIndex.build(docs)
+    index.save(args.out)
+    logging.info(f"Đã ghi {args.out} ({len(index)} docs, "
+                 f"{args.out.stat().st_size / 1024:.0f} KB) sau {time.time() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
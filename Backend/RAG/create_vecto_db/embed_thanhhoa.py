@@ -9,8 +9,6 @@ Xử lý 3 nguồn dữ liệu:
 import os, sys, time, json, shutil, logging
 from datetime import datetime
 import pandas as pd
-from sentence_transformers import SentenceTransformer
-import chromadb
 
 # ──────────────────────────────────────────────
 # CONFIG
@@ -51,6 +49,7 @@ def setup_logger():
 # LOAD MODEL
 # ──────────────────────────────────────────────
 def load_model():
+    from sentence_transformers import SentenceTransformer
     logging.info(f"Tải mô hình: {MODEL_PATH}")
     model = SentenceTransformer(MODEL_PATH)
     logging.info("Tải mô hình OK")
@@ -254,6 +253,7 @@ def prepare_diadiem():
 # MAIN
 # ──────────────────────────────────────────────
 if __name__ == "__main__":
+    import chromadb
     setup_logger()
 
     os.makedirs(CHROMA_DIR, exist_ok=True)
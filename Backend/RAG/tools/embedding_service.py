@@ -0,0 +1,215 @@
+"""
+Embedding service — LRU cache + micro-batching trước SentenceTransformer
+=======================================================================
+
+Cùng một câu hỏi thường được embed nhiều lần trong một lượt chat
+(cache_check → search_project_documents → cache_store). Service này:
+
+  1. Chuẩn hoá text (Unicode NFC + gộp khoảng trắng) làm key cho một LRU
+     trong bộ nhớ → các lần gọi lặp lại trả về ngay, không chạy model.
+  2. Gom các yêu cầu miss đến từ nhiều thread Flask trong vài ms thành MỘT
+     lần `encode(batch)` trên thread nền — một forward pass cho N câu rẻ hơn
+     nhiều so với N forward pass.
+  3. Các yêu cầu trùng text đang chờ trong cùng cửa sổ dùng chung một kết quả.
+
+Vector được giữ dạng np.ndarray float32 chỉ-đọc (4 byte/chiều thay vì một
+PyFloat ~24 byte + con trỏ) và trả thẳng cho caller, không copy; đổi sang
+list chỉ ở biên public (`get_embedding` trong rag.py).
+
+Tham số cấu hình (biến môi trường):
+  RAG_EMBED_CACHE_SIZE      : int,   default 4096 — số embedding giữ trong LRU
+  RAG_EMBED_BATCH_MAX       : int,   default 32   — số câu tối đa mỗi batch
+  RAG_EMBED_BATCH_WAIT_MS   : float, default 5    — thời gian chờ gom batch
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+
+logger = get_logger('rag.embedding')
+
+EMBED_CACHE_SIZE:    int   = int(os.getenv('RAG_EMBED_CACHE_SIZE', '4096'))
+EMBED_BATCH_MAX:     int   = int(os.getenv('RAG_EMBED_BATCH_MAX', '32'))
+EMBED_BATCH_WAIT_MS: float = float(os.getenv('RAG_EMBED_BATCH_WAIT_MS', '5'))
+
+_WS_RE = re.compile(r'\s+')
+
+# encode_fn nhận list[str], trả về ma trận (n, dim) hoặc list các vector
+EncodeFn = Callable[[List[str]], Sequence[Sequence[float]]]
+
+_EMPTY = np.zeros(0, dtype=np.float32)
+_EMPTY.setflags(write=False)
+
+
+def _readonly(vec: Sequence[float]) -> np.ndarray:
+    arr = np.array(vec, dtype=np.float32)              # luôn copy: không giữ view của ma trận batch
+    arr.setflags(write=False)
+    return arr
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hoá text trước khi embed / làm key cache."""
+    return _WS_RE.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+class EmbeddingService:
+    """
+    Thread-safe. `embed(text)` chặn tới khi có kết quả; `embed_many(texts)`
+    đẩy cả danh sách vào cùng cửa sổ gom batch.
+    """
+
+    def __init__(
+        self,
+        encode_fn: EncodeFn,
+        cache_size: int = EMBED_CACHE_SIZE,
+        max_batch: int = EMBED_BATCH_MAX,
+        max_wait_ms: float = EMBED_BATCH_WAIT_MS,
+    ) -> None:
+        self._encode_fn  = encode_fn
+        self._cache_size = max(0, cache_size)
+        self._max_batch  = max(1, max_batch)
+        self._max_wait   = max(0.0, max_wait_ms) / 1000.0
+
+        self._lock     = threading.Lock()
+        self._cache:   OrderedDict[str, np.ndarray] = OrderedDict()
+        self._pending: OrderedDict[str, Future] = OrderedDict()   # chờ encode
+        self._inflight: Dict[str, Future] = {}                     # đang encode
+        self._wake     = threading.Event()
+        self._thread:  Optional[threading.Thread] = None
+
+        # stats
+        self._hits    = 0
+        self._misses  = 0
+        self._batches = 0
+        self._encoded = 0
+
+    # ── public API ────────────────────────────────────────────────────────────
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """
+        Embed nhiều text; text rỗng trả về vector rỗng. Thứ tự kết quả giữ
+        nguyên. Vector float32 chỉ-đọc, dùng chung với cache — đừng sửa tại chỗ.
+        """
+        keys = [normalize_text(t or '') for t in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        waits: List[Tuple[int, Future]] = []
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                if not key:
+                    results[i] = _EMPTY
+                    continue
+                vec = self._cache.get(key)
+                if vec is not None:
+                    self._cache.move_to_end(key)
+                    self._hits += 1
+                    results[i] = vec
+                    continue
+                self._misses += 1
+                fut = self._inflight.get(key) or self._pending.get(key)
+                if fut is None:
+                    fut = Future()
+                    self._pending[key] = fut
+                waits.append((i, fut))
+
+        if waits:
+            self._ensure_started()
+            self._wake.set()
+            for i, fut in waits:
+                results[i] = fut.result()
+        return results  # type: ignore[return-value]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'cached':         len(self._cache),
+                'hits':           self._hits,
+                'misses':         self._misses,
+                'hit_rate':       self._hits / total if total else 0.0,
+                'batches':        self._batches,
+                'avg_batch_size': self._encoded / self._batches if self._batches else 0.0,
+            }
+
+    # ── batching worker ───────────────────────────────────────────────────────
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='embedding-batcher', daemon=True,
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            # Cửa sổ gom batch: chờ thêm yêu cầu tới khi đủ max_batch hoặc hết hạn
+            deadline = time.perf_counter() + self._max_wait
+            while time.perf_counter() < deadline:
+                with self._lock:
+                    if len(self._pending) >= self._max_batch:
+                        break
+                time.sleep(min(0.001, self._max_wait))
+            with self._lock:
+                batch: List[Tuple[str, Future]] = []
+                while self._pending and len(batch) < self._max_batch:
+                    batch.append(self._pending.popitem(last=False))
+                self._inflight.update(batch)
+                if not self._pending:
+                    self._wake.clear()
+            if batch:
+                self._encode_batch(batch)
+
+    def _encode_batch(self, batch: List[Tuple[str, Future]]) -> None:
+        texts = [key for key, _ in batch]
+        try:
+            vectors = self._encode_fn(texts)
+            rows = [_readonly(v) for v in vectors]
+            if len(rows) != len(texts):
+                raise RuntimeError(f'encode trả về {len(rows)} vector cho {len(texts)} text')
+        except Exception as exc:
+            logger.warning('[embed] batch %d text lỗi: %s', len(texts), exc)
+            with self._lock:
+                for key, _ in batch:
+                    self._inflight.pop(key, None)
+            for _, fut in batch:
+                fut.set_exception(exc)
+            return
+
+        with self._lock:
+            self._batches += 1
+            self._encoded += len(texts)
+            for key, vec in zip(texts, rows):
+                self._inflight.pop(key, None)
+                if self._cache_size:
+                    self._cache[key] = vec
+                    self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        for (_, fut), vec in zip(batch, rows):
+            fut.set_result(vec)
+        if len(texts) > 1:
+            logger.debug('[embed] batch %d text', len(texts))
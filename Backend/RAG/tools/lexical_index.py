@@ -0,0 +1,209 @@
+"""
+Lexical (BM25) inverted index cho FAQ / DVC Thanh Hóa
+=====================================================
+
+Retrieval dense bỏ lỡ các truy vấn theo mã / tên chính xác ("CT01", "GPLX",
+"CCCD") vì câu diễn giải thường có cosine cao hơn. Module này cung cấp một
+inverted index BM25 được build OFFLINE từ cùng nguồn dữ liệu với ChromaDB
+(xem create_vecto_db/build_lexical_index.py) và được fuse với kết quả dense
+bằng reciprocal-rank fusion trong tools/rag.py.
+
+Tokenisation tiếng Việt:
+  • fold dấu (NFD, bỏ dấu thanh + mũ, đ → d), lowercase
+  • token = âm tiết [a-z0-9]+  +  bigram các âm tiết liền kề ("can_cuoc")
+    (từ tiếng Việt thường gồm 2 âm tiết — bigram giữ được nghĩa từ ghép)
+
+Trọng số BM25 của từng posting được tính sẵn khi build, nên query chỉ là
+cộng dồn mảng numpy — vài chục micro-giây, không cần encode model.
+
+Định dạng artefact: JSON nén gzip
+  {"version", "docs": [{id, source, title, answer_text}, ...],
+   "postings": {term: [[doc_idx, ...], [weight, ...]]}}
+"""
+
+import gzip
+import json
+import math
+import re
+import sys
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+
+logger = get_logger('rag.lexical')
+
+INDEX_VERSION = 1
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Mã / viết tắt trong query gốc: "CT01", "GPLX", "CCCD", "TK1-TS"
+_CODE_RE = re.compile(r'\b(?:[A-Za-z]+\d[A-Za-z0-9]*|[A-ZĐ]{2,})\b')
+
+# Tiêu đề (câu hỏi / tên thủ tục) quan trọng hơn nội dung trả lời
+_TITLE_WEIGHT = 3
+
+
+def fold(text: str) -> str:
+    """Bỏ dấu tiếng Việt + lowercase: 'Căn cước Đ' → 'can cuoc d'."""
+    text = unicodedata.normalize('NFD', text.lower()).replace('đ', 'd')
+    return ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+
+
+def syllables(text: str) -> List[str]:
+    return _TOKEN_RE.findall(fold(text or ''))
+
+
+def tokenize(text: str) -> List[str]:
+    """Âm tiết + bigram âm tiết liền kề."""
+    syl = syllables(text)
+    return syl + [f'{a}_{b}' for a, b in zip(syl, syl[1:])]
+
+
+class LexicalIndex:
+    """Inverted index BM25 chỉ-đọc (build bằng `build`, nạp bằng `load`)."""
+
+    def __init__(self, docs: List[dict], postings: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> None:
+        self.docs = docs
+        self._postings = postings
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    # ── build / persist ───────────────────────────────────────────────────────
+
+    @classmethod
+    def build(cls, docs: Iterable[dict], k1: float = 1.2, b: float = 0.75) -> 'LexicalIndex':
+        """docs: iterable {id, source, title, answer_text}."""
+        kept: List[dict] = []
+        term_freqs: List[Counter] = []
+        for d in docs:
+            title = str(d.get('title') or '').strip()
+            if not title:
+                continue
+            tf = Counter(tokenize(title) * _TITLE_WEIGHT)
+            tf.update(tokenize(str(d.get('answer_text') or '')))
+            kept.append({
+                'id':          str(d.get('id', '')),
+                'source':      str(d.get('source', '')),
+                'title':       title,
+                'answer_text': str(d.get('answer_text') or ''),
+            })
+            term_freqs.append(tf)
+
+        n = len(kept)
+        lengths = np.array([sum(tf.values()) for tf in term_freqs], dtype=np.float64)
+        avgdl = float(lengths.mean()) if n else 1.0
+
+        raw: Dict[str, Tuple[List[int], List[float]]] = defaultdict(lambda: ([], []))
+        for i, tf in enumerate(term_freqs):
+            norm = k1 * (1 - b + b * lengths[i] / avgdl)
+            for term, f in tf.items():
+                idx, w = raw[term]
+                idx.append(i)
+                w.append(f * (k1 + 1) / (f + norm))
+
+        postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for term, (idx, w) in raw.items():
+            df = len(idx)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            postings[term] = (np.asarray(idx, dtype=np.int32),
+                              np.asarray(w, dtype=np.float32) * idf)
+        logger.info('[lexical] build: %d docs, %d terms', n, len(postings))
+        return cls(kept, postings)
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            'version':  INDEX_VERSION,
+            'docs':     self.docs,
+            'postings': {t: [idx.tolist(), [round(float(x), 5) for x in w]]
+                         for t, (idx, w) in self._postings.items()},
+        }
+        tmp = path.with_suffix(path.suffix + '.tmp')
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['LexicalIndex']:
+        """Nạp artefact; None nếu không có / sai version."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                payload = json.load(f)
+            if payload.get('version') != INDEX_VERSION:
+                logger.warning('[lexical] %s sai version — bỏ qua', path)
+                return None
+            postings = {
+                t: (np.asarray(idx, dtype=np.int32), np.asarray(w, dtype=np.float32))
+                for t, (idx, w) in payload['postings'].items()
+            }
+            return cls(payload['docs'], postings)
+        except Exception as exc:
+            logger.warning('[lexical] Không nạp được %s: %s', path, exc)
+            return None
+
+    # ── query ─────────────────────────────────────────────────────────────────
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[float, dict]]:
+        """Trả về [(bm25_score, doc), ...] giảm dần, chỉ doc có score > 0."""
+        terms = [t for t in set(tokenize(query)) if t in self._postings]
+        if not terms or not self.docs:
+            return []
+        scores = np.zeros(len(self.docs), dtype=np.float32)
+        for t in terms:
+            idx, w = self._postings[t]
+            scores[idx] += w
+        k = min(top_k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(float(scores[i]), self.docs[i]) for i in top]
+
+    @staticmethod
+    def exact_hits(
+        query: str,
+        hits: List[Tuple[float, dict]],
+        max_tokens: int = 4,
+    ) -> Optional[List[Tuple[float, dict]]]:
+        """
+        Nhận diện truy vấn "tra cứu chính xác" có thể trả lời chỉ bằng lexical:
+          • query trùng nguyên tiêu đề một doc (tên thủ tục) → doc đó lên đầu
+          • query chứa mã / viết tắt và mọi âm tiết nằm trong tiêu đề doc đầu
+        Trả về hits (đã sắp lại) hoặc None nếu phải dùng dense.
+        """
+        q = syllables(query)
+        if not q or not hits or len(q) > max_tokens:
+            return None
+        for i, (_, doc) in enumerate(hits):
+            if syllables(doc.get('title', '')) == q:
+                return [hits[i]] + hits[:i] + hits[i + 1:]
+        if _CODE_RE.search(query) and set(q).issubset(syllables(hits[0][1].get('title', ''))):
+            return hits
+        return None
+
+
+def rrf_fuse(rankings: List[List[Tuple[str, dict]]], k: int = 60, top_k: int = 5) -> List[Tuple[float, dict]]:
+    """
+    Reciprocal-rank fusion: score(d) = Σ 1 / (k + rank_i(d)).
+    rankings: mỗi phần tử là list (key, item) đã sắp xếp; item đầu tiên gặp
+    cho mỗi key được giữ lại.
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    items: Dict[str, dict] = {}
+    for ranking in rankings:
+        for rank, (key, item) in enumerate(ranking, 1):
+            scores[key] += 1.0 / (k + rank)
+            items.setdefault(key, item)
+    order = sorted(scores, key=lambda key: scores[key], reverse=True)[:top_k]
+    return [(scores[key], items[key]) for key in order]
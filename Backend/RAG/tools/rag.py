@@ -1,12 +1,17 @@
 from pathlib import Path
+import heapq
+import os
 import sys
-import chromadb
-from sentence_transformers import SentenceTransformer
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from functools import lru_cache
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from logger import get_logger
+from RAG.utils import rag_metrics
 from RAG.utils.rag_metrics import log_retrieval_metrics
+from RAG.tools.embedding_service import EmbeddingService
+from RAG.tools.lexical_index import LexicalIndex, rrf_fuse
 
 logger = get_logger('rag.retrieval')
 
@@ -25,6 +30,29 @@ _COLLECTIONS = [
 # Ngưỡng cosine tối thiểu — kết quả dưới ngưỡng này bị loại bỏ
 _MIN_COSINE = 0.30
 
+# Số kết quả cuối cùng sau khi merge các collection
+_TOP_K = 5
+
+# Timeout cho mỗi collection — collection chậm bị bỏ qua thay vì chặn câu trả lời
+_COLLECTION_TIMEOUT = float(os.getenv("RAG_COLLECTION_TIMEOUT_SECS", "3.0"))
+
+# Lexical (BM25) index build offline bởi create_vecto_db/build_lexical_index.py
+_LEXICAL_INDEX_PATH = Path(os.getenv(
+    "RAG_LEXICAL_INDEX_PATH", str(_RAG_DIR / "chroma_db" / "lexical_index.json.gz")))
+# Hằng số k của reciprocal-rank fusion
+_RRF_K = 60
+# Query ngắn (≤ N âm tiết) khớp trọn tiêu đề → trả lời thẳng từ lexical, không encode
+_LEXICAL_FASTPATH_MAX_TOKENS = int(os.getenv("RAG_LEXICAL_FASTPATH_MAX_TOKENS", "4"))
+
+# Mỗi collection một executor nhỏ: các collection của một query chạy song song
+# (latency retrieval = max thay vì tổng). Query Chroma đang chạy không huỷ được,
+# nên số query đang chạy mỗi collection bị chặn ở mức này — collection bị treo
+# chỉ giữ worker của chính nó và bị bỏ qua ngay, không làm nghẽn collection khác.
+_COLLECTION_WORKERS = max(1, int(os.getenv("RAG_RETRIEVAL_WORKERS_PER_COLLECTION", "4")))
+_collection_pools: dict[str, ThreadPoolExecutor] = {}
+_collection_inflight: dict[str, int] = {}
+_collection_lock = threading.Lock()
+
 
 _HF_MODEL_REPO  = "AITeamVN/Vietnamese_Embedding"
 _HF_TOKENIZER_REPO = "BAAI/bge-m3"
@@ -85,6 +113,7 @@ def _download_missing_files(path: Path) -> None:
 
 @lru_cache(maxsize=1)
 def load_model():
+    from sentence_transformers import SentenceTransformer  # lazy — nặng
     if not _model_is_ready(_MODEL_PATH):
         _download_missing_files(_MODEL_PATH)
     model = SentenceTransformer(str(_MODEL_PATH), model_kwargs={"torch_dtype": "float16"})
@@ -95,6 +124,7 @@ def load_model():
 def _get_collection(chroma_path: str, collection_name: str):
     """Mở một ChromaDB collection, trả None nếu không tồn tại."""
     try:
+        import chromadb  # lazy
         client = chromadb.PersistentClient(path=chroma_path)
         return client.get_collection(collection_name)
     except Exception as e:
@@ -102,23 +132,36 @@ def _get_collection(chroma_path: str, collection_name: str):
         return None
 
 
+def _encode_batch(texts: list[str]):
+    # normalize_embeddings=True → unit vector → cosine ≡ dot product, L2 đúng hơn
+    return load_model().encode(texts, normalize_embeddings=True, batch_size=len(texts))
+
+
+# LRU theo text đã chuẩn hoá + gom các request đồng thời thành một batch encode
+_embedder = EmbeddingService(_encode_batch)
+
+
 def get_embedding(text: str) -> list:
     if not text.strip():
         logger.debug("get_embedding: empty text skipped")
         return []
-    model = load_model()
-    # normalize_embeddings=True → unit vector → cosine ≡ dot product, L2 đúng hơn
-    return model.encode(text, normalize_embeddings=True).tolist()
+    return _embedder.embed(text).tolist()
+
+
+def get_embeddings(texts: list[str]) -> list[list]:
+    """Embed nhiều text trong một batch (text rỗng → [])."""
+    return [v.tolist() for v in _embedder.embed_many(texts)]
 
 
 def _query_collection(collection, query_embed: list, n_results: int = 5, query: str = "") -> list[dict]:
-    n = n_results
-    """Query một collection, trả về list {cosine, metadata}."""
+    """Query một collection, trả về list {cosine, meta}."""
+    with_metrics = rag_metrics.METRICS_ENABLED
+    include = ["metadatas", "distances"] + (["embeddings"] if with_metrics else [])
     try:
         results = collection.query(
             query_embeddings=[query_embed],
-            n_results=n,
-            include=["metadatas", "distances", "embeddings"],
+            n_results=n_results,
+            include=include,
         )
     except Exception as e:
         logger.warning("Query collection lỗi: %s", e)
@@ -126,67 +169,170 @@ def _query_collection(collection, query_embed: list, n_results: int = 5, query:
 
     metadatas  = results["metadatas"][0]
     distances  = results["distances"][0]   # cosine space → distance = 1 - cosine
-    embeddings = results.get("embeddings", [[]])[0]
-
-    # Log metrics
-    if embeddings and len(embeddings) == len(metadatas):
-        try:
-            log_retrieval_metrics(
-                query=query,
-                query_vec=query_embed,
-                doc_embeddings=embeddings,
-                doc_metadatas=metadatas,
-                chroma_distances=distances,
-            )
-        except Exception:
-            pass
+    ids        = (results.get("ids") or [[None] * len(metadatas)])[0]
+
+    # Log metrics (chỉ khi bật RAG_RETRIEVAL_METRICS — cần lấy thêm embeddings)
+    if with_metrics:
+        embeddings = (results.get("embeddings") or [[]])[0]
+        if embeddings is not None and len(embeddings) == len(metadatas):
+            try:
+                log_retrieval_metrics(
+                    query=query,
+                    query_vec=query_embed,
+                    doc_embeddings=embeddings,
+                    doc_metadatas=metadatas,
+                    chroma_distances=distances,
+                )
+            except Exception:
+                pass
 
     hits = []
-    for meta, dist in zip(metadatas, distances):
+    for doc_id, meta, dist in zip(ids, metadatas, distances):
         cosine = 1.0 - dist  # ChromaDB cosine space: distance = 1 - similarity
         if cosine >= _MIN_COSINE:
-            hits.append({"cosine": cosine, "meta": meta})
+            hits.append({"cosine": cosine, "meta": meta, "id": doc_id})
     return hits
 
 
-def search_project_documents(query: str):
+@lru_cache(maxsize=1)
+def _lexical_index() -> LexicalIndex | None:
+    index = LexicalIndex.load(_LEXICAL_INDEX_PATH)
+    if index is None:
+        logger.info("[RAG] Không có lexical index (%s) — chỉ dùng dense", _LEXICAL_INDEX_PATH)
+    else:
+        logger.info("[RAG] Lexical index: %d docs", len(index))
+    return index
+
+
+def _lexical_hit(score: float, doc: dict) -> dict:
+    return {
+        "cosine": None,
+        "bm25":   score,
+        "meta":   {"title": doc["title"], "answer_text": doc["answer_text"]},
+        "source": doc["source"],
+        "id":     doc["id"],
+    }
+
+
+def _hit_key(h: dict) -> str:
+    ident = h.get("id") or (h["meta"].get("answer_text") or "")[:120]
+    return f"{h.get('source')}:{ident}"
+
+
+def retrieve(query: str, top_k: int = _TOP_K, query_embed: list | None = None) -> list[dict]:
     """
-    Tìm kiếm trên tất cả collections, merge kết quả theo cosine giảm dần.
-    Trả về top-5 answer_text tốt nhất.
+    Hybrid retrieval: BM25 (lexical index) + dense (Chroma), fuse bằng RRF.
+    Query ngắn trùng tên thủ tục hoặc chứa mã / viết tắt khớp tiêu đề được
+    trả lời thẳng từ lexical index, không cần encode.
+    Trả về list {cosine, meta, source, id[, bm25, rrf]}.
     """
-    query_embed = get_embedding(query)
+    lex = _lexical_index()
+    lex_hits = lex.search(query, top_k=top_k * 2) if lex is not None else []
+
+    exact = (LexicalIndex.exact_hits(query, lex_hits, _LEXICAL_FASTPATH_MAX_TOKENS)
+             if query_embed is None else None)
+    if exact:
+        top = [_lexical_hit(score, doc) for score, doc in exact[:top_k]]
+        logger.info("[RAG] Lexical fast-path: %d hits, bm25=[%s]", len(top),
+                    ", ".join(f"{h['bm25']:.2f}({h['source']})" for h in top))
+        return top
+
+    dense = _dense_retrieve(query, top_k * 2 if lex_hits else top_k, query_embed)
+    if not lex_hits:
+        return dense
+
+    fused = rrf_fuse(
+        [[(_hit_key(h), h) for h in dense],
+         [(_hit_key(h), h) for h in (_lexical_hit(s, d) for s, d in lex_hits)]],
+        k=_RRF_K, top_k=top_k,
+    )
+    top = [dict(h, rrf=score) for score, h in fused]
+    logger.info("[RAG] Hybrid top-%d (dense=%d, lexical=%d): [%s]",
+                len(top), len(dense), len(lex_hits),
+                ", ".join(f"{h['rrf']:.4f}({h['source']})" for h in top))
+    return top
+
+
+def _release_collection(name: str) -> None:
+    with _collection_lock:
+        _collection_inflight[name] -= 1
+
+
+def _submit_query(name: str, collection, *args):
+    """Gửi query vào executor của collection; None nếu collection đã đủ query đang chạy."""
+    with _collection_lock:
+        if _collection_inflight.get(name, 0) >= _COLLECTION_WORKERS:
+            return None
+        _collection_inflight[name] = _collection_inflight.get(name, 0) + 1
+        pool = _collection_pools.get(name)
+        if pool is None:
+            pool = _collection_pools[name] = ThreadPoolExecutor(
+                max_workers=_COLLECTION_WORKERS, thread_name_prefix=f"rag-{name}",
+            )
+    fut = pool.submit(_query_collection, collection, *args)
+    fut.add_done_callback(lambda _: _release_collection(name))
+    return fut
+
+
+def _dense_retrieve(query: str, top_k: int, query_embed: list | None = None) -> list[dict]:
+    """
+    Query song song tất cả collections, merge bằng heap top-k theo cosine.
+    Trả về list {cosine, meta, source, id} giảm dần theo cosine.
+    """
+    if query_embed is None:
+        query_embed = get_embedding(query)
     if not query_embed:
         return []
 
-    all_hits: list[dict] = []
-
+    # Mở collection trên thread gọi (lru_cache) — chỉ phần query chạy song song
+    futures = {}
     for col_name, chroma_path in _COLLECTIONS:
         col = _get_collection(str(chroma_path), col_name)
         if col is None:
             continue
-        hits = _query_collection(col, query_embed, n_results=5, query=query)
+        fut = _submit_query(col_name, col, query_embed, top_k, query)
+        if fut is None:
+            logger.warning("[RAG] %s còn %d query chưa xong — bỏ qua", col_name, _COLLECTION_WORKERS)
+            continue
+        futures[fut] = col_name
+
+    done, _ = wait(futures, timeout=_COLLECTION_TIMEOUT)
+
+    # Heap kích thước top_k: (cosine, seq, hit) — seq giữ thứ tự ổn định khi bằng cosine.
+    # Duyệt theo thứ tự _COLLECTIONS (không theo set `done`) để kết quả tất định.
+    heap: list[tuple] = []
+    seq = 0
+    for fut, col_name in futures.items():
+        if fut not in done:
+            logger.warning("[RAG] %s quá %.1fs — bỏ qua", col_name, _COLLECTION_TIMEOUT)
+            continue
+        hits = fut.result()
+        logger.debug("[RAG] %s → %d hits (≥%.2f)", col_name, len(hits), _MIN_COSINE)
         for h in hits:
             h["source"] = col_name
-        all_hits.extend(hits)
-        logger.debug("[RAG] %s → %d hits (≥%.2f)", col_name, len(hits), _MIN_COSINE)
-
-    if not all_hits:
+            item = (h["cosine"], -seq, h)
+            seq += 1
+            if len(heap) < top_k:
+                heapq.heappush(heap, item)
+            elif item[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, item)
+
+    if not heap:
         logger.warning("[RAG] Không có kết quả nào vượt ngưỡng %.2f trên %d collections",
                        _MIN_COSINE, len(_COLLECTIONS))
         return []
 
-    # Sắp xếp theo cosine giảm dần, lấy top-5
-    all_hits.sort(key=lambda x: x["cosine"], reverse=True)
-    top = all_hits[:5]
-
+    top = [h for _, _, h in sorted(heap, key=lambda x: x[:2], reverse=True)]
     logger.info("[RAG] Top-%d từ %d collections: cosine=[%s]",
-                len(top), len(_COLLECTIONS),
+                len(top), len(futures),
                 ", ".join(f"{h['cosine']:.3f}({h['source']})" for h in top))
-
-    return [h["meta"].get("answer_text") or h["meta"].get("answer") or "" for h in top]
-
-
-
-
+    return top
 
 
+def search_project_documents(query: str):
+    """
+    Tìm kiếm trên tất cả collections (song song), merge kết quả theo cosine giảm dần.
+    Trả về top-5 answer_text tốt nhất.
+    """
+    top = retrieve(query, top_k=_TOP_K)
+    return [h["meta"].get("answer_text") or h["meta"].get("answer") or "" for h in top]
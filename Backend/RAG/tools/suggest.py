@@ -3,12 +3,20 @@ SuggestProcedure tool — gợi ý thủ tục hành chính phù hợp với câ
 
 Được đăng ký vào TOOL_REGISTRY để task_analyzer (LLM) tự động gọi khi phát hiện
 người dùng hỏi về thủ tục / dịch vụ công.
+
+Embedding tên thủ tục được lưu thành artefact .npy (float32, đã chuẩn hoá) và
+nạp bằng memmap — key = hash nội dung CSV + model id, nên chỉ encode lại khi dữ
+liệu hoặc model thay đổi; các worker dùng chung page cache của cùng một file.
 """
+import hashlib
+import json
 import os
 import re
 import sys
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
+
+import numpy as np
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from logger import get_logger
@@ -17,17 +25,16 @@ log = get_logger('rag.suggest')
 
 try:
     from sentence_transformers import SentenceTransformer
-    from sentence_transformers.util import cos_sim
     import pandas as pd
 except Exception:
     SentenceTransformer = None  # type: ignore
-    cos_sim = None              # type: ignore
     pd = None                   # type: ignore
 
 # ── Singletons (lazy-loaded, tái sử dụng qua mọi lần gọi) ────────────────────
 _model = None
 _df = None
 _embeddings = None
+_store: Optional['_CandidateStore'] = None
 _query_map: Dict[str, List[Dict[str, Any]]] = {}
 
 _BASE_DIR   = Path(__file__).parent.parent.parent          # Backend/
@@ -37,6 +44,151 @@ _MODEL_PATH = _BASE_DIR / 'SuggestProcedure' / 'model' / 'fine_tuned_model'
 _RANK_PATH  = _BASE_DIR / 'SuggestProcedure' / 'data' / 'query_procedure_ranking_quangninh.csv'
 _FALLBACK_MODEL = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
 
+_EMB_CACHE_DIR = Path(os.getenv(
+    'SUGGEST_EMB_CACHE_DIR', str(_BASE_DIR / 'SuggestProcedure' / 'model' / 'embedding_cache')))
+_EMB_ARTEFACT_VERSION = 1
+
+
+# ── Embedding artefact ────────────────────────────────────────────────────────
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _model_id(model_name: str) -> str:
+    """Định danh model: tên HF, hoặc với model local là config + kích thước weights."""
+    path = Path(model_name)
+    if not path.is_dir():
+        return model_name
+    h = hashlib.sha256()
+    for fname in ('config.json', 'modules.json', 'model.safetensors', 'pytorch_model.bin'):
+        f = path / fname
+        if not f.is_file():
+            continue
+        h.update(fname.encode())
+        h.update(f.read_bytes() if f.suffix == '.json' else str(f.stat().st_size).encode())
+    return f'local:{path.name}:{h.hexdigest()[:16]}'
+
+
+def _artefact_key(csv_hash: str, model_id: str) -> str:
+    raw = f'{_EMB_ARTEFACT_VERSION}|{csv_hash}|{model_id}'
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def _load_artefact(key: str, count: int) -> Optional[np.ndarray]:
+    """Nạp embeddings (memmap, chỉ đọc) nếu artefact khớp key + số dòng."""
+    npy  = _EMB_CACHE_DIR / f'suggest-{key}.npy'
+    meta = _EMB_CACHE_DIR / f'suggest-{key}.json'
+    if not (npy.is_file() and meta.is_file()):
+        return None
+    try:
+        info = json.loads(meta.read_text(encoding='utf-8'))
+        emb = np.load(npy, mmap_mode='r')
+        if info.get('version') != _EMB_ARTEFACT_VERSION or emb.ndim != 2 or emb.shape[0] != count:
+            return None
+        return emb
+    except Exception as exc:
+        log.warning(f'[SuggestProcedure] Artefact embedding lỗi (build lại): {exc}')
+        return None
+
+
+def _save_artefact(key: str, emb: np.ndarray, info: Dict[str, Any]) -> None:
+    _EMB_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    npy  = _EMB_CACHE_DIR / f'suggest-{key}.npy'
+    meta = _EMB_CACHE_DIR / f'suggest-{key}.json'
+    tmp  = _EMB_CACHE_DIR / f'.suggest-{key}.{os.getpid()}.npy'
+    np.save(tmp, emb)
+    os.replace(tmp, npy)
+    meta.write_text(json.dumps(info, ensure_ascii=False), encoding='utf-8')
+    # Dọn artefact cũ (worker đang memmap file cũ vẫn đọc được tới khi đóng)
+    for old in _EMB_CACHE_DIR.glob('suggest-*'):
+        if not old.name.startswith(f'suggest-{key}.'):
+            try:
+                old.unlink()
+            except OSError:
+                pass
+
+
+# ── Candidate store (dạng cột, tính sẵn một lần) ─────────────────────────────
+
+def _slugify(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9\- ]', '', name.lower()).strip().replace(' ', '-')
+
+
+def _link_base() -> str:
+    return os.getenv('PROCEDURE_LINK_BASE', 'https://dichvucong.gov.vn/thu-tuc/')
+
+
+def _make_link(link_base: str, pid: Any, slug: str) -> str:
+    return f'{link_base}{pid}-{slug}' if pid and str(pid).strip() else f'{link_base}{slug}'
+
+
+class _CandidateStore:
+    """id / tên / slug của mọi thủ tục theo thứ tự dòng embeddings — chỉ dựng dict cho top-k."""
+
+    __slots__ = ('ids', 'names', 'slugs')
+
+    def __init__(self, df) -> None:
+        n = len(df)
+        self.ids: List[int] = (
+            [int(x) for x in df['ID'].tolist()] if 'ID' in df.columns else list(range(n))
+        )
+        self.names: List[Any] = df['NAME'].tolist()
+        self.slugs: List[str] = [_slugify(str(x)) for x in self.names]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def top_k(self, scores: np.ndarray, k: int, threshold: float) -> np.ndarray:
+        """Chỉ số các dòng có score ≥ threshold, tối đa k, giảm dần theo score."""
+        idx = np.flatnonzero(scores >= threshold)
+        if k <= 0 or idx.size == 0:
+            return idx[:0]
+        if idx.size > k:
+            idx = idx[np.argpartition(-scores[idx], k - 1)[:k]]
+        # stable: hoà điểm thì giữ thứ tự dòng như sort cũ
+        return idx[np.argsort(-scores[idx], kind='stable')]
+
+    def suggestion(self, i: int, score: float, link_base: str) -> Dict[str, Any]:
+        pid = self.ids[i]
+        return {
+            'procedure_internal_id': pid,
+            'procedure_name':  self.names[i],
+            'procedure_code':  None,
+            'similarity_score': round(float(score), 4),
+            'source':          'embedding',
+            'link':            _make_link(link_base, pid, self.slugs[i]),
+        }
+
+
+def _load_or_build_embeddings(model, model_id: str, csv_hash: str, names: List[str]) -> np.ndarray:
+    """Embeddings (n, dim) float32 đã chuẩn hoá — từ artefact nếu có, nếu không thì encode + lưu."""
+    key = _artefact_key(csv_hash, model_id)
+    emb = _load_artefact(key, len(names))
+    if emb is not None:
+        log.info(f'[SuggestProcedure] Nạp embedding artefact {key} ({emb.shape[0]}×{emb.shape[1]})')
+        return emb
+
+    emb = np.asarray(
+        model.encode(names, normalize_embeddings=True, convert_to_numpy=True), dtype=np.float32,
+    )
+    try:
+        _save_artefact(key, emb, {
+            'version':  _EMB_ARTEFACT_VERSION,
+            'csv_hash': csv_hash,
+            'model_id': model_id,
+            'count':    int(emb.shape[0]),
+            'dim':      int(emb.shape[1]) if emb.ndim == 2 else 0,
+        })
+        log.info(f'[SuggestProcedure] Đã lưu embedding artefact {key}')
+    except Exception as exc:
+        log.warning(f'[SuggestProcedure] Không lưu được artefact (non-fatal): {exc}')
+    return emb
+
 
 def _resolve_csv() -> Path:
     """Trả về path CSV khả dụng: ưu tiên bộ Quảng Ninh, fallback về seed."""
@@ -67,9 +219,9 @@ def init_suggest() -> tuple:
     Khởi tạo model + data một lần duy nhất (singleton).
     Trả về (model, df, embeddings) hoặc raise nếu thất bại.
     """
-    global _model, _df, _embeddings, _query_map
+    global _model, _df, _embeddings, _store, _query_map
 
-    if _model is not None and _df is not None and _embeddings is not None:
+    if _model is not None and _df is not None and _embeddings is not None and _store is not None:
         return _model, _df, _embeddings
 
     if SentenceTransformer is None or pd is None:
@@ -77,6 +229,7 @@ def init_suggest() -> tuple:
 
     # ── Load CSV ──────────────────────────────────────────────────────────────
     csv_path = _resolve_csv()
+    csv_hash = _file_sha256(csv_path)
     _df = pd.read_csv(str(csv_path))
     if 'NAME' not in _df.columns:
         raise RuntimeError("CSV thiếu cột 'NAME'")
@@ -124,16 +277,65 @@ def init_suggest() -> tuple:
     try:
         _model = SentenceTransformer(model_name)
         names = _df['NAME'].astype(str).tolist()
-        _embeddings = _model.encode(names, convert_to_tensor=True)
+        _embeddings = _load_or_build_embeddings(_model, _model_id(model_name), csv_hash, names)
+        _store = _CandidateStore(_df)
         log.info(f'[SuggestProcedure] Sẵn sàng — {len(names)} thủ tục, model: {model_name}')
     except Exception as exc:
         log.error(f'[SuggestProcedure] Lỗi load model: {exc}')
-        _model = _df = _embeddings = None
+        _model = _df = _embeddings = _store = None
         raise
 
     return _model, _df, _embeddings
 
 
+def _normalize_query(query: str) -> str:
+    return re.sub(r'[^\w\s]', '', query.lower()).strip()
+
+
+def _label_hits(query: str, top_k: int, link_base: str) -> List[Dict[str, Any]]:
+    """Gợi ý từ ranking label (exact match) — luôn được ưu tiên."""
+    out: List[Dict[str, Any]] = []
+    for hit in _query_map.get(_normalize_query(query), [])[:top_k]:
+        pid, pname = hit.get('procedure_id'), hit.get('procedure_name')
+        out.append({
+            'procedure_internal_id': pid,
+            'procedure_name':  pname,
+            'procedure_code':  hit.get('procedure_code'),
+            'similarity_score': 1.0,
+            'source':          'ranking_label',
+            'link':            _make_link(link_base, pid, _slugify(str(pname))),
+        })
+    return out
+
+
+def _fill_from_scores(
+    suggestions: List[Dict[str, Any]],
+    store: _CandidateStore,
+    scores: np.ndarray,
+    top_k: int,
+    threshold: float,
+    link_base: str,
+) -> None:
+    """Bổ sung bằng embedding search — top-k trên vector điểm, chỉ dựng dict cho winners."""
+    existing = {s['procedure_name'] for s in suggestions}
+    remaining = top_k - len(suggestions)
+    # Lấy dư len(existing) dòng để bù các tên trùng với ranking label
+    for i in store.top_k(scores, remaining + len(existing), threshold):
+        if store.names[i] not in existing:
+            suggestions.append(store.suggestion(int(i), scores[i], link_base))
+        if len(suggestions) >= top_k:
+            break
+
+
+def _result(suggestions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    explanation = (
+        'Các thủ tục hành chính liên quan được đề xuất dựa trên yêu cầu của bạn.'
+        if suggestions else
+        'Không tìm thấy thủ tục phù hợp với yêu cầu.'
+    )
+    return {'suggestions': suggestions, 'explanation': explanation, 'total_candidates': len(suggestions)}
+
+
 def suggest_procedures(query: str, top_k: int = 4, threshold: float = 0.5) -> Dict[str, Any]:
     """
     Gợi ý tối đa `top_k` thủ tục hành chính liên quan đến `query`.
@@ -150,59 +352,50 @@ def suggest_procedures(query: str, top_k: int = 4, threshold: float = 0.5) -> Di
     except Exception as exc:
         return {'suggestions': [], 'explanation': f'Lỗi khởi tạo: {exc}', 'error': 'init_failed'}
 
-    link_base = os.getenv('PROCEDURE_LINK_BASE', 'https://dichvucong.gov.vn/thu-tuc/')
+    link_base = _link_base()
+    suggestions = _label_hits(query, top_k, link_base)
+    if len(suggestions) < top_k:
+        q_emb = model.encode(query, normalize_embeddings=True, convert_to_numpy=True)
+        scores = embeddings @ np.asarray(q_emb, dtype=np.float32)
+        _fill_from_scores(suggestions, _store, scores, top_k, threshold, link_base)
+    return _result(suggestions)
 
-    def _link(pid: Any, name: str) -> str:
-        slug = re.sub(r'[^a-zA-Z0-9\- ]', '', name.lower()).strip().replace(' ', '-')
-        return f'{link_base}{pid}-{slug}' if pid and str(pid).strip() else f'{link_base}{slug}'
 
-    # Ưu tiên ranking label (exact match)
-    norm_q = re.sub(r'[^\w\s]', '', query.lower()).strip()
-    suggestions: List[Dict[str, Any]] = []
-    for hit in _query_map.get(norm_q, [])[:top_k]:
-        pid, pname = hit.get('procedure_id'), hit.get('procedure_name')
-        suggestions.append({
-            'procedure_internal_id': pid,
-            'procedure_name':  pname,
-            'procedure_code':  hit.get('procedure_code'),
-            'similarity_score': 1.0,
-            'source':          'ranking_label',
-            'link':            _link(pid, str(pname)),
-        })
+# Số query mỗi lần nhân ma trận — giới hạn bộ nhớ (chunk × số thủ tục float32)
+_BATCH_CHUNK = 256
 
-    # Bổ sung bằng embedding search
-    remaining = top_k - len(suggestions)
-    if remaining > 0:
-        q_emb = model.encode(query, convert_to_tensor=True)
-        scores = cos_sim(q_emb, embeddings)[0].cpu().numpy().tolist()
-        existing = {s['procedure_name'] for s in suggestions}
-        scored = sorted(
-            [
-                {
-                    'procedure_internal_id': int(df['ID'].iloc[i]) if 'ID' in df.columns else i,
-                    'procedure_name':  df['NAME'].iloc[i],
-                    'procedure_code':  None,
-                    'similarity_score': round(float(s), 4),
-                    'source':          'embedding',
-                    'link':            _link(int(df['ID'].iloc[i]) if 'ID' in df.columns else i, str(df['NAME'].iloc[i])),
-                }
-                for i, s in enumerate(scores) if s >= threshold
-            ],
-            key=lambda x: x['similarity_score'],
-            reverse=True,
+
+def suggest_procedures_batch(
+    queries: List[str],
+    top_k: int = 4,
+    threshold: float = 0.5,
+) -> List[Dict[str, Any]]:
+    """
+    Phiên bản batch của `suggest_procedures`: encode mọi query trong một lượt
+    model, chấm điểm bằng một phép nhân ma trận (queries × thủ tục) mỗi chunk.
+    Trả về list kết quả cùng thứ tự và cùng định dạng với `suggest_procedures`.
+    """
+    try:
+        model, df, embeddings = init_suggest()
+    except Exception as exc:
+        err = {'suggestions': [], 'explanation': f'Lỗi khởi tạo: {exc}', 'error': 'init_failed'}
+        return [dict(err) for _ in queries]
+
+    link_base = _link_base()
+    results = [_label_hits(q, top_k, link_base) for q in queries]
+    pending = [i for i, sug in enumerate(results) if len(sug) < top_k and queries[i].strip()]
+
+    for start in range(0, len(pending), _BATCH_CHUNK):
+        chunk = pending[start:start + _BATCH_CHUNK]
+        q_emb = model.encode(
+            [queries[i] for i in chunk], normalize_embeddings=True,
+            convert_to_numpy=True, batch_size=min(len(chunk), 64),
         )
-        for item in scored:
-            if item['procedure_name'] not in existing:
-                suggestions.append(item)
-            if len(suggestions) >= top_k:
-                break
+        scores = np.asarray(q_emb, dtype=np.float32) @ np.asarray(embeddings).T
+        for row, i in enumerate(chunk):
+            _fill_from_scores(results[i], _store, scores[row], top_k, threshold, link_base)
 
-    explanation = (
-        'Các thủ tục hành chính liên quan được đề xuất dựa trên yêu cầu của bạn.'
-        if suggestions else
-        'Không tìm thấy thủ tục phù hợp với yêu cầu.'
-    )
-    return {'suggestions': suggestions, 'explanation': explanation, 'total_candidates': len(suggestions)}
+    return [_result(sug) for sug in results]
 
 
 def suggest_procedures_tool(query: str, top_k: int = 4) -> List[Dict[str, Any]]:
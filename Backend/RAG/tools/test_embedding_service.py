@@ -0,0 +1,86 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from RAG.tools.embedding_service import EmbeddingService, normalize_text
+
+
+class _Model:
+    def __init__(self, delay=0.0, fail=False):
+        self.calls = []
+        self.delay = delay
+        self.fail = fail
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError('model lỗi')
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_normalize_text():
+    assert normalize_text(' a \t b\n') == 'a b'
+    assert normalize_text('Thu\u0309 tu\u0323c') == 'Thủ tục'     # NFD → NFC
+
+
+def test_repeated_text_hits_lru():
+    model = _Model()
+    svc = EmbeddingService(model, max_wait_ms=0)
+    a = svc.embed('thủ tục  cấp CCCD')
+    b = svc.embed(' thủ tục cấp CCCD ')
+    assert a is b and len(model.calls) == 1                    # hit trả lại chính vector trong cache
+    assert svc.stats()['hits'] == 1
+
+
+def test_cached_vectors_are_readonly_float32():
+    svc = EmbeddingService(_Model(), max_wait_ms=0)
+    vec = svc.embed('abc')
+    assert vec.dtype == np.float32 and vec.tolist() == [3.0, 1.0]
+    with pytest.raises(ValueError):
+        vec[0] = 0.0
+
+
+def test_concurrent_requests_share_one_batch():
+    model = _Model(delay=0.01)
+    svc = EmbeddingService(model, max_wait_ms=50)
+    out = {}
+
+    def worker(i):
+        out[i] = svc.embed(f'câu {i % 5}' + 'x' * i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(out) == 8
+    assert sum(len(c) for c in model.calls) == 8
+    assert len(model.calls) < 8
+    assert out[3].tolist() == [float(len('câu 3xxx')), 1.0]
+
+
+def test_embed_many_keeps_order_and_skips_empty():
+    model = _Model()
+    svc = EmbeddingService(model, max_wait_ms=0)
+    res = svc.embed_many(['ab', '', 'abc', 'ab'])
+    assert [v.tolist() for v in res] == [[2.0, 1.0], [], [3.0, 1.0], [2.0, 1.0]]
+    assert model.calls == [['ab', 'abc']]
+
+
+def test_lru_is_bounded():
+    svc = EmbeddingService(_Model(), cache_size=2, max_wait_ms=0)
+    for t in ('a', 'bb', 'ccc'):
+        svc.embed(t)
+    assert list(svc._cache) == ['bb', 'ccc']
+
+
+def test_encode_error_propagates_and_is_not_cached():
+    model = _Model(fail=True)
+    svc = EmbeddingService(model, max_wait_ms=0)
+    with pytest.raises(RuntimeError):
+        svc.embed('x')
+    model.fail = False
+    assert svc.embed('x').tolist() == [1.0, 1.0]
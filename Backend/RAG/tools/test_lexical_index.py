@@ -0,0 +1,49 @@
+from RAG.tools.lexical_index import LexicalIndex, fold, rrf_fuse, tokenize
+
+_DOCS = [
+    {'id': 'f1', 'source': 'faqs_collection', 'title': 'Làm thẻ căn cước (CCCD) ở đâu?',
+     'answer_text': 'Công an cấp xã, tờ khai CC02.'},
+    {'id': 'f2', 'source': 'faqs_collection', 'title': 'Đổi giấy phép lái xe (GPLX)',
+     'answer_text': 'Nộp tại Sở GTVT.'},
+    {'id': 'c1', 'source': 'thanhhoa_congan', 'title': 'Đăng ký tạm trú',
+     'answer_text': 'Tờ khai CT01.'},
+    {'id': 'c2', 'source': 'thanhhoa_congan', 'title': '', 'answer_text': 'bỏ qua'},
+]
+
+
+def test_fold_and_tokenize():
+    assert fold('Đăng KÝ Căn Cước') == 'dang ky can cuoc'
+    assert tokenize('Căn cước CT01') == ['can', 'cuoc', 'ct01', 'can_cuoc', 'cuoc_ct01']
+
+
+def test_search_matches_codes_without_diacritics():
+    index = LexicalIndex.build(_DOCS)
+    assert len(index) == 3                                 # doc không có tiêu đề bị bỏ
+    assert index.search('ct01')[0][1]['id'] == 'c1'
+    assert index.search('gplx het han')[0][1]['id'] == 'f2'
+    assert index.search('can cuoc')[0][1]['id'] == 'f1'
+    assert index.search('không liên quan zzz') == []
+
+
+def test_save_load_roundtrip(tmp_path):
+    path = tmp_path / 'lex.json.gz'
+    LexicalIndex.build(_DOCS).save(path)
+    index = LexicalIndex.load(path)
+    assert index is not None and len(index) == 3
+    assert index.search('GPLX')[0][1]['title'].startswith('Đổi giấy phép')
+    assert LexicalIndex.load(tmp_path / 'missing.json.gz') is None
+
+
+def test_exact_hits():
+    index = LexicalIndex.build(_DOCS)
+    assert LexicalIndex.exact_hits('GPLX', index.search('GPLX'))[0][1]['id'] == 'f2'
+    assert LexicalIndex.exact_hits('đăng ký tạm trú', index.search('đăng ký tạm trú'))[0][1]['id'] == 'c1'
+    assert LexicalIndex.exact_hits('tạm trú', index.search('tạm trú')) is None
+    assert LexicalIndex.exact_hits('làm sao để đổi giấy phép lái xe', index.search('giấy phép')) is None
+
+
+def test_rrf_fuse():
+    a = [('x', {'n': 'x'}), ('y', {'n': 'y'})]
+    b = [('y', {'n': 'y2'}), ('z', {'n': 'z'})]
+    fused = rrf_fuse([a, b], k=60, top_k=2)
+    assert [item['n'] for _, item in fused] == ['y', 'x']
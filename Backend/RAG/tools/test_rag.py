@@ -0,0 +1,118 @@
+import time
+
+import RAG.tools.rag as rag
+from RAG.tools.lexical_index import LexicalIndex
+
+
+class _Col:
+    def __init__(self, name, cosines, delay=0.0):
+        self.name, self.cosines, self.delay = name, cosines, delay
+        self.includes = []
+
+    def query(self, query_embeddings, n_results, include):
+        self.includes.append(include)
+        time.sleep(self.delay)
+        cos = self.cosines[:n_results]
+        return {
+            'metadatas': [[{'answer_text': f'{self.name}-{c}'} for c in cos]],
+            'distances': [[1.0 - c for c in cos]],
+            'ids':       [[f'{self.name}{i}' for i in range(len(cos))]],
+        }
+
+
+def _setup(monkeypatch, cols, timeout=1.0):
+    monkeypatch.setattr(rag, '_COLLECTIONS', [(c.name, '/x') for c in cols])
+    monkeypatch.setattr(rag, '_get_collection', lambda path, name: next(c for c in cols if c.name == name))
+    monkeypatch.setattr(rag, '_COLLECTION_TIMEOUT', timeout)
+    monkeypatch.setattr(rag.rag_metrics, 'METRICS_ENABLED', False)
+    monkeypatch.setattr(rag, '_lexical_index', lambda: None)
+
+
+def test_merges_top_k_across_collections(monkeypatch):
+    cols = [_Col('a', [0.9, 0.5, 0.2]), _Col('b', [0.8, 0.7, 0.6, 0.4]), _Col('c', [])]
+    _setup(monkeypatch, cols)
+    top = rag.retrieve('q', top_k=4, query_embed=[1.0])
+    assert [h['cosine'] for h in top] == [0.9, 0.8, 0.7, 0.6]
+    assert [h['source'] for h in top] == ['a', 'b', 'b', 'b']
+    assert all(inc == ['metadatas', 'distances'] for c in cols for inc in c.includes)
+
+
+def test_collections_run_concurrently(monkeypatch):
+    cols = [_Col(n, [0.9], delay=0.2) for n in ('a', 'b', 'c')]
+    _setup(monkeypatch, cols)
+    t0 = time.perf_counter()
+    assert len(rag.retrieve('q', query_embed=[1.0])) == 3
+    assert time.perf_counter() - t0 < 0.5
+
+
+def test_equal_cosines_follow_collection_order(monkeypatch):
+    cols = [_Col('a', [0.8], delay=0.05), _Col('b', [0.8])]      # b xong trước a
+    _setup(monkeypatch, cols)
+    top = rag.retrieve('q', top_k=1, query_embed=[1.0])
+    assert [h['source'] for h in top] == ['a']
+
+
+def test_slow_collection_is_skipped(monkeypatch):
+    cols = [_Col('fast', [0.6]), _Col('slow', [0.99], delay=0.5)]
+    _setup(monkeypatch, cols, timeout=0.1)
+    top = rag.retrieve('q', query_embed=[1.0])
+    assert [h['source'] for h in top] == ['fast']
+
+
+def test_hung_collection_is_capped_and_does_not_block_others(monkeypatch):
+    import threading
+    release = threading.Event()
+
+    class _Hung(_Col):
+        def query(self, *a, **k):
+            release.wait(5)
+            return super().query(*a, **k)
+
+    cols = [_Col('ok', [0.7]), _Hung('hung', [0.9])]
+    _setup(monkeypatch, cols, timeout=0.1)
+    monkeypatch.setattr(rag, '_COLLECTION_WORKERS', 1)
+    monkeypatch.setattr(rag, '_collection_pools', {})
+    monkeypatch.setattr(rag, '_collection_inflight', {})
+    try:
+        assert [h['source'] for h in rag.retrieve('q', query_embed=[1.0])] == ['ok']
+        t0 = time.perf_counter()
+        assert [h['source'] for h in rag.retrieve('q', query_embed=[1.0])] == ['ok']
+        assert time.perf_counter() - t0 < 0.1                   # không submit, không chờ timeout
+        assert rag._collection_inflight['hung'] == 1
+    finally:
+        release.set()
+
+
+def test_search_project_documents_returns_answers(monkeypatch):
+    _setup(monkeypatch, [_Col('a', [0.9, 0.1])])
+    monkeypatch.setattr(rag, 'get_embedding', lambda q: [1.0])
+    assert rag.search_project_documents('q') == ['a-0.9']
+
+
+def _lex(docs):
+    return LexicalIndex.build(docs)
+
+
+def test_exact_procedure_name_skips_encode(monkeypatch):
+    _setup(monkeypatch, [_Col('a', [0.9])])
+    index = _lex([
+        {'id': 'x1', 'source': 'thanhhoa_congan', 'title': 'Xóa đăng ký thường trú', 'answer_text': 'xoá'},
+        {'id': 'x2', 'source': 'thanhhoa_congan', 'title': 'Đăng ký thường trú', 'answer_text': 'CT01'},
+    ])
+    monkeypatch.setattr(rag, '_lexical_index', lambda: index)
+    monkeypatch.setattr(rag, 'get_embedding', lambda q: (_ for _ in ()).throw(AssertionError('encode')))
+    top = rag.retrieve('đăng ký thường trú')
+    assert top[0]['id'] == 'x2' and top[0]['cosine'] is None
+
+
+def test_hybrid_fuses_dense_and_lexical(monkeypatch):
+    _setup(monkeypatch, [_Col('a', [0.9, 0.8])])
+    index = _lex([
+        {'id': 'a1', 'source': 'a', 'title': 'Thủ tục cấp GPLX', 'answer_text': 'GPLX hạng B2'},
+        {'id': 'z9', 'source': 'a', 'title': 'Đổi giấy phép lái xe', 'answer_text': 'giấy phép'},
+    ])
+    monkeypatch.setattr(rag, '_lexical_index', lambda: index)
+    top = rag.retrieve('hỏi về thủ tục cấp GPLX hạng B2 mới nhất', query_embed=[1.0])
+    assert top[0]['id'] == 'a1'                                 # top ở cả dense lẫn lexical
+    assert [h['id'] for h in top] == ['a1', 'a0']
+    assert all('rrf' in h for h in top)
@@ -0,0 +1,110 @@
+import numpy as np
+
+import RAG.tools.suggest as sg
+
+
+class _Model:
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, texts, normalize_embeddings=True, convert_to_numpy=True):
+        self.calls += 1
+        rng = np.random.default_rng(len(texts))
+        v = rng.normal(size=(len(texts), 8)).astype(np.float32)
+        return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def test_artefact_is_built_once_and_memmapped(monkeypatch, tmp_path):
+    monkeypatch.setattr(sg, '_EMB_CACHE_DIR', tmp_path)
+    model = _Model()
+    names = ['Cấp CCCD', 'Đăng ký khai sinh', 'Cấp hộ chiếu']
+    first = sg._load_or_build_embeddings(model, 'm1', 'csv-a', names)
+    second = sg._load_or_build_embeddings(model, 'm1', 'csv-a', names)
+    assert model.calls == 1
+    assert isinstance(second, np.memmap) and second.dtype == np.float32
+    assert np.allclose(first, second)
+
+
+def test_artefact_rebuilds_when_data_or_model_changes(monkeypatch, tmp_path):
+    monkeypatch.setattr(sg, '_EMB_CACHE_DIR', tmp_path)
+    model = _Model()
+    sg._load_or_build_embeddings(model, 'm1', 'csv-a', ['a', 'b'])
+    sg._load_or_build_embeddings(model, 'm1', 'csv-b', ['a', 'b'])
+    sg._load_or_build_embeddings(model, 'm2', 'csv-b', ['a', 'b'])
+    assert model.calls == 3
+    assert len(list(tmp_path.glob('suggest-*.npy'))) == 1      # artefact cũ đã dọn
+
+
+def test_model_id_for_local_dir_tracks_config(tmp_path):
+    (tmp_path / 'config.json').write_text('{"a": 1}')
+    first = sg._model_id(str(tmp_path))
+    (tmp_path / 'config.json').write_text('{"a": 2}')
+    assert sg._model_id(str(tmp_path)) != first
+    assert sg._model_id('org/hf-model') == 'org/hf-model'
+
+
+class _QueryModel:
+    def __init__(self, vec, by_query=None):
+        self.vec = np.asarray(vec, dtype=np.float32)
+        self.by_query = by_query or {}
+        self.batches = []
+
+    def _one(self, query):
+        return np.asarray(self.by_query.get(query, self.vec), dtype=np.float32)
+
+    def encode(self, query, normalize_embeddings=True, convert_to_numpy=True, batch_size=32):
+        if isinstance(query, list):
+            self.batches.append(query)
+            return np.stack([self._one(q) for q in query])
+        return self._one(query)
+
+
+def _install(monkeypatch, names, emb, query_vec, ids=None):
+    import pandas as pd
+    data = {'NAME': names}
+    if ids is not None:
+        data['ID'] = ids
+    df = pd.DataFrame(data)
+    monkeypatch.setattr(sg, '_model', _QueryModel(query_vec))
+    monkeypatch.setattr(sg, '_df', df)
+    monkeypatch.setattr(sg, '_embeddings', np.asarray(emb, dtype=np.float32))
+    monkeypatch.setattr(sg, '_store', sg._CandidateStore(df))
+    monkeypatch.setattr(sg, '_query_map', {})
+    monkeypatch.setenv('PROCEDURE_LINK_BASE', 'https://x/')
+
+
+def test_suggest_returns_top_k_above_threshold(monkeypatch):
+    names = ['Cấp CCCD', 'Khai sinh', 'Hộ chiếu', 'Kết hôn', 'Tạm trú']
+    emb = np.eye(5)
+    q = [0.9, 0.2, 0.8, 0.55, 0.1]
+    _install(monkeypatch, names, emb, q, ids=[10, 11, 12, 13, 14])
+    res = sg.suggest_procedures('q', top_k=2, threshold=0.5)
+    assert [s['procedure_name'] for s in res['suggestions']] == ['Cấp CCCD', 'Hộ chiếu']
+    top = res['suggestions'][0]
+    assert top['procedure_internal_id'] == 10 and top['similarity_score'] == 0.9
+    assert top['link'] == 'https://x/10-cp-cccd'
+
+
+def test_suggest_ties_keep_row_order_and_ranking_labels_first(monkeypatch):
+    names = ['A', 'B', 'C']
+    _install(monkeypatch, names, np.eye(3), [0.7, 0.7, 0.7])
+    monkeypatch.setattr(sg, '_query_map', {'q': [{'procedure_id': 7, 'procedure_name': 'B'}]})
+    res = sg.suggest_procedures('q', top_k=3, threshold=0.5)
+    assert [(s['procedure_name'], s['source']) for s in res['suggestions']] == [
+        ('B', 'ranking_label'), ('A', 'embedding'), ('C', 'embedding')]
+    assert res['suggestions'][1]['procedure_internal_id'] == 0
+
+
+def test_batch_matches_single_and_encodes_once(monkeypatch):
+    names = ['Cấp CCCD', 'Khai sinh', 'Hộ chiếu']
+    by_query = {'cccd': [0.9, 0.1, 0.6], 'khai sinh': [0.2, 0.95, 0.1]}
+    _install(monkeypatch, names, np.eye(3), [0, 0, 0])
+    sg._model.by_query = by_query
+    queries = ['cccd', '', 'khai sinh']
+    batch = sg.suggest_procedures_batch(queries, top_k=2, threshold=0.5)
+    assert sg._model.batches == [['cccd', 'khai sinh']]
+    assert batch[1]['suggestions'] == []
+    for q, res in zip(queries, batch):
+        if q:
+            assert res == sg.suggest_procedures(q, top_k=2, threshold=0.5)
+    assert [s['procedure_name'] for s in batch[0]['suggestions']] == ['Cấp CCCD', 'Hộ chiếu']
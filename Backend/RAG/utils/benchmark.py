@@ -0,0 +1,358 @@
+"""
+RAG benchmark — latency / throughput / chất lượng retrieval, xuất JSON
+=====================================================================
+
+rag_metrics chỉ in bảng khoảng cách của từng lần retrieve; không có gì đo
+pipeline chat từ đầu đến cuối. Module này replay một tập câu hỏi cố định
+(câu hỏi trong RAG/data/faq_*.xlsx, chọn xác định theo seed) ở ba chế độ:
+
+  retrieval : embed + retrieve() (Chroma + BM25) — không LLM, không cache
+  graph     : MultiRoleAgentGraph đầy đủ; Gemini được thay bằng LLM giả
+              (analyzer luôn chọn search_project_documents, độ trễ
+              RAG_BENCH_LLM_MS), cache riêng trong bộ nhớ và rỗng
+  cache_hit : như graph nhưng cache đã nạp sẵn mọi câu hỏi — đường HIT
+
+Mỗi chế độ báo cáo:
+  • latency_ms: p50/p95/p99/mean/max cho toàn request và từng node
+    (cache_check, task_analyzer, tool_executor, llm_response, …; embed /
+    retrieve ở chế độ retrieval)
+  • throughput_qps khi chạy N thread đồng thời
+  • recall@k / MRR: vị trí đầu tiên của FAQ được gán nhãn (khớp id Chroma
+    hoặc answer_text) trong kết quả retrieve / tool_results
+
+`compare(current, baseline, tolerance)` liệt kê các chỉ số p95 / throughput /
+recall xấu đi quá ngưỡng — CLI scripts/bench_rag.py trả exit code 1 khi có,
+để chặn regression trước khi deploy.
+
+Tham số cấu hình (biến môi trường):
+  RAG_BENCH_QUERIES   : int,   default 200 — số câu hỏi replay
+  RAG_BENCH_THREADS   : int,   default 4   — số thread đồng thời
+  RAG_BENCH_K         : int,   default 5   — k của recall@k / MRR
+  RAG_BENCH_LLM_MS    : float, default 0   — độ trễ giả lập mỗi lời gọi LLM (ms)
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+from ..tools.embedding_service import normalize_text
+
+log = get_logger('rag.bench')
+
+BENCH_QUERIES: int   = int(os.getenv('RAG_BENCH_QUERIES', '200'))
+BENCH_THREADS: int   = int(os.getenv('RAG_BENCH_THREADS', '4'))
+BENCH_K:       int   = int(os.getenv('RAG_BENCH_K', '5'))
+BENCH_LLM_MS:  float = float(os.getenv('RAG_BENCH_LLM_MS', '0'))
+
+_DATA_DIR = Path(__file__).parent.parent / 'data'
+_GRAPH_NODES = ('user_input', 'role_manager', 'cache_check', 'task_analyzer',
+                'tool_executor', 'llm_response', 'cache_store')
+_ANSWER_KEY_CHARS = 200
+
+
+@dataclass
+class Query:
+    id:       str
+    question: str
+    answer:   str
+    source:   str
+
+
+# ── query set ─────────────────────────────────────────────────────────────────
+
+def load_query_set(data_dir: Path = _DATA_DIR, limit: int = BENCH_QUERIES, seed: int = 0) -> List[Query]:
+    """Câu hỏi có nhãn (id, answer) từ faq_*.xlsx; cùng seed → cùng tập câu hỏi."""
+    import pandas as pd  # lazy
+    queries: List[Query] = []
+    seen = set()
+    for path in sorted(Path(data_dir).glob('faq_*.xlsx')):
+        try:
+            df = pd.read_excel(path, sheet_name='FAQ', dtype=str).fillna('')
+        except Exception as exc:
+            log.debug(f'[bench] bỏ qua {path.name}: {exc}')
+            continue
+        for r in df.to_dict(orient='records'):
+            qid, question = str(r.get('id', '')).strip(), str(r.get('question', '')).strip()
+            if not qid or not question or qid in seen:
+                continue
+            seen.add(qid)
+            queries.append(Query(qid, question, str(r.get('answer', '')).strip(), path.name))
+    random.Random(seed).shuffle(queries)
+    return queries[:max(0, limit)]
+
+
+# ── measurement primitives ────────────────────────────────────────────────────
+
+def summarize(samples_ms: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean/max (ms) của một dãy mẫu."""
+    if not len(samples_ms):
+        return {'n': 0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'mean': 0.0, 'max': 0.0}
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {'n': int(arr.size), 'p50': round(float(p50), 2), 'p95': round(float(p95), 2),
+            'p99': round(float(p99), 2), 'mean': round(float(arr.mean()), 2),
+            'max': round(float(arr.max()), 2)}
+
+
+class NodeTimer:
+    """Gom thời gian chạy theo tên bước. Thread-safe."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._samples: Dict[str, List[float]] = defaultdict(list)
+
+    def add(self, name: str, ms: float) -> None:
+        with self._lock:
+            self._samples[name].append(ms)
+
+    def wrap(self, name: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(name, (time.perf_counter() - t0) * 1000)
+        return timed
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: summarize(s) for name, s in self._samples.items()}
+
+
+def _answer_key(text: Any) -> str:
+    return normalize_text(str(text or ''))[:_ANSWER_KEY_CHARS]
+
+
+def rank_of(hits: Sequence[Tuple[Optional[str], str]], query: Query) -> Optional[int]:
+    """Hạng (từ 1) của kết quả đầu tiên khớp FAQ được gán nhãn — theo id hoặc answer_text."""
+    want = _answer_key(query.answer)
+    for i, (doc_id, text) in enumerate(hits, 1):
+        if (doc_id is not None and str(doc_id) == query.id) or (want and _answer_key(text) == want):
+            return i
+    return None
+
+
+def quality(ranks: Sequence[Optional[int]], k: int) -> Dict[str, float]:
+    """recall@k và MRR (cắt tại k) trên các hạng của rank_of."""
+    n = len(ranks)
+    if not n:
+        return {f'recall@{k}': 0.0, 'mrr': 0.0, 'n': 0}
+    found = [r for r in ranks if r is not None and r <= k]
+    return {f'recall@{k}': round(len(found) / n, 4),
+            'mrr': round(sum(1.0 / r for r in found) / n, 4), 'n': n}
+
+
+def run_concurrent(fn: Callable[[Any], Any], items: Sequence[Any], threads: int) -> Tuple[List[Any], float]:
+    """Chạy fn(item) trên `threads` thread; trả (kết quả theo thứ tự, wall giây)."""
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix='rag-bench') as pool:
+        results = list(pool.map(fn, items))
+    return results, time.perf_counter() - t0
+
+
+def _mode_report(timer: NodeTimer, ranks: Sequence[Optional[int]], wall: float,
+                 threads: int, k: int) -> Dict[str, Any]:
+    n = len(ranks)
+    return {
+        'queries':        n,
+        'threads':        threads,
+        'wall_s':         round(wall, 3),
+        'throughput_qps': round(n / wall, 2) if wall > 0 else 0.0,
+        'latency_ms':     timer.report(),
+        'quality':        quality(ranks, k),
+    }
+
+
+# ── mode: retrieval ───────────────────────────────────────────────────────────
+
+def bench_retrieval(
+    queries: Sequence[Query],
+    threads: int = BENCH_THREADS,
+    k: int = BENCH_K,
+    embed_fn: Optional[Callable[[str], List[float]]] = None,
+    retrieve_fn: Optional[Callable[..., List[Dict[str, Any]]]] = None,
+) -> Dict[str, Any]:
+    """Embed + retrieve() cho từng câu hỏi — Chroma + BM25, không LLM."""
+    if embed_fn is None or retrieve_fn is None:
+        from ..tools.rag import get_embedding, retrieve
+        embed_fn, retrieve_fn = embed_fn or get_embedding, retrieve_fn or retrieve
+    timer = NodeTimer()
+    embed, search = timer.wrap('embed', embed_fn), timer.wrap('retrieve', retrieve_fn)
+
+    def _one(q: Query) -> Optional[int]:
+        hits = search(q.question, top_k=k, query_embed=embed(q.question))
+        return rank_of([(h.get('id'), (h.get('meta') or {}).get('answer_text')) for h in hits], q)
+
+    ranks, wall = run_concurrent(timer.wrap('total', _one), list(queries), threads)
+    return _mode_report(timer, ranks, wall, threads, k)
+
+
+# ── mode: graph / cache_hit ───────────────────────────────────────────────────
+
+class _StubAnalyzer:
+    """Thay GeminiAnalyzerLLM: luôn gọi search_project_documents với câu hỏi gốc."""
+
+    def __init__(self, delay_ms: float) -> None:
+        self._delay = delay_ms / 1000.0
+
+    def analyze_task(self, base_prompt: str, user_question: str, role_tools: Any = None,
+                     tool_descriptions: Optional[str] = None) -> str:
+        if self._delay:
+            time.sleep(self._delay)
+        return json.dumps({'analysis': 'benchmark stub', 'required_tools': [
+            {'tool_name': 'search_project_documents', 'params': {'query': user_question}},
+        ]}, ensure_ascii=False)
+
+
+class _StubSynthesizer:
+    """Thay GeminiSynthesizerLLM: trả về độ dài prompt, không gọi mạng."""
+
+    def __init__(self, delay_ms: float) -> None:
+        self._delay = delay_ms / 1000.0
+
+    def run(self, prompt: str) -> str:
+        if self._delay:
+            time.sleep(self._delay)
+        return f'[benchmark] synthesized from {len(prompt)} prompt chars'
+
+
+@contextmanager
+def stubbed_graph(timer: NodeTimer, cache: Any, llm_ms: float = BENCH_LLM_MS) -> Iterator[Any]:
+    """
+    MultiRoleAgentGraph với node được bấm giờ, LLM giả và `cache` thay cho
+    singleton get_cache(). Mọi thay đổi được hoàn tác khi thoát context.
+    """
+    from ..agent_core import graph as graph_mod, node as node_mod  # lazy — kéo theo LangGraph
+    with ExitStack() as stack:
+        patch = lambda target, name, value: stack.enter_context(mock.patch.object(target, name, value))
+        patch(node_mod, 'GeminiAnalyzerLLM', lambda: _StubAnalyzer(llm_ms))
+        patch(node_mod, 'GeminiSynthesizerLLM', lambda: _StubSynthesizer(llm_ms))
+        patch(node_mod, 'get_cache', lambda: cache)
+        # graph.py import trực tiếp các node → bấm giờ tại đó trước khi dựng graph
+        for name in _GRAPH_NODES:
+            patch(graph_mod, name, timer.wrap(name, getattr(graph_mod, name)))
+        yield graph_mod.MultiRoleAgentGraph()
+
+
+def _tool_hits(state: Dict[str, Any]) -> List[Tuple[Optional[str], str]]:
+    hits: List[Tuple[Optional[str], str]] = []
+    for r in state.get('tool_results') or []:
+        if r.get('tool_name') == 'search_project_documents' and isinstance(r.get('result'), list):
+            hits.extend((None, text) for text in r['result'])
+    return hits
+
+
+def bench_graph(
+    queries: Sequence[Query],
+    threads: int = BENCH_THREADS,
+    k: int = BENCH_K,
+    llm_ms: float = BENCH_LLM_MS,
+    warm_cache: bool = False,
+) -> Dict[str, Any]:
+    """
+    Chạy graph đầy đủ với LLM giả. warm_cache=True: cache được nạp sẵn câu
+    hỏi + câu trả lời nhãn của mọi query (chế độ cache_hit).
+    """
+    from ..cache.semantic_cache import SemanticCache
+    from ..tools.rag import get_embeddings
+
+    queries = list(queries)
+    cache = SemanticCache(persistent=False)
+    if warm_cache:
+        for q, emb in zip(queries, get_embeddings([q.question for q in queries])):
+            cache.store(query=q.question, query_embedding=emb, answer=q.answer or q.question)
+
+    timer = NodeTimer()
+    hits = [0]
+    with stubbed_graph(timer, cache, llm_ms) as agent:
+        def _one(q: Query) -> Optional[int]:
+            t0 = time.perf_counter()
+            state = agent.run(agent.create_new_state(q.question, ''))
+            timer.add('total', (time.perf_counter() - t0) * 1000)
+            if state.get('cache_hit'):
+                hits[0] += 1
+                answer = state.get('final_answer') or ''
+                return 1 if _answer_key(answer) == _answer_key(q.answer) else None
+            return rank_of(_tool_hits(state), q)
+
+        ranks, wall = run_concurrent(_one, queries, threads)
+
+    report = _mode_report(timer, ranks, wall, threads, k)
+    report['cache_hit_rate'] = round(hits[0] / len(queries), 4) if queries else 0.0
+    report['llm_ms'] = llm_ms
+    return report
+
+
+# ── suite + regression check ──────────────────────────────────────────────────
+
+MODES = ('retrieval', 'graph', 'cache_hit')
+
+
+def run_suite(
+    modes: Sequence[str] = MODES,
+    limit: int = BENCH_QUERIES,
+    threads: int = BENCH_THREADS,
+    k: int = BENCH_K,
+    llm_ms: float = BENCH_LLM_MS,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    queries = load_query_set(limit=limit, seed=seed)
+    result: Dict[str, Any] = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'queries': len(queries), 'threads': threads, 'k': k,
+            'llm_ms': llm_ms, 'seed': seed,
+        },
+        'modes': {},
+    }
+    for mode in modes:
+        log.info(f'[bench] {mode}: {len(queries)} queries × {threads} threads')
+        if mode == 'retrieval':
+            result['modes'][mode] = bench_retrieval(queries, threads=threads, k=k)
+        elif mode == 'graph':
+            result['modes'][mode] = bench_graph(queries, threads=threads, k=k, llm_ms=llm_ms)
+        elif mode == 'cache_hit':
+            result['modes'][mode] = bench_graph(queries, threads=threads, k=k, llm_ms=llm_ms,
+                                                warm_cache=True)
+        else:
+            raise ValueError(f'mode không hợp lệ: {mode!r} (chọn trong {MODES})')
+    return result
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    """
+    Các regression so với baseline: p95 (toàn request và từng node) tăng quá
+    `tolerance`, throughput / recall / MRR giảm quá `tolerance` (tương đối).
+    """
+    problems: List[str] = []
+    for mode, cur in (current.get('modes') or {}).items():
+        base = (baseline.get('modes') or {}).get(mode)
+        if not base:
+            continue
+        for step, stats in (cur.get('latency_ms') or {}).items():
+            old = (base.get('latency_ms') or {}).get(step, {}).get('p95')
+            if old and stats.get('p95', 0) > old * (1 + tolerance):
+                problems.append(f'{mode}.{step}.p95: {old} → {stats["p95"]} ms')
+        metrics = [('throughput_qps', cur, base)] + [
+            (name, cur.get('quality') or {}, base.get('quality') or {})
+            for name in (cur.get('quality') or {}) if name != 'n'
+        ]
+        for name, c, b in metrics:
+            old, new = b.get(name), c.get(name)
+            if old and new is not None and new < old * (1 - tolerance):
+                problems.append(f'{mode}.{name}: {old} → {new}')
+    return problems
@@ -0,0 +1,256 @@
+"""
+Gemini client pool — client dài hạn theo (key, model) + chọn key theo quota
+===========================================================================
+
+_ApiKeyPool cũ gọi `genai.configure(api_key=key)` (trạng thái global của cả
+process — race giữa các thread) và tạo `GenerativeModel` mới ở mỗi request,
+nên mỗi lời gọi LLM lại dựng client + bắt tay TLS/gRPC mới. Pool này:
+
+  • Giữ MỘT GenerativeModel cho mỗi (key, model), gắn GenerativeServiceClient
+    riêng của key đó (client_options.api_key) — kênh kết nối được tái sử dụng,
+    không đụng tới cấu hình global.
+    google-generativeai không có API công khai để gắn client theo từng model
+    (chỉ có `genai.configure` global), nên factory đặt `GenerativeModel._client`.
+    Vì đây là chi tiết nội bộ của SDK: phiên bản được pin trong requirements.txt,
+    factory báo lỗi ngay nếu thuộc tính biến mất, và test_gemini_pool.py kiểm
+    tra `generate_content` vẫn đi qua `self._client`.
+  • Concurrency thích ứng theo key (AIMD): giới hạn tăng dần 1/limit mỗi lần
+    thành công, giảm một nửa + cooldown khi gặp 429 (ResourceExhausted thật).
+    Key đang cooldown / hết slot không được chọn.
+  • Tuỳ chọn GEMINI_RPM_PER_KEY > 0: cửa sổ trượt 60 s đếm request của từng
+    key, remaining = RPM − số request trong cửa sổ; key hết lượt thì chờ. Mặc
+    định tắt — quota thực của key khác nhau, và chờ ở client chỉ cộng thêm độ
+    trễ mà không ngăn được 429.
+
+Tham số cấu hình (biến môi trường):
+  GEMINI_RPM_PER_KEY           : int,   default 0  — request/phút mỗi key (0 = không giới hạn)
+  GEMINI_MAX_CONCURRENCY       : int,   default 4  — số lời gọi đồng thời tối đa mỗi key
+  GEMINI_ACQUIRE_TIMEOUT_SECS  : float, default 20 — thời gian chờ key rảnh tối đa
+  GEMINI_QUOTA_COOLDOWN_SECS   : float, default 60 — cooldown key sau 429
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Generator, List, Optional, Tuple, Type
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+
+log = get_logger('rag.llm')
+
+RPM_PER_KEY:     int   = int(os.getenv('GEMINI_RPM_PER_KEY', '0'))
+MAX_CONCURRENCY: int   = int(os.getenv('GEMINI_MAX_CONCURRENCY', '4'))
+ACQUIRE_TIMEOUT: float = float(os.getenv('GEMINI_ACQUIRE_TIMEOUT_SECS', '20'))
+QUOTA_COOLDOWN:  float = float(os.getenv('GEMINI_QUOTA_COOLDOWN_SECS', '60'))
+
+_WINDOW_SECS = 60.0
+
+
+def _default_client_factory(key: str, model_name: str) -> Any:
+    """GenerativeModel gắn client gRPC riêng của key (không dùng genai.configure)."""
+    import google.generativeai as genai  # lazy
+    from google.ai import generativelanguage as glm  # type: ignore
+    model = genai.GenerativeModel(model_name)
+    # GenerativeModel tạo client mặc định (global) ở lần gọi đầu nếu _client là None.
+    # Thuộc tính nội bộ — SDK đổi cấu trúc thì báo lỗi ngay thay vì âm thầm dùng key global.
+    if '_client' not in vars(model):
+        raise RuntimeError(
+            f'google-generativeai {getattr(genai, "__version__", "?")}: GenerativeModel '
+            'không còn thuộc tính _client — xem lại gemini_pool._default_client_factory'
+        )
+    model._client = glm.GenerativeServiceClient(client_options={'api_key': key})
+    return model
+
+
+def _is_quota_error(exc: BaseException) -> bool:
+    return type(exc).__name__ == 'ResourceExhausted' or '429' in str(exc)
+
+
+class _KeyState:
+    __slots__ = ('key', 'limit', 'inflight', 'window', 'cooldown_until',
+                 'calls', 'throttled')
+
+    def __init__(self, key: str, limit: float) -> None:
+        self.key            = key
+        self.limit          = limit
+        self.inflight       = 0
+        self.window: Deque[float] = deque()
+        self.cooldown_until = 0.0
+        self.calls          = 0
+        self.throttled      = 0
+
+
+class GeminiClientPool:
+    """Thread-safe. `call(model, fn)` / `stream_call(model, prompt)` như _ApiKeyPool cũ."""
+
+    def __init__(
+        self,
+        keys: List[str],
+        client_factory: Callable[[str, str], Any] = _default_client_factory,
+        rpm_per_key: int = RPM_PER_KEY,
+        max_concurrency: int = MAX_CONCURRENCY,
+        acquire_timeout: float = ACQUIRE_TIMEOUT,
+        cooldown: float = QUOTA_COOLDOWN,
+        exhausted_error: Type[Exception] = RuntimeError,
+        is_quota_error: Callable[[BaseException], bool] = _is_quota_error,
+    ) -> None:
+        self._factory         = client_factory
+        self._rpm             = max(0, rpm_per_key)
+        self._max_concurrency = max(1, max_concurrency)
+        self._acquire_timeout = max(0.0, acquire_timeout)
+        self._cooldown        = max(0.0, cooldown)
+        self._exhausted_error = exhausted_error
+        self._is_quota_error  = is_quota_error
+
+        self._cond   = threading.Condition()
+        self._states = [_KeyState(k, float(self._max_concurrency)) for k in keys]
+        self._models: Dict[Tuple[str, str], Any] = {}
+        self._models_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    # ── clients ───────────────────────────────────────────────────────────────
+
+    def _model(self, key: str, model_name: str) -> Any:
+        cache_key = (key, model_name)
+        model = self._models.get(cache_key)
+        if model is None:
+            with self._models_lock:
+                model = self._models.get(cache_key)
+                if model is None:
+                    model = self._factory(key, model_name)
+                    self._models[cache_key] = model
+        return model
+
+    # ── key selection ─────────────────────────────────────────────────────────
+
+    def _remaining(self, st: _KeyState, now: float) -> float:
+        while st.window and now - st.window[0] >= _WINDOW_SECS:
+            st.window.popleft()
+        if not self._rpm:
+            return float('inf')
+        return self._rpm - len(st.window)
+
+    def _acquire(self, exclude: set) -> Optional[_KeyState]:
+        """Chọn key còn nhiều quota nhất và còn slot concurrency; chờ nếu tất cả bận."""
+        deadline = time.monotonic() + self._acquire_timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                pool = [st for st in self._states if st.key not in exclude]
+                if not pool:
+                    return None
+                ready = [
+                    st for st in pool
+                    if st.cooldown_until <= now
+                    and st.inflight < int(st.limit)
+                    and self._remaining(st, now) > 0
+                ]
+                if ready:
+                    st = max(ready, key=lambda s: (self._remaining(s, now), -s.inflight))
+                    break
+                wait = deadline - now
+                if wait <= 0:
+                    # Hết thời gian chờ — dùng key ít tải / hết cooldown sớm nhất
+                    st = min(pool, key=lambda s: (s.cooldown_until, s.inflight))
+                    break
+                self._cond.wait(min(wait, 0.5))
+            st.inflight += 1
+            st.calls    += 1
+            st.window.append(now)
+            return st
+
+    def _release(self, st: _KeyState, throttled: bool) -> None:
+        with self._cond:
+            st.inflight -= 1
+            if throttled:
+                st.throttled     += 1
+                st.limit          = max(1.0, st.limit / 2)
+                st.cooldown_until = time.monotonic() + self._cooldown
+            else:
+                st.limit = min(float(self._max_concurrency), st.limit + 1.0 / st.limit)
+            self._cond.notify_all()
+
+    def _no_keys(self) -> Exception:
+        return ValueError(
+            "Không có Gemini API key nào trong .env. "
+            "Đặt GOOGLE_API_KEY_1 / GOOGLE_API_KEY_2 / ... hoặc GOOGLE_API_KEY."
+        )
+
+    # ── public API ────────────────────────────────────────────────────────────
+
+    def call(self, model_name: str, call_fn: Callable[[Any], Any]) -> Any:
+        """Gọi call_fn(model); gặp 429 thì chuyển sang key khác (mỗi key thử một lần)."""
+        if not self._states:
+            raise self._no_keys()
+        tried: set = set()
+        last_exc: BaseException = RuntimeError("Chưa thử key nào.")
+        while True:
+            st = self._acquire(tried)
+            if st is None:
+                break
+            tried.add(st.key)
+            throttled = False
+            try:
+                return call_fn(self._model(st.key, model_name))
+            except Exception as exc:
+                if not self._is_quota_error(exc):
+                    raise
+                throttled, last_exc = True, exc
+                log.warning(
+                    "[LLM] Key ...%s hết quota (429) – thử key tiếp theo (%d/%d).",
+                    st.key[-4:], len(tried), len(self._states),
+                )
+            finally:
+                self._release(st, throttled)
+        raise self._exhausted_error(
+            "Tất cả Gemini API key đã hết quota (429). "
+            "Vui lòng thêm key mới hoặc nâng cấp plan tại https://aistudio.google.com/."
+        ) from last_exc
+
+    def stream_call(self, model_name: str, prompt: str) -> Generator[str, None, None]:
+        """generate_content(stream=True); chỉ đổi key khi 429 xảy ra trước chunk đầu tiên."""
+        if not self._states:
+            raise self._no_keys()
+        tried: set = set()
+        last_exc: BaseException = RuntimeError("Chưa thử key nào.")
+        while True:
+            st = self._acquire(tried)
+            if st is None:
+                break
+            tried.add(st.key)
+            throttled, started = False, False
+            try:
+                response = self._model(st.key, model_name).generate_content(prompt, stream=True)
+                for chunk in response:
+                    text = getattr(chunk, 'text', None)
+                    if text:
+                        started = True
+                        yield text
+                return
+            except Exception as exc:
+                if started or not self._is_quota_error(exc):
+                    raise
+                throttled, last_exc = True, exc
+                log.warning("[LLM] Key ...%s hết quota (429) khi stream – thử key tiếp theo.", st.key[-4:])
+            finally:
+                self._release(st, throttled)
+        raise self._exhausted_error("Tất cả Gemini API key đã hết quota (429).") from last_exc
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._cond:
+            return [{
+                'key':         f'...{st.key[-4:]}',
+                'inflight':    st.inflight,
+                'limit':       round(st.limit, 2),
+                'remaining':   None if not self._rpm else max(0, int(self._remaining(st, now))),
+                'cooling':     st.cooldown_until > now,
+                'calls':       st.calls,
+                'throttled':   st.throttled,
+            } for st in self._states]
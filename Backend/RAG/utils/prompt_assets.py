@@ -0,0 +1,101 @@
+"""
+Prompt assets — cache General_Prompt.docx / tool.yaml theo mtime
+=================================================================
+
+role_manager trước đây mở + parse General_Prompt.docx (python-docx) và
+YAML-parse tool.yaml ở MỌI request chat. Các file này gần như không đổi, nên
+`PromptAssetCache` giữ giá trị đã parse và chỉ chạy lại loader khi chữ ký
+file (st_mtime_ns, st_size) thay đổi — mỗi request chỉ còn một os.stat.
+File bị xoá / tạo lại cũng được phát hiện (chữ ký None ↔ có giá trị).
+
+`render_tool_descriptions` dựng sẵn khối "AVAILABLE TOOLS" cho
+GeminiAnalyzerLLM.analyze_task và nhớ kết quả cho danh sách tool gần nhất.
+"""
+
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from logger import get_logger
+
+log = get_logger('rag.prompt')
+
+_Signature = Optional[Tuple[int, int]]
+
+
+def _signature(path: Path) -> _Signature:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class PromptAssetCache:
+    """Cache thread-safe: path → (chữ ký file, giá trị đã parse)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: Dict[Path, Tuple[_Signature, Any]] = {}
+        self._hits  = 0
+        self._loads = 0
+
+    def get(self, path: Path, loader: Callable[[Path], Any]) -> Any:
+        """Trả giá trị của `loader(path)`, chỉ gọi lại loader khi file thay đổi."""
+        path = Path(path)
+        sig = _signature(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == sig:
+                self._hits += 1
+                return entry[1]
+
+        # Parse ngoài lock; hai request cùng lúc có thể cùng parse một lần — vô hại
+        value = loader(path)
+        with self._lock:
+            self._entries[path] = (sig, value)
+            self._loads += 1
+        log.debug(f'[prompt] loaded {path.name}')
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'assets': len(self._entries), 'hits': self._hits, 'loads': self._loads}
+
+
+_assets = PromptAssetCache()
+
+
+def get_assets() -> PromptAssetCache:
+    return _assets
+
+
+# ── tool description block ────────────────────────────────────────────────────
+
+_tool_block_lock = threading.Lock()
+_tool_block: Tuple[Optional[List[Dict[str, Any]]], str] = (None, '')
+
+
+def render_tool_descriptions(role_tools: List[Dict[str, Any]]) -> str:
+    """Khối mô tả tool cho prompt analyzer; dựng lại chỉ khi danh sách tool đổi."""
+    global _tool_block
+    with _tool_block_lock:
+        cached_tools, block = _tool_block
+        if cached_tools is not None and cached_tools == role_tools:
+            return block
+    block = "\n".join([
+        f"- {t['name']}: {t.get('description', '')}\n"
+        f"  Parameters: {t.get('parameters', {})}\n"
+        f"  Returns: {t.get('returns', '')}"
+        for t in role_tools
+    ])
+    with _tool_block_lock:
+        _tool_block = ([dict(t) for t in role_tools], block)
+    return block
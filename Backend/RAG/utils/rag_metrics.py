@@ -9,9 +9,13 @@ the query vector and each retrieved document vector:
   • Dot Product        = Σ(Aᵢ·Bᵢ)                     unbounded,     higher = more similar
 
 All output goes to the 'rag.metrics' logger (terminal only).
+
+Metrics are opt-in (RAG_RETRIEVAL_METRICS=1): they need the document
+embeddings, which retrieval otherwise does not fetch from ChromaDB.
 """
 
 import math
+import os
 import sys
 from pathlib import Path
 from typing import List, Optional
@@ -22,6 +26,8 @@ from logger import get_logger
 
 log = get_logger('rag.metrics')
 
+METRICS_ENABLED: bool = os.getenv('RAG_RETRIEVAL_METRICS', '0').strip().lower() in ('1', 'true', 'yes')
+
 # ANSI codes for inline coloring inside metric rows (no reset needed per line)
 _GREEN  = '\033[92m'
 _YELLOW = '\033[93m'
@@ -0,0 +1,67 @@
+import pandas as pd
+
+from RAG.utils.benchmark import (
+    NodeTimer, Query, bench_retrieval, compare, load_query_set, quality, rank_of, summarize,
+)
+
+
+def test_summarize_percentiles():
+    s = summarize([float(i) for i in range(1, 101)])
+    assert s['n'] == 100 and s['p50'] == 50.5 and s['max'] == 100.0
+    assert s['p95'] <= s['p99'] <= s['max']
+    assert summarize([])['n'] == 0
+
+
+def test_rank_and_quality_by_id_or_answer():
+    q = Query('pc-001', 'câu hỏi', 'Trả lời  đúng', 'faq_pccc.xlsx')
+    assert rank_of([('x', 'khác'), ('pc-001', '')], q) == 2
+    assert rank_of([(None, 'khác'), (None, 'Trả lời đúng')], q) == 2
+    assert rank_of([('x', 'khác')], q) is None
+    assert quality([1, 2, None, 6], k=5) == {'recall@5': 0.5, 'mrr': 0.375, 'n': 4}
+
+
+def test_node_timer_records_even_on_error():
+    timer = NodeTimer()
+
+    def boom():
+        raise RuntimeError('x')
+
+    timer.wrap('ok', lambda: 1)()
+    try:
+        timer.wrap('boom', boom)()
+    except RuntimeError:
+        pass
+    assert set(timer.report()) == {'ok', 'boom'}
+
+
+def test_load_query_set_is_deterministic(tmp_path):
+    rows = [{'id': f'a-{i}', 'question': f'q{i}', 'answer': f'a{i}'} for i in range(10)]
+    rows.append({'id': 'a-1', 'question': 'trùng id', 'answer': ''})
+    pd.DataFrame(rows).to_excel(tmp_path / 'faq_test.xlsx', sheet_name='FAQ', index=False)
+    first = load_query_set(tmp_path, limit=5, seed=1)
+    assert [q.id for q in first] == [q.id for q in load_query_set(tmp_path, limit=5, seed=1)]
+    assert len(first) == 5 and len(load_query_set(tmp_path, limit=100)) == 10
+
+
+def test_bench_retrieval_reports_nodes_and_quality():
+    queries = [Query(f'id{i}', f'q{i}', f'a{i}', 'f') for i in range(6)]
+
+    def retrieve(query, top_k, query_embed):
+        i = int(query[1:])
+        ids = ['other', f'id{i}'] if i % 2 else [f'id{i}']
+        return [{'id': d, 'meta': {}} for d in ids]
+
+    r = bench_retrieval(queries, threads=3, k=5, embed_fn=lambda q: [1.0], retrieve_fn=retrieve)
+    assert r['queries'] == 6 and r['throughput_qps'] > 0
+    assert {'embed', 'retrieve', 'total'} <= set(r['latency_ms'])
+    assert r['quality'] == {'recall@5': 1.0, 'mrr': 0.75, 'n': 6}
+
+
+def test_compare_flags_regressions():
+    base = {'modes': {'graph': {'throughput_qps': 100, 'quality': {'recall@5': 0.9, 'n': 10},
+                                'latency_ms': {'total': {'p95': 10.0}, 'tool_executor': {'p95': 5.0}}}}}
+    cur = {'modes': {'graph': {'throughput_qps': 95, 'quality': {'recall@5': 0.6, 'n': 10},
+                               'latency_ms': {'total': {'p95': 11.0}, 'tool_executor': {'p95': 9.0}}}}}
+    problems = compare(cur, base, tolerance=0.2)
+    assert problems == ['graph.tool_executor.p95: 5.0 → 9.0 ms', 'graph.recall@5: 0.9 → 0.6']
+    assert compare(base, base) == []
@@ -0,0 +1,128 @@
+import threading
+
+import pytest
+
+from RAG.utils.gemini_pool import GeminiClientPool
+
+
+class Quota(Exception):
+    pass
+
+
+def _pool(keys, created=None, **kw):
+    def factory(key, model_name):
+        if created is not None:
+            created.append((key, model_name))
+        return {'key': key, 'model': model_name}
+    kw.setdefault('acquire_timeout', 0.2)
+    return GeminiClientPool(keys, client_factory=factory, exhausted_error=Quota,
+                            is_quota_error=lambda e: isinstance(e, Quota), **kw)
+
+
+def test_one_long_lived_client_per_key_and_model():
+    created = []
+    pool = _pool(['k1'], created)
+    for _ in range(3):
+        assert pool.call('flash', lambda m: m['key']) == 'k1'
+    pool.call('pro', lambda m: m['model'])
+    assert created == [('k1', 'flash'), ('k1', 'pro')]
+
+
+def test_picks_key_with_most_remaining_quota():
+    pool = _pool(['k1', 'k2'], rpm_per_key=3)
+    used = [pool.call('m', lambda m: m['key']) for _ in range(4)]
+    # luân phiên theo quota còn lại → không key nào vượt 2 lần
+    assert sorted(used) == ['k1', 'k1', 'k2', 'k2']
+    stats = {s['key']: s for s in pool.stats()}
+    assert stats['...k1']['remaining'] == 1 and stats['...k2']['remaining'] == 1
+
+
+def test_quota_error_halves_limit_cools_down_and_fails_over():
+    pool = _pool(['k1', 'k2'], max_concurrency=4, rpm_per_key=0)
+
+    def fn(model):
+        if model['key'] == 'k1':
+            raise Quota('429')
+        return model['key']
+
+    assert pool.call('m', fn) == 'k2'   # k1 được chọn trước (hoà quota), bị 429
+    assert pool.call('m', fn) == 'k2'   # k1 đang cooldown → không bị gọi lại
+    stats = {s['key']: s for s in pool.stats()}
+    assert stats['...k1']['throttled'] == 1 and stats['...k1']['calls'] == 1
+    assert stats['...k1']['cooling'] and stats['...k1']['limit'] == 2.0
+
+
+def test_all_keys_exhausted_raises_and_other_errors_propagate():
+    pool = _pool(['k1', 'k2'], rpm_per_key=0)
+
+    def quota(model):
+        raise Quota('429')
+
+    with pytest.raises(Quota):
+        pool.call('m', quota)
+    with pytest.raises(ValueError):
+        _pool([]).call('m', quota)
+    with pytest.raises(KeyError):
+        _pool(['k3']).call('m', lambda m: {}['x'])
+
+
+def test_concurrency_per_key_is_bounded():
+    pool = _pool(['k1'], max_concurrency=2, rpm_per_key=0, acquire_timeout=5)
+    lock, active, peak = threading.Lock(), [0], [0]
+    gate = threading.Event()
+
+    def fn(model):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        gate.wait(0.05)
+        with lock:
+            active[0] -= 1
+        return 1
+
+    threads = [threading.Thread(target=pool.call, args=('m', fn)) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert peak[0] <= 2
+
+
+def test_stream_fails_over_only_before_first_chunk():
+    class Model:
+        def __init__(self, key):
+            self.key = key
+
+        def generate_content(self, prompt, stream=False):
+            if self.key == 'k1':
+                raise Quota('429')
+            return [type('C', (), {'text': 'a'})(), type('C', (), {'text': 'b'})()]
+
+    pool = GeminiClientPool(['k1', 'k2'], client_factory=lambda k, m: Model(k),
+                            exhausted_error=Quota, is_quota_error=lambda e: isinstance(e, Quota),
+                            rpm_per_key=0, acquire_timeout=0.1)
+    assert ''.join(pool.stream_call('m', 'p')) == 'ab'
+
+
+def test_sdk_still_routes_generate_content_through_private_client():
+    # Factory dựa vào GenerativeModel._client (nội bộ SDK) — đổi phiên bản mà
+    # thuộc tính này không còn được dùng thì test phải đỏ trước khi lên production.
+    import inspect
+
+    genai = pytest.importorskip('google.generativeai')
+    glm = pytest.importorskip('google.ai.generativelanguage')
+    from RAG.utils.gemini_pool import _default_client_factory
+
+    model = _default_client_factory('test-key', 'gemini-1.5-flash')
+    assert isinstance(model._client, glm.GenerativeServiceClient)
+    assert 'self._client' in inspect.getsource(genai.GenerativeModel.generate_content)
+
+
+def test_rpm_throttle_is_off_by_default(monkeypatch):
+    monkeypatch.delenv('GEMINI_RPM_PER_KEY', raising=False)
+    import importlib
+    from RAG.utils import gemini_pool
+    assert importlib.reload(gemini_pool).RPM_PER_KEY == 0
+    pool = _pool(['k1'], rpm_per_key=gemini_pool.RPM_PER_KEY, acquire_timeout=5)
+    assert all(pool.call('m', lambda m: m['key']) == 'k1' for _ in range(50))
+    assert pool.stats()[0]['remaining'] is None
@@ -0,0 +1,41 @@
+import os
+
+from RAG.utils import prompt_assets
+from RAG.utils.prompt_assets import PromptAssetCache, render_tool_descriptions
+
+
+def test_loader_runs_again_only_when_file_changes(tmp_path):
+    path = tmp_path / 'tool.yaml'
+    path.write_text('v1', encoding='utf-8')
+    calls = []
+
+    def loader(p):
+        calls.append(p)
+        return p.read_text(encoding='utf-8') if p.exists() else None
+
+    cache = PromptAssetCache()
+    assert cache.get(path, loader) == 'v1'
+    assert cache.get(path, loader) == 'v1'
+    assert len(calls) == 1
+
+    path.write_text('v2!', encoding='utf-8')
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert cache.get(path, loader) == 'v2!'
+
+    path.unlink()
+    assert cache.get(path, loader) is None
+    assert cache.get(path, loader) is None
+    assert len(calls) == 3
+    assert cache.stats() == {'assets': 1, 'hits': 2, 'loads': 3}
+
+
+def test_tool_block_is_rendered_once_per_tool_list(monkeypatch):
+    monkeypatch.setattr(prompt_assets, '_tool_block', (None, ''))
+    tools = [{'name': 'search', 'description': 'Tìm', 'parameters': {'query': {}}, 'returns': 'docs'}]
+    block = render_tool_descriptions(tools)
+    assert block == "- search: Tìm\n  Parameters: {'query': {}}\n  Returns: docs"
+    assert render_tool_descriptions([dict(tools[0])]) is block
+
+    changed = [dict(tools[0], description='Tra cứu')]
+    assert 'Tra cứu' in render_tool_descriptions(changed)
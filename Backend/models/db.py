@@ -107,6 +107,10 @@ def init_db(app):
             CREATE INDEX IF NOT EXISTS idx_conv_timestamp
                 ON public.conversation_history(timestamp);
 
+            -- Tóm tắt từng lượt, ghi nền sau khi trả lời (RAG/agent_core/memory_summary.py)
+            ALTER TABLE public.conversation_history
+                ADD COLUMN IF NOT EXISTS summary TEXT;
+
             CREATE TABLE IF NOT EXISTS public.query_results (
                 id SERIAL PRIMARY KEY,
                 conversation_id INTEGER
@@ -130,7 +134,9 @@ def init_db(app):
                 id          SERIAL PRIMARY KEY,
                 query_hash  VARCHAR(64) UNIQUE NOT NULL,
                 query_text  TEXT NOT NULL,
-                query_vector TEXT NOT NULL,
+                query_vector TEXT,
+                query_vector_bin BYTEA,
+                vector_dtype VARCHAR(8),
                 answer_text TEXT NOT NULL,
                 hit_count   INTEGER NOT NULL DEFAULT 0,
                 created_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
@@ -141,6 +147,15 @@ def init_db(app):
                 ON public.rag_semantic_cache(expires_at);
             CREATE INDEX IF NOT EXISTS idx_cache_last_hit
                 ON public.rag_semantic_cache(last_hit_at DESC);
+
+            -- Vector nhị phân (float16/float32 little-endian) thay cho JSON text;
+            -- dòng JSON cũ vẫn đọc được và tự hết hạn theo TTL
+            ALTER TABLE public.rag_semantic_cache
+                ADD COLUMN IF NOT EXISTS query_vector_bin BYTEA;
+            ALTER TABLE public.rag_semantic_cache
+                ADD COLUMN IF NOT EXISTS vector_dtype VARCHAR(8);
+            ALTER TABLE public.rag_semantic_cache
+                ALTER COLUMN query_vector DROP NOT NULL;
             ''')
             db.session.execute(rag_ddl)
             db.session.commit()
@@ -245,6 +260,10 @@ def init_db(app):
                 ON public.queue_tickets(user_id, date);
             CREATE INDEX IF NOT EXISTS idx_qt_status
                 ON public.queue_tickets(status, agency_id, date);
+            -- Vé đang chờ theo thứ tự gọi — subquery FOR UPDATE SKIP LOCKED của call_next
+            CREATE INDEX IF NOT EXISTS idx_qt_waiting_order
+                ON public.queue_tickets(agency_id, date, priority DESC, ticket_number)
+                WHERE status = 'waiting';
 
             CREATE TABLE IF NOT EXISTS public.agency_counters (
                 id              VARCHAR(80)  PRIMARY KEY,
@@ -268,6 +287,24 @@ def init_db(app):
                 updated_at      TIMESTAMPTZ  NOT NULL DEFAULT now(),
                 PRIMARY KEY (agency_id, service_id)
             );
+
+            -- Bộ đếm số vé theo (cơ quan, prefix, ngày) — QueueTicket.create
+            -- cấp số bằng upsert dòng này, không dùng MAX(ticket_number)+1
+            CREATE TABLE IF NOT EXISTS public.queue_ticket_counters (
+                agency_id       VARCHAR(120) NOT NULL,
+                prefix          VARCHAR(5)   NOT NULL,
+                date            DATE         NOT NULL,
+                last_number     INTEGER      NOT NULL DEFAULT 0,
+                PRIMARY KEY (agency_id, prefix, date)
+            );
+            -- Tiếp nối số đã cấp trong ngày (deploy giữa giờ làm việc)
+            INSERT INTO public.queue_ticket_counters (agency_id, prefix, date, last_number)
+                SELECT agency_id, prefix, date, MAX(ticket_number)
+                FROM public.queue_tickets
+                WHERE date >= CURRENT_DATE
+                GROUP BY agency_id, prefix, date
+            ON CONFLICT (agency_id, prefix, date) DO UPDATE
+                SET last_number = GREATEST(queue_ticket_counters.last_number, EXCLUDED.last_number);
             ''')
             db.session.execute(queue_ddl)
             db.session.commit()
@@ -6,6 +6,8 @@ import math
 import uuid
 from datetime import datetime
 from models.user import FileStorage
+from models.queue_state import QueueStateEngine
+from services import queue_events
 
 try:
     from models.db import db
@@ -87,28 +89,37 @@ class QueueTicket:
     def _save_json(tickets: list) -> None:
         FileStorage.write_json('queue_tickets.json', tickets)
 
-    # ── next ticket number ────────────────────────────────────────────────────
+    # ── create ────────────────────────────────────────────────────────────────
 
-    @staticmethod
-    def _next_number_db(agency_id: str, prefix: str, date: str) -> int:
-        row = db.session.execute(text("""
-            SELECT COALESCE(MAX(ticket_number), 0) + 1
-            FROM public.queue_tickets
-            WHERE agency_id = :aid AND prefix = :pfx AND date = :dt
-        """), {'aid': agency_id, 'pfx': prefix, 'dt': date}).fetchone()
-        return int(row[0]) if row else 1
+    # Cấp số + INSERT vé trong MỘT câu lệnh: upsert queue_ticket_counters khoá
+    # dòng (agency, prefix, date) tới khi commit, nên các kiosk đồng thời nhận số
+    # liên tiếp không trùng; RETURNING trả luôn vé vừa tạo (không SELECT lại).
+    _CREATE_SQL = """
+        WITH next AS (
+            INSERT INTO public.queue_ticket_counters AS c (agency_id, prefix, date, last_number)
+            VALUES (:aid, :pfx, :dt, 1)
+            ON CONFLICT (agency_id, prefix, date)
+                DO UPDATE SET last_number = c.last_number + 1
+            RETURNING last_number
+        )
+        INSERT INTO public.queue_tickets
+            (id, agency_id, service_id, service_name, ticket_number, prefix,
+             user_id, user_name, status, priority, estimated_wait, date)
+        SELECT :id, :aid, :sid, :sname, next.last_number, :pfx,
+               :uid, :uname, 'waiting', :prio, :wait, :dt
+        FROM next
+        RETURNING *
+    """
 
     @staticmethod
-    def _next_number_json(agency_id: str, prefix: str, date: str) -> int:
+    def _next_number_json(tickets: list, agency_id: str, prefix: str, date: str) -> int:
         existing = [
-            t for t in QueueTicket._all_json()
+            t.get('ticketNumber', 0) for t in tickets
             if t.get('agencyId') == agency_id
             and t.get('prefix') == prefix
             and t.get('date') == date
         ]
-        return (max(t.get('ticketNumber', 0) for t in existing) + 1) if existing else 1
-
-    # ── create ────────────────────────────────────────────────────────────────
+        return (max(existing) + 1) if existing else 1
 
     @staticmethod
     def create(data: dict) -> dict:
@@ -117,51 +128,41 @@ class QueueTicket:
         aid     = data['agencyId']
         sid     = data.get('serviceId', '')
         uid     = data.get('userId')
+        wait    = QueueService.estimate_wait(aid, sid, data.get('priority', 0), prefix)
 
         if _use_db():
-            num = QueueTicket._next_number_db(aid, prefix, date)
-            tid = str(uuid.uuid4())
-            wait = QueueService.estimate_wait(aid, sid, data.get('priority', 0), prefix)
-            db.session.execute(text("""
-                INSERT INTO public.queue_tickets
-                    (id, agency_id, service_id, service_name, ticket_number, prefix,
-                     user_id, user_name, status, priority, estimated_wait, date)
-                VALUES
-                    (:id, :aid, :sid, :sname, :num, :pfx,
-                     :uid, :uname, 'waiting', :prio, :wait, :dt)
-            """), {
-                'id': tid, 'aid': aid, 'sid': sid,
+            row = db.session.execute(text(QueueTicket._CREATE_SQL), {
+                'id': str(uuid.uuid4()), 'aid': aid, 'sid': sid,
                 'sname': data.get('serviceName', ''),
-                'num': num, 'pfx': prefix,
+                'pfx': prefix,
                 'uid': uid, 'uname': data.get('userName', ''),
                 'prio': data.get('priority', 0),
                 'wait': wait, 'dt': date,
-            })
+            }).fetchone()
             db.session.commit()
-            row = db.session.execute(
-                text("SELECT * FROM public.queue_tickets WHERE id = :id"), {'id': tid}
-            ).fetchone()
-            return _row_to_dict(row)
-
-        # JSON fallback
-        tickets = QueueTicket._all_json()
-        num  = QueueTicket._next_number_json(aid, prefix, date)
-        tid  = str(uuid.uuid4())
-        wait = QueueService.estimate_wait(aid, sid, data.get('priority', 0), prefix)
-        ticket = {
-            'id': tid, 'agencyId': aid, 'serviceId': sid,
-            'serviceName': data.get('serviceName', ''),
-            'ticketNumber': num, 'prefix': prefix,
-            'ticketCode': _ticket_code(prefix, num),
-            'userId': uid, 'userName': data.get('userName', ''),
-            'counterNo': None, 'status': STATUS_WAITING,
-            'priority': data.get('priority', 0),
-            'estimatedWait': wait,
-            'calledAt': None, 'servedAt': None, 'doneAt': None,
-            'createdAt': _now_iso(), 'updatedAt': _now_iso(), 'date': date,
-        }
-        tickets.append(ticket)
-        QueueTicket._save_json(tickets)
+            ticket = _row_to_dict(row)
+            _emit(ticket)
+            return ticket
+
+        # JSON fallback — đọc, cấp số, ghi dưới cùng một file lock
+        with FileStorage.lock('queue_tickets.json'):
+            tickets = QueueTicket._all_json()
+            num  = QueueTicket._next_number_json(tickets, aid, prefix, date)
+            ticket = {
+                'id': str(uuid.uuid4()), 'agencyId': aid, 'serviceId': sid,
+                'serviceName': data.get('serviceName', ''),
+                'ticketNumber': num, 'prefix': prefix,
+                'ticketCode': _ticket_code(prefix, num),
+                'userId': uid, 'userName': data.get('userName', ''),
+                'counterNo': None, 'status': STATUS_WAITING,
+                'priority': data.get('priority', 0),
+                'estimatedWait': wait,
+                'calledAt': None, 'servedAt': None, 'doneAt': None,
+                'createdAt': _now_iso(), 'updatedAt': _now_iso(), 'date': date,
+            }
+            tickets.append(ticket)
+            QueueTicket._save_json(tickets)
+        _emit(ticket)
         return ticket
 
     # ── find ──────────────────────────────────────────────────────────────────
@@ -196,6 +197,14 @@ class QueueTicket:
 
     @staticmethod
     def find_all(agency_id: str = None, date: str = None, status: str = None) -> list:
+        # Hàng chờ hôm nay của một cơ quan: đọc từ state trong bộ nhớ
+        if agency_id and date == _today():
+            return queue_state(agency_id).tickets(status)
+        return QueueTicket._scan(agency_id, date, status)
+
+    @staticmethod
+    def _scan(agency_id: str = None, date: str = None, status: str = None) -> list:
+        """Đọc thẳng từ PostgreSQL / JSON (nguồn dựng queue state)."""
         if _use_db():
             where, params = [], {}
             if agency_id: where.append('agency_id = :aid');  params['aid'] = agency_id
@@ -244,63 +253,95 @@ class QueueTicket:
                 params
             )
             db.session.commit()
-            return QueueTicket.find_by_id(ticket_id)
-
-        tickets = QueueTicket._all_json()
-        for i, t in enumerate(tickets):
-            if t.get('id') == ticket_id:
-                t.update(updates)
-                t['updatedAt'] = _now_iso()
-                QueueTicket._save_json(tickets)
-                return t
+            ticket = QueueTicket.find_by_id(ticket_id)
+            _emit(ticket)
+            return ticket
+
+        with FileStorage.lock('queue_tickets.json'):
+            tickets = QueueTicket._all_json()
+            for i, t in enumerate(tickets):
+                if t.get('id') == ticket_id:
+                    t.update(updates)
+                    t['updatedAt'] = _now_iso()
+                    QueueTicket._save_json(tickets)
+                    _emit(t)
+                    return t
         return None
 
     # ── call_next ─────────────────────────────────────────────────────────────
 
+    # Nhận vé trong MỘT câu lệnh: subquery khoá dòng vé chờ đầu tiên bằng
+    # FOR UPDATE SKIP LOCKED — quầy khác bấm cùng lúc bỏ qua dòng đang bị khoá và
+    # lấy vé kế tiếp thay vì chờ hoặc gọi trùng; điều kiện status ở UPDATE ngoài
+    # chặn trường hợp vé vừa bị đổi trạng thái sau khi subquery đọc.
+    # Thứ tự: priority (lớp ưu tiên) → dịch vụ quầy ưu tiên (affinity) → số vé.
+    _CALL_NEXT_SQL = """
+        UPDATE public.queue_tickets AS q
+        SET status = 'called', counter_no = :cnt, called_at = now(), updated_at = now()
+        WHERE q.id = (
+            SELECT id FROM public.queue_tickets
+            WHERE {where}
+            ORDER BY {order}
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        ) AND q.status = 'waiting'
+        RETURNING q.*
+    """
+
+    @staticmethod
+    def _call_next_query(agency_id: str, counter_no: int, service_id: str = None,
+                         affinity: list = None, date: str = None) -> tuple:
+        """(sql, params) cho call_next trên PostgreSQL — dùng chung với scripts/bench_call_next.py."""
+        where = "agency_id = :aid AND status = 'waiting' AND date = :dt"
+        order = 'priority DESC, ticket_number ASC'
+        params: dict = {'aid': agency_id, 'dt': date or _today(), 'cnt': counter_no}
+        if service_id:
+            where += ' AND service_id = :sid'
+            params['sid'] = service_id
+        elif affinity:
+            order = 'priority DESC, (service_id = ANY(:aff)) DESC, ticket_number ASC'
+            params['aff'] = list(affinity)
+        return QueueTicket._CALL_NEXT_SQL.format(where=where, order=order), params
+
     @staticmethod
-    def call_next(agency_id: str, counter_no: int, service_id: str = None) -> dict | None:
+    def call_next(agency_id: str, counter_no: int, service_id: str = None,
+                  affinity: list = None) -> dict | None:
+        """
+        Gọi vé chờ tiếp theo cho quầy. service_id: chỉ lấy vé của dịch vụ đó;
+        affinity: các dịch vụ quầy ưu tiên phục vụ (vẫn lấy vé khác nếu hết).
+        """
         if _use_db():
-            where = "agency_id = :aid AND status = 'waiting' AND date = :dt"
-            params: dict = {'aid': agency_id, 'dt': _today(), 'cnt': counter_no}
-            if service_id:
-                where += ' AND service_id = :sid'
-                params['sid'] = service_id
-            row = db.session.execute(text(f"""
-                SELECT * FROM public.queue_tickets
-                WHERE {where}
-                ORDER BY priority DESC, ticket_number ASC
-                LIMIT 1
-            """), params).fetchone()
+            sql, params = QueueTicket._call_next_query(agency_id, counter_no, service_id, affinity)
+            row = db.session.execute(text(sql), params).fetchone()
+            db.session.commit()
             if not row:
                 return None
             ticket = _row_to_dict(row)
-            return QueueTicket.update(ticket['id'], {
-                'status': STATUS_CALLED,
-                'counterNo': counter_no,
-                'calledAt': _now_iso(),
-            })
-
-        tickets = QueueTicket._all_json()
-        waiting = sorted(
-            [
-                t for t in tickets
-                if t.get('agencyId') == agency_id
-                and t.get('status') == STATUS_WAITING
-                and t.get('date') == _today()
-                and (service_id is None or t.get('serviceId') == service_id)
-            ],
-            key=lambda t: (-t.get('priority', 0), t.get('ticketNumber', 0))
-        )
-        if not waiting:
-            return None
-        nxt = waiting[0]
-        for t in tickets:
-            if t.get('id') == nxt['id']:
-                t.update({'status': STATUS_CALLED, 'counterNo': counter_no,
-                           'calledAt': _now_iso(), 'updatedAt': _now_iso()})
-                QueueTicket._save_json(tickets)
-                return t
-        return None
+            _emit(ticket)
+            return ticket
+
+        preferred = set(affinity or ())
+        with FileStorage.lock('queue_tickets.json'):
+            tickets = QueueTicket._all_json()
+            waiting = sorted(
+                [
+                    t for t in tickets
+                    if t.get('agencyId') == agency_id
+                    and t.get('status') == STATUS_WAITING
+                    and t.get('date') == _today()
+                    and (service_id is None or t.get('serviceId') == service_id)
+                ],
+                key=lambda t: (-t.get('priority', 0), t.get('serviceId') not in preferred,
+                               t.get('ticketNumber', 0))
+            )
+            if not waiting:
+                return None
+            nxt = waiting[0]
+            nxt.update({'status': STATUS_CALLED, 'counterNo': counter_no,
+                        'calledAt': _now_iso(), 'updatedAt': _now_iso()})
+            QueueTicket._save_json(tickets)
+        _emit(nxt)
+        return nxt
 
     # ── active check ──────────────────────────────────────────────────────────
 
@@ -313,6 +354,40 @@ class QueueTicket:
         return None
 
 
+# ── Queue state (models/queue_state.py) ──────────────────────────────────────
+
+_engine = QueueStateEngine(lambda agency_id, date: QueueTicket._scan(agency_id, date))
+
+
+def queue_state(agency_id: str, date: str = None):
+    """AgencyQueueState của cơ quan trong ngày (mặc định hôm nay), dựng lười từ DB/JSON."""
+    return _engine.get(agency_id, date or _today())
+
+
+def _emit(ticket: dict) -> None:
+    """Vé vừa đổi: cập nhật state cục bộ và phát event cho các worker khác."""
+    if ticket:
+        _engine.apply(ticket)
+        queue_events.publish('ticket', ticket.get('agencyId'), ticket)
+
+
+def _on_queue_event(event: dict) -> None:
+    """Event từ worker khác → áp vào state của process này."""
+    if not event.get('remote'):
+        return                                   # event cục bộ đã được _emit áp
+    if event.get('kind') == 'resync':
+        _engine.clear()                          # mất event → dựng lại từ DB ở lần đọc sau
+        return
+    ticket = event.get('ticket')
+    if ticket is None and event.get('ticketId'):
+        ticket = QueueTicket.find_by_id(event['ticketId'])
+    if ticket:
+        _engine.apply(ticket)
+
+
+queue_events.subscribe(_on_queue_event)
+
+
 # ── AgencyCounter ─────────────────────────────────────────────────────────────
 
 class AgencyCounter:
@@ -361,6 +436,7 @@ class AgencyCounter:
                 SELECT * FROM public.agency_counters
                 WHERE agency_id = :aid AND counter_no = :cnt
             """), {'aid': agency_id, 'cnt': counter_no}).fetchone()
+            queue_events.publish('counter', agency_id)
             return dict(row._mapping) if row else {}
 
         counters = AgencyCounter._all_json()
@@ -369,6 +445,7 @@ class AgencyCounter:
                 c.update({'isActive': is_active, 'operatorName': operator_name,
                            'updatedAt': _now_iso()})
                 AgencyCounter._save_json(counters)
+                queue_events.publish('counter', agency_id)
                 return c
         new_c = {
             'id': str(uuid.uuid4()), 'agencyId': agency_id, 'counterNo': counter_no,
@@ -377,6 +454,7 @@ class AgencyCounter:
         }
         counters.append(new_c)
         AgencyCounter._save_json(counters)
+        queue_events.publish('counter', agency_id)
         return new_c
 
 
@@ -440,12 +518,11 @@ class QueueService:
 
     @staticmethod
     def estimate_wait(agency_id: str, service_id: str,
-                      priority: int = 0, prefix: str = 'A') -> int:
-        today = _today()
-        waiting = QueueTicket.find_all(agency_id=agency_id, date=today, status=STATUS_WAITING)
-        tickets_ahead = len(waiting) if priority == 0 else sum(
-            1 for t in waiting if t.get('priority', 0) > 0
-        )
+                      priority: int = 0, prefix: str = 'A', ticket_id: str = None) -> int:
+        """ticket_id: vé đang chờ → dùng vị trí thật của vé thay vì toàn bộ hàng chờ."""
+        state = queue_state(agency_id)
+        position = state.position(ticket_id) if ticket_id else None
+        tickets_ahead = position if position is not None else state.waiting_ahead(priority)
         num_counters = AgencyCounter.active_count(agency_id)
         avg_time     = ServiceStats.avg_service_time(agency_id, service_id)
         peak_factor  = QueueService._peak_factor()
@@ -458,53 +535,50 @@ class QueueService:
 
     @staticmethod
     def queue_summary(agency_id: str) -> dict:
-        today    = _today()
-        all_day  = QueueTicket.find_all(agency_id=agency_id, date=today)
-
-        waiting  = [t for t in all_day if t['status'] == STATUS_WAITING]
-        called   = [t for t in all_day if t['status'] == STATUS_CALLED]
-        serving  = [t for t in all_day if t['status'] == STATUS_SERVING]
-        done     = [t for t in all_day if t['status'] == STATUS_DONE]
+        today = _today()
+        state = queue_state(agency_id, today)
 
-        # now_serving: quầy đang phục vụ
+        # now_serving: quầy đang gọi / phục vụ
         now_serving = [
             {
                 'counterNo':   t.get('counterNo'),
                 'ticketCode':  t.get('ticketCode') or _ticket_code(t.get('prefix', 'A'), t.get('ticketNumber', 0)),
                 'serviceName': t.get('serviceName', ''),
             }
-            for t in (called + serving) if t.get('counterNo')
+            for t in state.now_serving()
         ]
 
-        # avg service time
-        served_times = []
-        for t in done:
-            if t.get('servedAt') and t.get('doneAt'):
-                try:
-                    s = datetime.fromisoformat(t['servedAt'])
-                    d = datetime.fromisoformat(t['doneAt'])
-                    served_times.append((d - s).total_seconds())
-                except Exception:
-                    pass
-        avg_service = int(sum(served_times) / len(served_times)) if served_times else 0
-
-        tw = len(waiting)
+        tw = state.count(STATUS_WAITING)
         load_level = 'high' if tw > 15 else ('medium' if tw > 5 else 'low')
 
         return {
             'agencyId':          agency_id,
             'date':              today,
             'totalWaiting':      tw,
-            'totalCalled':       len(called),
-            'totalServing':      len(serving),
-            'totalDone':         len(done),
+            'totalCalled':       state.count(STATUS_CALLED),
+            'totalServing':      state.count(STATUS_SERVING),
+            'totalDone':         state.count(STATUS_DONE),
             'activeCounters':    AgencyCounter.active_count(agency_id),
-            'avgServiceTimeSec': avg_service,
+            'avgServiceTimeSec': state.avg_service_seconds(),
             'peakFactor':        QueueService._peak_factor(),
             'loadLevel':         load_level,
             'nowServing':        now_serving,
         }
 
+    @staticmethod
+    def rebuild_state() -> int:
+        """Dựng lại queue state của mọi cơ quan có vé hôm nay (gọi lúc khởi động)."""
+        today = _today()
+        if _use_db():
+            rows = db.session.execute(text("""
+                SELECT DISTINCT agency_id FROM public.queue_tickets WHERE date = :dt
+            """), {'dt': today}).fetchall()
+            agency_ids = [r[0] for r in rows if r[0]]
+        else:
+            agency_ids = sorted({t.get('agencyId') for t in QueueTicket._all_json()
+                                 if t.get('agencyId') and t.get('date') == today})
+        return _engine.rebuild(agency_ids, today)
+
     @staticmethod
     def sync_to_postgres(agency_id: str, summary: dict) -> None:
         """Upsert snapshot vào agency_queue_realtime (dùng cho map-overview nhanh)."""
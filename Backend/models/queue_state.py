@@ -0,0 +1,238 @@
+"""
+Queue state engine — trạng thái hàng chờ trong bộ nhớ, theo từng cơ quan / ngày.
+
+queue_summary, estimate_wait và /api/queue/list trước đây đọc lại mọi vé trong
+ngày rồi đếm lại bằng Python ở mỗi lần gọi — chi phí tăng dần theo số vé đã
+phát. Ở đây mỗi (agency, date) có một AgencyQueueState dựng MỘT lần từ
+PostgreSQL/JSON (nguồn dữ liệu bền vững), sau đó mỗi thay đổi vé (tạo / gọi /
+phục vụ / xong / huỷ) được `apply` — chỉ cập nhật bộ đếm của đúng vé đó:
+
+  • đếm theo trạng thái, số vé chờ theo dịch vụ, số vé ưu tiên đang chờ
+  • danh sách chờ theo từng mức priority, sắp theo ticket_number (bisect) —
+    vị trí của vé = tổng số vé ở mức priority cao hơn + chỉ số trong mức của nó
+  • tổng / số mẫu thời gian phục vụ (servedAt → doneAt) của vé đã xong
+  • quầy đang gọi / phục vụ
+
+Mỗi process giữ state riêng: state cũ hơn QUEUE_STATE_RESYNC_SECS được dựng
+lại từ DB ở lần đọc sau (giới hạn độ lệch giữa các worker), state của ngày cũ
+bị bỏ khi sang ngày mới.
+
+Tham số cấu hình (biến môi trường):
+  QUEUE_STATE_RESYNC_SECS : float, default 300 — tuổi tối đa của state trước khi dựng lại (0 = không)
+"""
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime
+
+QUEUE_STATE_RESYNC_SECS = float(os.getenv('QUEUE_STATE_RESYNC_SECS', '300'))
+
+_WAITING = 'waiting'
+_ON_COUNTER = ('called', 'serving')
+_DONE = 'done'
+
+
+def _service_seconds(ticket: dict):
+    if ticket.get('status') != _DONE or not ticket.get('servedAt') or not ticket.get('doneAt'):
+        return None
+    try:
+        return (datetime.fromisoformat(ticket['doneAt'])
+                - datetime.fromisoformat(ticket['servedAt'])).total_seconds()
+    except Exception:
+        return None
+
+
+class AgencyQueueState:
+    """Trạng thái hàng chờ của một cơ quan trong một ngày. Thread-safe."""
+
+    def __init__(self, agency_id: str, date: str):
+        self.agency_id = agency_id
+        self.date = date
+        self.built_at = time.monotonic()
+        self._lock = threading.RLock()
+        self._tickets: dict = {}                 # id → ticket dict
+        self._status = Counter()
+        self._waiting_by_service = Counter()
+        self._waiting: dict = {}                 # priority → [(ticket_number, id)] tăng dần
+        self._on_counter: dict = {}              # id → ticket đang gọi / phục vụ có counterNo
+        self._service_total = 0.0
+        self._service_count = 0
+
+    # ── mutation ──────────────────────────────────────────────────────────────
+
+    def load(self, tickets) -> 'AgencyQueueState':
+        with self._lock:
+            for t in tickets:
+                self.apply(t)
+            self.built_at = time.monotonic()
+        return self
+
+    def apply(self, ticket: dict) -> bool:
+        """Thêm / cập nhật một vé. Bỏ qua bản cũ hơn bản đang giữ (theo updatedAt)."""
+        tid = ticket.get('id')
+        if not tid:
+            return False
+        with self._lock:
+            old = self._tickets.get(tid)
+            if old is not None:
+                if (ticket.get('updatedAt') or '') < (old.get('updatedAt') or ''):
+                    return False
+                self._account(old, -1)
+            new = dict(ticket)
+            self._tickets[tid] = new
+            self._account(new, +1)
+            return True
+
+    def _account(self, t: dict, sign: int) -> None:
+        status = t.get('status')
+        self._status[status] += sign
+        if status == _WAITING:
+            self._waiting_by_service[t.get('serviceId', '')] += sign
+            bucket = self._waiting.setdefault(t.get('priority', 0) or 0, [])
+            key = (t.get('ticketNumber', 0), t['id'])
+            if sign > 0:
+                insort(bucket, key)
+            else:
+                i = bisect_left(bucket, key)
+                if i < len(bucket) and bucket[i] == key:
+                    del bucket[i]
+        elif status in _ON_COUNTER and t.get('counterNo'):
+            if sign > 0:
+                self._on_counter[t['id']] = t
+            else:
+                self._on_counter.pop(t['id'], None)
+        secs = _service_seconds(t)
+        if secs is not None:
+            self._service_total += sign * secs
+            self._service_count += sign
+
+    # ── queries ───────────────────────────────────────────────────────────────
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            return self._status[status]
+
+    def waiting_ahead(self, priority: int = 0) -> int:
+        """Số vé chờ mà một vé mới ở mức `priority` phải đợi (như estimate_wait cũ)."""
+        with self._lock:
+            if priority == 0:
+                return self._status[_WAITING]
+            return sum(len(b) for p, b in self._waiting.items() if p > 0)
+
+    def position(self, ticket_id: str):
+        """Số vé đang chờ đứng trước vé này; None nếu vé không ở trạng thái chờ."""
+        with self._lock:
+            t = self._tickets.get(ticket_id)
+            if t is None or t.get('status') != _WAITING:
+                return None
+            prio = t.get('priority', 0) or 0
+            ahead = sum(len(b) for p, b in self._waiting.items() if p > prio)
+            return ahead + bisect_left(self._waiting.get(prio, []), (t.get('ticketNumber', 0), ticket_id))
+
+    def waiting_for_service(self, service_id: str) -> int:
+        with self._lock:
+            return self._waiting_by_service[service_id]
+
+    def avg_service_seconds(self) -> int:
+        with self._lock:
+            return int(self._service_total / self._service_count) if self._service_count > 0 else 0
+
+    def now_serving(self) -> list:
+        with self._lock:
+            return sorted((dict(t) for t in self._on_counter.values()),
+                          key=lambda t: t.get('counterNo') or 0)
+
+    def tickets(self, status: str = None) -> list:
+        """Bản sao các vé, sắp như find_all: priority giảm dần, ticket_number tăng dần."""
+        with self._lock:
+            if status == _WAITING:
+                out = [self._tickets[tid] for p in sorted(self._waiting, reverse=True)
+                       for _, tid in self._waiting[p]]
+            else:
+                out = sorted((t for t in self._tickets.values()
+                              if status is None or t.get('status') == status),
+                             key=lambda t: (-(t.get('priority', 0) or 0), t.get('ticketNumber', 0)))
+            return [dict(t) for t in out]
+
+
+class QueueStateEngine:
+    """Registry AgencyQueueState theo (agency, date); dựng lười bằng `loader(agency_id, date)`."""
+
+    def __init__(self, loader, resync_secs: float = QUEUE_STATE_RESYNC_SECS):
+        self._loader = loader
+        self._resync = resync_secs
+        self._lock = threading.Lock()
+        self._states: dict = {}
+        self._building: dict = {}               # key → vé apply trong lúc đang dựng
+        self._build_locks: dict = {}            # key → lock: mỗi key chỉ một lần dựng cùng lúc
+        self.builds = 0
+
+    def _fresh(self, state) -> bool:
+        return state is not None and (
+            not self._resync or time.monotonic() - state.built_at < self._resync)
+
+    def get(self, agency_id: str, date: str) -> AgencyQueueState:
+        key = (agency_id, date)
+        with self._lock:
+            state = self._states.get(key)
+            if self._fresh(state):
+                return state
+            # Ngày mới → bỏ state của các ngày trước
+            for k in [k for k in self._states if k[1] != date]:
+                del self._states[k]
+                self._build_locks.pop(k, None)
+        return self._build(key, force=False)
+
+    def _build(self, key, force: bool) -> AgencyQueueState:
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            with self._lock:
+                state = self._states.get(key)
+                if not force and self._fresh(state):
+                    return state            # thread khác vừa dựng xong
+                self._building[key] = []
+            try:
+                state = AgencyQueueState(*key).load(self._loader(*key))
+            except BaseException:
+                with self._lock:
+                    self._building.pop(key, None)
+                raise
+            with self._lock:
+                # Thay đổi xảy ra trong lúc đọc DB được áp lại (bản cũ hơn tự bị bỏ qua)
+                for t in self._building.pop(key, []):
+                    state.apply(t)
+                self._states[key] = state
+                self.builds += 1
+            return state
+
+    def apply(self, ticket: dict) -> None:
+        """Ghi nhận một vé vừa thay đổi; bỏ qua nếu state của cơ quan chưa được dựng."""
+        if not ticket:
+            return
+        key = (ticket.get('agencyId'), str(ticket.get('date')))
+        with self._lock:
+            pending = self._building.get(key)
+            if pending is not None:
+                pending.append(dict(ticket))
+            state = self._states.get(key)
+        if state is not None:
+            state.apply(ticket)
+
+    def rebuild(self, agency_ids, date: str) -> int:
+        """Dựng lại state cho các cơ quan (lúc khởi động). Trả về số state đã dựng."""
+        n = 0
+        for aid in agency_ids:
+            self._build((aid, date), force=True)
+            n += 1
+        return n
+
+    def clear(self) -> None:
+        with self._lock:
+            self._states.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'states': len(self._states), 'builds': self.builds}
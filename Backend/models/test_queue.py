@@ -0,0 +1,130 @@
+import threading
+
+import pytest
+
+import models.queue as queue
+from models.queue import QueueService, QueueTicket
+from models.user import FileStorage
+
+
+def _json_store(monkeypatch, tmp_path):
+    monkeypatch.setattr(queue, '_use_db', lambda: False)
+    monkeypatch.setattr(FileStorage, 'get_data_dir', staticmethod(lambda: tmp_path))
+    monkeypatch.setattr(QueueService, 'estimate_wait', staticmethod(lambda *a, **k: 0))
+    queue._engine.clear()
+
+
+def test_concurrent_json_tickets_get_unique_numbers(monkeypatch, tmp_path):
+    _json_store(monkeypatch, tmp_path)
+    barrier = threading.Barrier(16)
+    issued = []
+
+    def kiosk():
+        barrier.wait()
+        for _ in range(5):
+            issued.append(QueueTicket.create({'agencyId': 'ag1', 'prefix': 'a', 'date': '2026-01-05'}))
+
+    threads = [threading.Thread(target=kiosk) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    numbers = sorted(t['ticketNumber'] for t in issued)
+    assert numbers == list(range(1, 81))
+    stored = FileStorage.read_json('queue_tickets.json')
+    assert len(stored) == 80 and {t['ticketCode'][:1] for t in stored} == {'A'}
+
+
+def test_numbering_is_per_agency_prefix_and_date(monkeypatch, tmp_path):
+    _json_store(monkeypatch, tmp_path)
+    make = lambda aid, pfx, dt: QueueTicket.create({'agencyId': aid, 'prefix': pfx, 'date': dt})
+    assert make('ag1', 'A', '2026-01-05')['ticketNumber'] == 1
+    assert make('ag1', 'A', '2026-01-05')['ticketNumber'] == 2
+    assert make('ag1', 'B', '2026-01-05')['ticketNumber'] == 1
+    assert make('ag2', 'A', '2026-01-05')['ticketNumber'] == 1
+    assert make('ag1', 'A', '2026-01-06')['ticketCode'] == 'A001'
+
+
+def test_update_does_not_drop_concurrently_created_ticket(monkeypatch, tmp_path):
+    _json_store(monkeypatch, tmp_path)
+    first = QueueTicket.create({'agencyId': 'ag1', 'date': '2026-01-05'})
+    barrier = threading.Barrier(2)
+
+    def updater():
+        barrier.wait()
+        for _ in range(20):
+            QueueTicket.update(first['id'], {'priority': 1})
+
+    def creator():
+        barrier.wait()
+        for _ in range(20):
+            QueueTicket.create({'agencyId': 'ag1', 'date': '2026-01-05'})
+
+    threads = [threading.Thread(target=updater), threading.Thread(target=creator)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(FileStorage.read_json('queue_tickets.json')) == 21
+
+
+def _seed_waiting(n, **overrides):
+    from models.queue import _today
+    tickets = [dict({'id': f't{i}', 'agencyId': 'ag1', 'serviceId': f's{i % 3}', 'ticketNumber': i,
+                     'prefix': 'A', 'status': 'waiting', 'priority': 1 if i % 10 == 0 else 0,
+                     'date': _today(), 'updatedAt': ''}, **overrides) for i in range(1, n + 1)]
+    FileStorage.write_json('queue_tickets.json', tickets)
+
+
+def test_concurrent_counters_never_call_the_same_ticket(monkeypatch, tmp_path):
+    _json_store(monkeypatch, tmp_path)
+    _seed_waiting(60)
+    barrier = threading.Barrier(8)
+    called = []
+
+    def counter(no):
+        barrier.wait()
+        while (t := QueueTicket.call_next('ag1', no)) is not None:
+            called.append(t['id'])
+
+    threads = [threading.Thread(target=counter, args=(no,)) for no in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(called) == len(set(called)) == 60
+    stored = FileStorage.read_json('queue_tickets.json')
+    assert all(t['status'] == 'called' and t['counterNo'] for t in stored)
+
+
+def test_call_next_orders_by_priority_then_affinity(monkeypatch, tmp_path):
+    _json_store(monkeypatch, tmp_path)
+    _seed_waiting(12)
+    order = [QueueTicket.call_next('ag1', 1, affinity=['s2'])['id'] for _ in range(4)]
+    assert order == ['t10', 't2', 't5', 't8']                # lớp ưu tiên trước, rồi dịch vụ s2
+    assert QueueTicket.call_next('ag1', 1, service_id='s0')['id'] == 't3'
+    assert QueueTicket.call_next('ag1', 1)['id'] == 't1'
+
+
+def test_call_next_sql_claims_with_skip_locked():
+    sql, params = QueueTicket._call_next_query('ag1', 3, affinity=['s1'], date='2026-01-05')
+    assert 'FOR UPDATE SKIP LOCKED' in sql and 'RETURNING q.*' in sql
+    assert 'priority DESC, (service_id = ANY(:aff)) DESC, ticket_number ASC' in sql
+    assert params == {'aid': 'ag1', 'dt': '2026-01-05', 'cnt': 3, 'aff': ['s1']}
+    sql, params = QueueTicket._call_next_query('ag1', 3, service_id='s1')
+    assert 'service_id = :sid' in sql and 'aff' not in params
+
+
+def test_skip_locked_benchmark_on_postgres():
+    psycopg2 = pytest.importorskip('psycopg2')
+    from models.db import get_db_url
+    try:
+        psycopg2.connect(get_db_url(), connect_timeout=2).close()
+    except Exception:
+        pytest.skip('cần Postgres (DB_HOST / DB_PORT / ...)')
+    from scripts.bench_call_next import run
+
+    report = run(get_db_url(), tickets=300, max_counters=8, service_ms=2)
+    assert report['double_called'] == 0 and report['missed'] == 0
+    assert report['rounds'][-1]['speedup'] > 2                  # 8 quầy nhanh hơn rõ rệt 1 quầy
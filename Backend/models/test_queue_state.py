@@ -0,0 +1,89 @@
+import models.queue as queue
+from models.queue import (
+    AgencyCounter, QueueService, QueueTicket, ServiceStats, _today, queue_state,
+)
+from models.queue_state import AgencyQueueState, QueueStateEngine
+from models.user import FileStorage
+
+
+def _t(tid, num, status='waiting', prio=0, svc='s1', **extra):
+    t = {'id': tid, 'agencyId': 'ag1', 'date': '2026-01-05', 'ticketNumber': num,
+         'prefix': 'A', 'status': status, 'priority': prio, 'serviceId': svc,
+         'updatedAt': extra.pop('updatedAt', f'2026-01-05T08:00:{num:02d}')}
+    t.update(extra)
+    return t
+
+
+def test_counts_positions_and_transitions():
+    st = AgencyQueueState('ag1', '2026-01-05').load([
+        _t('a', 1), _t('b', 2), _t('c', 3, prio=1), _t('d', 4, svc='s2'),
+    ])
+    assert st.count('waiting') == 4 and st.waiting_for_service('s1') == 3
+    assert [t['id'] for t in st.tickets('waiting')] == ['c', 'a', 'b', 'd']
+    assert st.position('c') == 0 and st.position('b') == 2 and st.position('d') == 3
+    assert st.waiting_ahead(0) == 4 and st.waiting_ahead(1) == 1
+
+    st.apply(_t('c', 3, status='called', prio=1, counterNo=2, updatedAt='2026-01-05T09:00:00'))
+    st.apply(_t('a', 1, status='serving', counterNo=1, updatedAt='2026-01-05T09:00:01'))
+    assert st.count('waiting') == 2 and st.position('b') == 0
+    assert [t['counterNo'] for t in st.now_serving()] == [1, 2]
+
+    st.apply(_t('a', 1, status='done', servedAt='2026-01-05T09:00:00',
+                doneAt='2026-01-05T09:05:00', updatedAt='2026-01-05T09:05:00'))
+    st.apply(_t('b', 2, status='cancelled', updatedAt='2026-01-05T09:06:00'))
+    assert st.avg_service_seconds() == 300
+    assert st.count('done') == 1 and st.count('cancelled') == 1 and st.count('waiting') == 1
+    assert [t['counterNo'] for t in st.now_serving()] == [2]
+
+
+def test_older_update_is_ignored():
+    st = AgencyQueueState('ag1', '2026-01-05').load([_t('a', 1)])
+    st.apply(_t('a', 1, status='called', counterNo=1, updatedAt='2026-01-05T09:00:00'))
+    assert not st.apply(_t('a', 1, updatedAt='2026-01-05T08:59:00'))
+    assert st.count('waiting') == 0 and st.count('called') == 1
+
+
+def test_engine_builds_once_and_resyncs(monkeypatch):
+    calls = []
+
+    def loader(aid, dt):
+        calls.append((aid, dt))
+        return [_t('a', 1)]
+
+    engine = QueueStateEngine(loader, resync_secs=300)
+    st = engine.get('ag1', '2026-01-05')
+    assert engine.get('ag1', '2026-01-05') is st and len(calls) == 1
+    engine.apply(_t('b', 2))
+    assert st.count('waiting') == 2
+
+    monkeypatch.setattr(st, 'built_at', st.built_at - 301)
+    assert engine.get('ag1', '2026-01-05') is not st and len(calls) == 2
+    engine.get('ag1', '2026-01-06')
+    assert engine.stats()['states'] == 1                     # ngày cũ bị bỏ
+
+
+def test_engine_replays_changes_made_while_building():
+    engine = QueueStateEngine(lambda aid, dt: (engine.apply(_t('b', 2)), [_t('a', 1)])[1])
+    assert engine.get('ag1', '2026-01-05').count('waiting') == 2
+
+
+def test_summary_and_wait_come_from_state(monkeypatch, tmp_path):
+    monkeypatch.setattr(queue, '_use_db', lambda: False)
+    monkeypatch.setattr(FileStorage, 'get_data_dir', staticmethod(lambda: tmp_path))
+    monkeypatch.setattr(AgencyCounter, 'active_count', staticmethod(lambda aid: 1))
+    monkeypatch.setattr(ServiceStats, 'avg_service_time', staticmethod(lambda *a, **k: 100.0))
+    monkeypatch.setattr(QueueService, '_peak_factor', staticmethod(lambda: 1.0))
+    queue._engine.clear()
+
+    first = QueueTicket.create({'agencyId': 'agX', 'serviceId': 's1'})
+    second = QueueTicket.create({'agencyId': 'agX', 'serviceId': 's1'})
+    assert second['estimatedWait'] == 100 and first['estimatedWait'] == 50
+    assert QueueService.estimate_wait('agX', 's1', ticket_id=second['id']) == 100
+
+    QueueTicket.call_next('agX', counter_no=3)
+    summary = QueueService.queue_summary('agX')
+    assert summary['totalWaiting'] == 1 and summary['totalCalled'] == 1
+    assert summary['nowServing'] == [{'counterNo': 3, 'ticketCode': 'A001', 'serviceName': ''}]
+    assert queue_state('agX').position(second['id']) == 0
+    assert [t['id'] for t in QueueTicket.find_all('agX', _today())] == [first['id'], second['id']]
+    queue._engine.clear()
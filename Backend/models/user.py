@@ -1,8 +1,17 @@
 import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
 
+try:
+    import fcntl
+except ImportError:  # Windows — chỉ khoá giữa các thread trong process
+    fcntl = None
+
 
 # Try to detect SQLAlchemy DB from models.db
 try:
@@ -18,6 +27,9 @@ except Exception:
 from logger import get_logger as _get_logger
 _log = _get_logger('models.user')
 
+_file_locks: dict = {}
+_file_locks_guard = threading.Lock()
+
 
 class FileStorage:
     """Utility class for file-based JSON storage"""
@@ -43,16 +55,44 @@ class FileStorage:
     
     @staticmethod
     def write_json(filename, data):
-        """Write JSON file"""
+        """Write JSON file (ghi file tạm rồi os.replace — reader không bao giờ thấy file dở)"""
         filepath = FileStorage.get_data_dir() / filename
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            fd, tmp = tempfile.mkstemp(dir=filepath.parent, prefix=f'.{filename}.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False)
+                os.replace(tmp, filepath)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+                raise
             return True
         except Exception as e:
             _log.warning(f"Error writing {filename}: {e}")
             return False
 
+    @staticmethod
+    @contextmanager
+    def lock(filename):
+        """
+        Khoá độc quyền cho một chuỗi read → modify → write trên file JSON:
+        lock theo thread trong process + flock trên `<file>.lock` giữa các process (POSIX).
+        """
+        with _file_locks_guard:
+            thread_lock = _file_locks.setdefault(filename, threading.Lock())
+        with thread_lock:
+            if fcntl is None:
+                yield
+                return
+            lock_path = FileStorage.get_data_dir() / f'{filename}.lock'
+            with open(lock_path, 'a+') as lock_f:
+                fcntl.flock(lock_f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_f, fcntl.LOCK_UN)
+
 
 class User:
     """User model - file-based storage with optional Postgres backing"""
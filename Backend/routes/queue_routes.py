@@ -21,49 +21,52 @@ import json
 import time
 import threading
 from datetime import datetime
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 
 from models.queue import (
     QueueTicket, AgencyCounter, QueueService, ServiceStats,
     STATUS_WAITING, STATUS_CALLED, STATUS_SERVING,
     STATUS_DONE, STATUS_ABSENT, STATUS_CANCELLED,
-    ACTIVE_STATUSES, _today,
+    ACTIVE_STATUSES, _today, queue_state,
 )
+from services import queue_events
+from services.queue_broadcast import QueueBroadcaster
 from logger import get_logger
 
 log = get_logger('queue_routes')
 queue_bp = Blueprint('queue', __name__, url_prefix='/api/queue')
 
-# ── WebSocket subscriber registry ────────────────────────────────────────────
-_subscribers: dict[str, list] = {}
-_sub_lock = threading.Lock()
+# ── WebSocket broadcaster ────────────────────────────────────────────────────
+_broadcaster = QueueBroadcaster(QueueService.queue_summary,
+                                on_publish=QueueService.sync_to_postgres)
 
 
-def _broadcast(agency_id: str, payload: dict):
-    msg  = json.dumps(payload, ensure_ascii=False)
-    with _sub_lock:
-        conns = list(_subscribers.get(agency_id, []))
-    dead = []
-    for ws in conns:
+def _bind_app():
+    if _broadcaster.app is None:
         try:
-            ws.send(msg)
-        except Exception:
-            dead.append(ws)
-    if dead:
-        with _sub_lock:
-            bucket = _subscribers.get(agency_id, [])
-            for ws in dead:
-                try: bucket.remove(ws)
-                except ValueError: pass
-
-
-def _push_summary(agency_id: str):
-    try:
-        summary = QueueService.queue_summary(agency_id)
-        _broadcast(agency_id, {'type': 'summary', 'data': summary})
-        QueueService.sync_to_postgres(agency_id, summary)
-    except Exception as e:
-        log.error(f'[Queue WS] push_summary error: {e}')
+            _broadcaster.bind_app(current_app._get_current_object())
+        except RuntimeError:
+            pass
+
+
+def _on_queue_event(event: dict):
+    """Thay đổi hàng chờ ở worker này hoặc worker khác → broadcaster gộp rồi đẩy."""
+    _bind_app()
+    # Chỉ worker tạo ra thay đổi ghi agency_queue_realtime (on_publish)
+    local = not event.get('remote')
+    if event.get('kind') == 'resync':
+        _broadcaster.notify_all(local)
+    else:
+        _broadcaster.notify(event.get('agencyId'), local)
+
+
+queue_events.subscribe(_on_queue_event)
+
+
+def init_queue_realtime(app):
+    """Gắn app cho broadcaster + khởi động event bus (LISTEN) — gọi lúc server khởi động."""
+    _broadcaster.bind_app(app)
+    return queue_events.start(app)
 
 
 # ── WebSocket handler ─────────────────────────────────────────────────────────
@@ -71,37 +74,24 @@ def _push_summary(agency_id: str):
 def register_websocket(sock_app):
     @sock_app.route('/ws/queue/<agency_id>')
     def ws_queue(ws, agency_id: str):
+        _bind_app()
+        client = _broadcaster.subscribe(agency_id, ws)
         try:
-            summary = QueueService.queue_summary(agency_id)
-            ws.send(json.dumps({'type': 'snapshot', 'data': summary}, ensure_ascii=False))
-        except Exception:
-            pass
-
-        with _sub_lock:
-            _subscribers.setdefault(agency_id, []).append(ws)
-
-        try:
-            while True:
+            while not client.closed:
                 try:
                     msg = ws.receive(timeout=15)
                     if msg is None:
                         break
                     data = json.loads(msg)
                     if data.get('type') == 'ping':
-                        ws.send(json.dumps({'type': 'pong', 'ts': time.time()}))
+                        client.send({'type': 'pong', 'ts': time.time()})
                     elif data.get('type') == 'subscribe':
-                        summary = QueueService.queue_summary(agency_id)
-                        ws.send(json.dumps({'type': 'snapshot', 'data': summary}, ensure_ascii=False))
+                        _broadcaster.send_snapshot(agency_id, client)
                 except Exception:
-                    try:
-                        ws.send(json.dumps({'type': 'ping', 'ts': time.time()}))
-                    except Exception:
+                    if not client.send({'type': 'ping', 'ts': time.time()}):
                         break
         finally:
-            with _sub_lock:
-                bucket = _subscribers.get(agency_id, [])
-                try: bucket.remove(ws)
-                except ValueError: pass
+            _broadcaster.unsubscribe(agency_id, client)
 
 
 # ── Helper ────────────────────────────────────────────────────────────────────
@@ -164,7 +154,6 @@ def take_ticket():
             'priority':    priority,
             'prefix':      prefix,
         })
-        threading.Thread(target=_push_summary, args=(agency_id,), daemon=True).start()
         return _ok(ticket, 201)
     except Exception as e:
         log.error(f'take_ticket error: {e}', exc_info=True)
@@ -181,8 +170,10 @@ def ticket_status(ticket_id: str):
     if ticket.get('status') == STATUS_WAITING:
         ticket['estimatedWait'] = QueueService.estimate_wait(
             ticket['agencyId'], ticket.get('serviceId', ''),
-            ticket.get('priority', 0), ticket.get('prefix', 'A')
+            ticket.get('priority', 0), ticket.get('prefix', 'A'), ticket_id=ticket_id,
         )
+        if ticket.get('date') == _today():
+            ticket['position'] = queue_state(ticket['agencyId']).position(ticket_id)
     return _ok(ticket)
 
 
@@ -199,7 +190,7 @@ def my_tickets():
         if t.get('status') == STATUS_WAITING:
             t['estimatedWait'] = QueueService.estimate_wait(
                 t['agencyId'], t.get('serviceId', ''),
-                t.get('priority', 0), t.get('prefix', 'A')
+                t.get('priority', 0), t.get('prefix', 'A'), ticket_id=t['id'],
             )
     return _ok(tickets)
 
@@ -220,7 +211,6 @@ def cancel_ticket(ticket_id: str):
         return _err('Không thể hủy vé ở trạng thái này', 400)
 
     updated = QueueTicket.update(ticket_id, {'status': STATUS_CANCELLED})
-    threading.Thread(target=_push_summary, args=(ticket['agencyId'],), daemon=True).start()
     return _ok(updated)
 
 
@@ -268,12 +258,14 @@ def call_next():
     agency_id  = (data.get('agencyId') or '').strip()
     counter_no = int(data.get('counterNo', 1))
     service_id = data.get('serviceId')
+    affinity   = data.get('affinity') or None          # dịch vụ quầy ưu tiên gọi trước
     if not agency_id:
         return _err('Thiếu agencyId', 400)
-    ticket = QueueTicket.call_next(agency_id, counter_no, service_id)
+    if affinity is not None and not isinstance(affinity, list):
+        return _err('affinity phải là danh sách serviceId', 400)
+    ticket = QueueTicket.call_next(agency_id, counter_no, service_id, affinity)
     if not ticket:
         return jsonify({'success': True, 'data': None, 'message': 'Không còn vé chờ'})
-    threading.Thread(target=_push_summary, args=(agency_id,), daemon=True).start()
     return _ok(ticket)
 
 
@@ -314,7 +306,6 @@ def update_ticket_status(ticket_id: str):
                 pass
 
     updated = QueueTicket.update(ticket_id, updates)
-    threading.Thread(target=_push_summary, args=(ticket['agencyId'],), daemon=True).start()
     return _ok(updated)
 
 
@@ -338,7 +329,6 @@ def upsert_counter():
     if not agency_id:
         return _err('Thiếu agencyId', 400)
     counter = AgencyCounter.upsert(agency_id, counter_no, is_active, operator_name)
-    threading.Thread(target=_push_summary, args=(agency_id,), daemon=True).start()
     return _ok(counter, 201)
 
 
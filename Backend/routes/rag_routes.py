@@ -1,8 +1,9 @@
 """
-RAG / chatbot routes: chat, session history, procedure suggestion.
+RAG / chatbot routes: chat, session history, procedure suggestion, semantic cache admin.
 """
 import json
 import os
+import queue
 import re
 import threading
 import time
@@ -16,6 +17,7 @@ from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 
 from logger import get_logger
+from middleware.auth import require_admin
 # RAG imports are lazy (loaded on first request) để không làm chậm startup
 
 log = get_logger('rag_routes')
@@ -24,6 +26,9 @@ rag_bp = Blueprint('rag', __name__)
 
 VN_TZ = timezone(timedelta(hours=7))
 
+# Kích thước (ký tự) mỗi frame SSE khi gửi câu trả lời lấy từ cache
+_SSE_FRAME_CHARS = int(os.getenv('RAG_SSE_FRAME_CHARS', '400'))
+
 # ── Lazy singletons (thread-safe) ─────────────────────────────────────────────
 _agent_graph: Optional[Any] = None  # MultiRoleAgentGraph — lazy import
 _db_engine = None
@@ -89,14 +94,23 @@ def _clean_docs(raw: Any) -> str:
 
 
 # ── DB logging ─────────────────────────────────────────────────────────────────
-def _log_chat(session_id: Optional[str], user_query: str, ai_response: str, intermediate_steps: str) -> Optional[str]:
-    """Persist chat to SQL Server. Returns session_id or None on failure/no-db."""
+def _log_chat(
+    session_id: Optional[str],
+    user_query: str,
+    ai_response: str,
+    intermediate_steps: str,
+    new_session: bool = False,
+) -> Optional[str]:
+    """
+    Persist chat to SQL Server. Returns session_id or None on failure/no-db.
+    new_session=True: session_id do server cấp trước (stream) — vẫn tạo chat_sessions.
+    """
     engine = _get_db()
     if engine is None:
         return None
 
     timestamp = datetime.now(VN_TZ).replace(tzinfo=None)
-    is_new = not session_id
+    is_new = new_session or not session_id
     sid = session_id or f'st_session_{uuid.uuid4()}'
     summary = user_query[:30] + ('...' if len(user_query) > 30 else '')
 
@@ -126,6 +140,13 @@ def _log_chat(session_id: Optional[str], user_query: str, ai_response: str, inte
         log.warning(f'[rag] DB log failed: {exc}', exc_info=True)
         return None
 
+    # Tóm tắt lượt này trên thread nền — lượt sau đọc summary đã lưu, không gọi LLM
+    try:
+        from RAG.agent_core.memory_summary import schedule as schedule_summary  # lazy
+        schedule_summary(conv_id, user_query, ai_response)
+    except Exception as exc:
+        log.debug(f'[rag] memory summary skipped (non-fatal): {exc}')
+
     return sid
 
 
@@ -167,6 +188,69 @@ def _fetch_session_messages(session_id: str) -> List[Dict[str, Any]]:
         return []
 
 
+# ── Single-flight (gộp câu hỏi trùng đang xử lý) ──────────────────────────────
+def _single_flight():
+    from RAG.agent_core.single_flight import get_single_flight  # lazy
+    return get_single_flight()
+
+
+def _flight_embedding(message: str) -> Optional[List[float]]:
+    """Embedding để gộp theo ngữ nghĩa (chỉ khi RAG_COALESCE_SIM > 0; LRU được dùng lại ở cache_check)."""
+    from RAG.agent_core.single_flight import COALESCE_SIM  # lazy
+    if COALESCE_SIM <= 0:
+        return None
+    try:
+        from RAG.tools.rag import get_embedding
+        return get_embedding(message)
+    except Exception as exc:
+        log.debug(f'[rag] coalesce embedding failed (non-fatal): {exc}')
+        return None
+
+
+def _join_flight(message: str, session_id: Optional[str]):
+    """
+    (flight, is_leader). Scope = session id: request trong các hội thoại khác nhau
+    (lịch sử khác nhau) không bao giờ dùng chung câu trả lời. Khi tắt single-flight
+    trả về một flight riêng, không đăng ký.
+    """
+    from RAG.agent_core.single_flight import COALESCE_ENABLED, Flight  # lazy
+    if not COALESCE_ENABLED:
+        return Flight(message, None), True
+    return _single_flight().join(message, _flight_embedding(message), scope=session_id or '')
+
+
+def _flight_result(final_answer: str, llm_analysis: Any = None, tool_results: Any = None,
+                   intermediate: Optional[str] = None) -> Dict[str, Any]:
+    """Kết quả chung mà leader của /chat lẫn /chat/stream settle cho follower."""
+    if intermediate is None:
+        source = llm_analysis if llm_analysis is not None else tool_results
+        intermediate = _clean_docs(source if source is not None else [])
+    return {'final_answer': final_answer, 'llm_analysis': llm_analysis,
+            'tool_results': tool_results, 'intermediate': intermediate}
+
+
+def _coalesced(message: str, session_id: Optional[str], fn) -> Dict[str, Any]:
+    """
+    Chạy fn() (trả về agent state) một lần cho mọi request trùng đang bay.
+    Leader publish câu trả lời thành frame để follower của /chat/stream cũng nhận được.
+    """
+    flight, leader = _join_flight(message, session_id)
+    if not leader:
+        log.info(f'[rag] coalesced: "{message[:60]}" (+{flight.followers})')
+        return flight.wait()
+    try:
+        state = fn()
+        result = _flight_result(state.get('final_answer'), state.get('llm_analysis'),
+                                state.get('tool_results'))
+    except BaseException as exc:
+        _single_flight().fail(flight, exc)
+        raise
+    for frame in _frames((result['final_answer'] or '').strip(), _SSE_FRAME_CHARS):
+        flight.publish(frame)
+    _single_flight().finish(flight, result)
+    return result
+
+
 def init_document_suggestion():
     """Alias để server.py preload vẫn hoạt động."""
     from RAG.tools.suggest import init_suggest  # lazy
@@ -195,6 +279,7 @@ def rag_chat():
         re.IGNORECASE,
     )
 
+    intermediate_str: Optional[str] = None
     if intent == 'document_suggestion' or (intent == '' and _DOC_QUERY_RE.search(user_message)):
         try:
             from services.suggest_service import suggest_with_requirements, format_for_chat
@@ -220,7 +305,7 @@ def rag_chat():
             return jsonify({'success': False, 'message': f'Failed to initialize agent: {exc}'}), 500
         try:
             state = agent.create_new_state(user_question=user_message, session_id=session_id or '')
-            result = agent.run(state)
+            result = _coalesced(user_message, session_id, lambda: agent.run(state))
         except Exception as exc:
             err_str = str(exc)
             is_quota = '429' in err_str or 'quota' in err_str.lower() or 'ResourceExhausted' in type(exc).__name__
@@ -233,6 +318,7 @@ def rag_chat():
         final_answer = result.get('final_answer') or 'Xin lỗi, tôi chưa thể trả lời câu hỏi này.'
         raw_analysis = result.get('llm_analysis')
         raw_tool_results = result.get('tool_results')
+        intermediate_str = result.get('intermediate')
 
     def _safe_json(v: Any) -> Any:
         try:
@@ -247,8 +333,8 @@ def rag_chat():
     stored_session_id = session_id
 
     try:
-        source = raw_analysis if raw_analysis is not None else raw_tool_results
-        intermediate_str = _clean_docs(source if source is not None else [])
+        if intermediate_str is None:
+            intermediate_str = _flight_result(final_answer, raw_analysis, raw_tool_results)['intermediate']
         result_sid = _log_chat(session_id, user_message, final_answer, intermediate_str)
         if result_sid:
             stored_session_id = result_sid
@@ -278,8 +364,31 @@ def rag_chat():
     return jsonify(response_payload)
 
 
+def _frames(text_: str, size: int) -> List[str]:
+    """Cắt text thành vài frame lớn (~size ký tự), ưu tiên cắt ở khoảng trắng."""
+    frames: List[str] = []
+    while len(text_) > size:
+        cut = text_.rfind(' ', 0, size) + 1 or size
+        frames.append(text_[:cut])
+        text_ = text_[cut:]
+    if text_:
+        frames.append(text_)
+    return frames
+
+
 @rag_bp.route('/api/rag/chat/stream', methods=['POST'])
 def rag_chat_stream():
+    """
+    SSE theo từng giai đoạn — byte đầu tiên được gửi ngay, không chờ pipeline:
+      session → progress(received) → progress(cache_check | analyzing |
+      retrieving | retrieved, ...) → start → chunk… → done
+    Pipeline chạy trên thread riêng, tiến độ được chuyển qua hàng đợi.
+    Câu trả lời từ cache gửi thành vài frame lớn. _log_chat (chat_sessions +
+    conversation_history) chạy ngay trước frame done — client dùng sessionId
+    trong done gửi lượt tiếp được ngay; cache_store chạy sau khi stream đóng
+    (call_on_close). Câu hỏi trùng một câu đang chạy chỉ nhận lại luồng token
+    của request đầu tiên (single-flight).
+    """
     payload      = request.get_json(silent=True) or {}
     user_message = (payload.get('message') or '').strip()
     session_id   = payload.get('sessionId') or None
@@ -287,40 +396,112 @@ def rag_chat_stream():
     if not user_message:
         return jsonify({'success': False, 'message': 'message is required'}), 400
 
+    # Session id biết trước → gửi được ngay trong frame đầu tiên
+    stream_sid = session_id or f'st_session_{uuid.uuid4()}'
+    outcome: Dict[str, Any] = {}
+
     def _sse(data: dict) -> str:
         return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
 
+    def _log_once():
+        if outcome.get('answer') and not outcome.get('logged'):
+            outcome['logged'] = True
+            _log_chat(stream_sid, user_message, outcome['answer'], outcome['intermediate'],
+                      new_session=not session_id)
+
+    def _done(start: float) -> str:
+        _log_once()
+        return _sse({'type': 'done', 'sessionId': stream_sid,
+                     'latencyMs': round((time.perf_counter() - start) * 1000, 2)})
+
+    def _error_message(exc: Exception, fallback: str) -> str:
+        err = str(exc)
+        if '429' in err or 'quota' in err.lower():
+            return 'Hệ thống AI đang quá tải, vui lòng thử lại sau ít phút.'
+        return fallback.format(err=err)
+
     @stream_with_context
     def generate():
         start = time.perf_counter()
+        yield _sse({'type': 'session', 'sessionId': stream_sid})
+        yield _sse({'type': 'progress', 'stage': 'received'})
+
         try:
             agent = _get_agent()
         except Exception as exc:
             yield _sse({'type': 'error', 'message': str(exc)})
             return
 
-        # ── Phase 1: pipeline (cache check + tool execution) ──────────────
+        # ── Single-flight: câu hỏi trùng đang chạy → nhận chung luồng token ──
+        flight, leader = _join_flight(user_message, session_id)
+        if not leader:
+            yield from _follow(flight, start)
+            return
+        try:
+            yield from _lead(agent, flight, start)
+        finally:
+            if outcome.get('answer'):
+                _single_flight().finish(flight, outcome['result'])
+            else:
+                _single_flight().fail(flight, RuntimeError(outcome.get('error') or 'Yêu cầu gốc đã bị huỷ.'))
+
+    def _follow(flight, start: float):
+        yield _sse({'type': 'progress', 'stage': 'coalesced'})
+        yield _sse({'type': 'start'})
+        parts: List[str] = []
         try:
-            state = agent.create_new_state(user_message, session_id or '')
-            agent.run_pipeline_only(state)
+            for chunk in flight.stream():
+                parts.append(chunk)
+                yield _sse({'type': 'chunk', 'text': chunk})
+            result = flight.wait(0) or {}
         except Exception as exc:
-            err = str(exc)
-            is_quota = '429' in err or 'quota' in err.lower()
-            msg = 'Hệ thống AI đang quá tải, vui lòng thử lại sau ít phút.' if is_quota else 'Xảy ra lỗi khi xử lý yêu cầu.'
-            yield _sse({'type': 'error', 'message': msg})
+            yield _sse({'type': 'error', 'message': _error_message(exc, '{err}')})
             return
-
-        # ── Cache HIT: stream cached answer word by word ───────────────────
+        answer = ''.join(parts).strip()
+        if not answer and result.get('final_answer'):
+            answer = result['final_answer'].strip()
+            for frame in _frames(answer, _SSE_FRAME_CHARS):
+                yield _sse({'type': 'chunk', 'text': frame})
+        outcome.update(answer=answer, intermediate=result.get('intermediate') or '{}', state=None)
+        yield _done(start)
+
+    def _lead(agent, flight, start: float):
+        # ── Phase 1: pipeline (cache check + tool execution) trên thread riêng ──
+        state  = agent.create_new_state(user_message, session_id or '')
+        events: 'queue.Queue[tuple]' = queue.Queue()
+
+        def _run_pipeline():
+            try:
+                agent.run_pipeline_only(
+                    state, on_stage=lambda stage, **info: events.put(('progress', stage, info)),
+                )
+                events.put(('ok', None, None))
+            except Exception as exc:
+                events.put(('error', exc, None))
+
+        threading.Thread(target=_run_pipeline, name='rag-stream-pipeline', daemon=True).start()
+        while True:
+            kind, value, info = events.get()
+            if kind == 'progress':
+                yield _sse({'type': 'progress', 'stage': value, **(info or {})})
+            elif kind == 'error':
+                log.warning(f'[rag] stream pipeline failed: {value}')
+                outcome['error'] = _error_message(value, 'Xảy ra lỗi khi xử lý yêu cầu.')
+                yield _sse({'type': 'error', 'message': outcome['error']})
+                return
+            else:
+                break
+
+        # ── Cache HIT: gửi câu trả lời đã cache thành vài frame lớn ─────────
         if state.get('cache_hit'):
             cached = (state.get('final_answer') or '').strip()
-            stored_sid = _log_chat(session_id, user_message, cached, '{}') or session_id
-            yield _sse({'type': 'session', 'sessionId': stored_sid})
-            words = cached.split(' ')
-            for i, word in enumerate(words):
-                chunk = word + ('' if i == len(words) - 1 else ' ')
-                yield _sse({'type': 'chunk', 'text': chunk})
-            yield _sse({'type': 'done', 'sessionId': stored_sid,
-                        'latencyMs': round((time.perf_counter() - start) * 1000, 2)})
+            yield _sse({'type': 'start'})
+            for frame in _frames(cached, _SSE_FRAME_CHARS):
+                flight.publish(frame)
+                yield _sse({'type': 'chunk', 'text': frame})
+            outcome.update(answer=cached, intermediate='{}', state=None,
+                           result=_flight_result(cached, intermediate='{}'))
+            yield _done(start)
             return
 
         # ── Phase 2: stream synthesis ──────────────────────────────────────
@@ -329,7 +510,8 @@ def rag_chat_stream():
             from RAG.utils.llm_wrapper import GeminiSynthesizerLLM
             synthesis_prompt = build_synthesis_prompt(state)
         except Exception as exc:
-            yield _sse({'type': 'error', 'message': f'Lỗi xây dựng prompt: {exc}'})
+            outcome['error'] = f'Lỗi xây dựng prompt: {exc}'
+            yield _sse({'type': 'error', 'message': outcome['error']})
             return
 
         synthesizer = GeminiSynthesizerLLM()
@@ -339,31 +521,38 @@ def rag_chat_stream():
         try:
             for chunk in synthesizer.stream_run(synthesis_prompt):
                 full_chunks.append(chunk)
+                flight.publish(chunk)
                 yield _sse({'type': 'chunk', 'text': chunk})
         except Exception as exc:
-            err = str(exc)
-            is_quota = '429' in err or 'quota' in err.lower()
-            msg = 'Hệ thống AI đang quá tải, vui lòng thử lại sau ít phút.' if is_quota else f'Lỗi sinh câu trả lời: {err}'
-            yield _sse({'type': 'error', 'message': msg})
+            outcome['error'] = _error_message(exc, 'Lỗi sinh câu trả lời: {err}')
+            yield _sse({'type': 'error', 'message': outcome['error']})
             return
 
         final_answer = ''.join(full_chunks).strip()
-
-        # ── Phase 3: cache store + DB log ─────────────────────────────────
         state['final_answer'] = final_answer
-        try:
-            from RAG.agent_core.node import cache_store
-            cache_store(state)
-        except Exception:
-            pass
-
         intermediate = _clean_docs(state.get('tool_results') or [])
-        stored_sid = _log_chat(session_id, user_message, final_answer, intermediate) or session_id
-
-        yield _sse({'type': 'done', 'sessionId': stored_sid,
-                    'latencyMs': round((time.perf_counter() - start) * 1000, 2)})
+        outcome.update(
+            answer=final_answer,
+            intermediate=intermediate,
+            state=state,
+            result=_flight_result(final_answer, state.get('llm_analysis'),
+                                  state.get('tool_results'), intermediate),
+        )
+        yield _done(start)
 
-    return Response(
+    # ── Phase 3: cache store — sau khi stream đã đóng (DB log: xem _done) ────
+    def _persist():
+        if not outcome.get('answer'):
+            return
+        if outcome.get('state') is not None:
+            try:
+                from RAG.agent_core.node import cache_store
+                cache_store(outcome['state'])
+            except Exception as exc:
+                log.debug(f'[rag] cache_store failed (non-fatal): {exc}')
+        _log_once()                                  # client ngắt trước frame done
+
+    response = Response(
         generate(),
         content_type='text/event-stream',
         headers={
@@ -372,6 +561,8 @@ def rag_chat_stream():
             'Connection': 'keep-alive',
         },
     )
+    response.call_on_close(_persist)
+    return response
 
 
 @rag_bp.route('/api/rag/sessions', methods=['GET'])
@@ -441,3 +632,99 @@ def api_suggest_procedure():
             'sessionId': new_sid,
         },
     })
+
+
+# Số query tối đa mỗi request batch (encode chạy trên thread của request)
+_SUGGEST_BATCH_MAX = int(os.getenv('SUGGEST_BATCH_MAX', '200'))
+
+
+def _strict_bool(value) -> bool:
+    """true/false, 1/0 hoặc chuỗi 'true'/'false'/'1'/'0'; giá trị khác → ValueError."""
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('true', '1'):
+        return True
+    if text in ('false', '0'):
+        return False
+    raise ValueError(f'không phải bool: {value!r}')
+
+
+def _field(payload: dict, key: str, default, cast):
+    """payload[key] ép kiểu bằng cast; thiếu / null → default (0 và false vẫn giữ nguyên)."""
+    value = payload.get(key)
+    if value is None:
+        return default
+    if isinstance(value, bool) and cast is not _strict_bool:
+        raise ValueError(f'{key} không nhận bool')
+    return cast(value)
+
+
+@rag_bp.route('/api/suggest-procedure/batch', methods=['POST'])
+@require_admin
+def api_suggest_procedure_batch():
+    """
+    Gợi ý thủ tục cho N query trong một lượt encode + một phép nhân ma trận (công cụ admin).
+    Body: {"queries": [...], "topK": 4, "threshold": 0.45, "includeRequirements": true}
+    """
+    payload = request.get_json(silent=True) or {}
+    queries = payload.get('queries')
+    if not isinstance(queries, list) or not queries:
+        return jsonify({'success': False, 'message': 'queries (list) is required'}), 400
+    if len(queries) > _SUGGEST_BATCH_MAX:
+        return jsonify({'success': False,
+                        'message': f'Tối đa {_SUGGEST_BATCH_MAX} queries mỗi request'}), 413
+    try:
+        top_k = _field(payload, 'topK', 4, int)
+        threshold = _field(payload, 'threshold', 0.45, float)
+        include_req = _field(payload, 'includeRequirements', True, _strict_bool)
+    except (TypeError, ValueError):
+        return jsonify({'success': False,
+                        'message': 'topK / threshold / includeRequirements không hợp lệ'}), 400
+    if top_k < 1 or not 0.0 <= threshold <= 1.0:
+        return jsonify({'success': False, 'message': 'topK >= 1, threshold trong [0, 1]'}), 400
+    queries = [str(q or '').strip() for q in queries]
+
+    start_time = time.perf_counter()
+    try:
+        from services.suggest_service import suggest_with_requirements_batch  # lazy
+        results = suggest_with_requirements_batch(
+            queries, top_k=top_k, threshold=threshold, include_requirements=include_req,
+        )
+    except Exception as exc:
+        log.error(f'[suggest-procedure/batch] {exc}', exc_info=True)
+        return jsonify({'success': False, 'message': str(exc)}), 500
+    latency_ms = round((time.perf_counter() - start_time) * 1000, 2)
+
+    return jsonify({
+        'success': True,
+        'data': {'results': results, 'count': len(results), 'latencyMs': latency_ms},
+    })
+
+
+# ── Semantic cache admin ──────────────────────────────────────────────────────
+
+@rag_bp.route('/api/rag/cache/invalidate', methods=['POST'])
+@require_admin
+def rag_cache_invalidate():
+    """Xoá một câu hỏi (body {"query": ...}) hoặc toàn bộ cache trên mọi worker."""
+    payload = request.get_json(silent=True) or {}
+    query = (payload.get('query') or '').strip() or None
+    try:
+        from RAG.cache.semantic_cache import get_cache  # lazy
+        removed = get_cache().invalidate(query)
+    except Exception as exc:
+        log.error(f'[rag/cache/invalidate] {exc}', exc_info=True)
+        return jsonify({'success': False, 'message': str(exc)}), 500
+    return jsonify({'success': True, 'data': {'query': query, 'removed': removed}})
+
+
+@rag_bp.route('/api/rag/cache/stats', methods=['GET'])
+@require_admin
+def rag_cache_stats():
+    from RAG.cache.semantic_cache import get_cache  # lazy
+    from RAG.agent_core import speculation
+    data = get_cache().stats()
+    data['speculation'] = speculation.stats()
+    data['single_flight'] = _single_flight().stats()
+    return jsonify({'success': True, 'data': data})
@@ -0,0 +1,158 @@
+"""
+Benchmark QueueTicket.call_next trên PostgreSQL: nạp --tickets vé chờ cho một cơ quan tạm,
+cho 1, 2, 4, ... --max-counters quầy (mỗi quầy một thread + một kết nối) cùng gọi số tới khi
+hết vé; ghi số vé bị gọi trùng, vé sót, thông lượng (vé/giây) và hệ số tăng so với 1 quầy.
+Chạy:  python -X utf8 -m scripts.bench_call_next [--tickets 2000] [--max-counters 16]
+           [--service-ms 5] [--naive] [--out bench_call_next.json]
+       (từ Backend/; cần Postgres theo DB_HOST / DB_PORT / DB_NAME / DB_USER / DB_PASSWORD)
+--service-ms: thời gian xử lý giả lập giữa hai lần gọi của một quầy.
+--naive: chạy thêm cách cũ (SELECT rồi UPDATE) để so sánh số vé bị gọi trùng.
+Exit code 1 nếu call_next (SKIP LOCKED) gọi trùng hoặc bỏ sót vé.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+_SEED_SQL = """
+    INSERT INTO public.queue_tickets
+        (id, agency_id, service_id, ticket_number, prefix, status, priority, date)
+    SELECT :aid || '-' || g, :aid, 's' || (g % 3), g, 'A', 'waiting',
+           CASE WHEN g % 10 = 0 THEN 1 ELSE 0 END, :dt
+    FROM generate_series(1, :n) AS g
+"""
+
+_NAIVE_SELECT = """
+    SELECT id FROM public.queue_tickets
+    WHERE agency_id = :aid AND status = 'waiting' AND date = :dt
+    ORDER BY priority DESC, ticket_number ASC LIMIT 1
+"""
+_NAIVE_UPDATE = """
+    UPDATE public.queue_tickets SET status = 'called', counter_no = :cnt, updated_at = now()
+    WHERE id = :id RETURNING id
+"""
+
+
+def _claim_loop(engine, agency_id, counter_no, naive, service_s, claimed, start):
+    from sqlalchemy import text
+    from models.queue import QueueTicket
+
+    sql, params = QueueTicket._call_next_query(agency_id, counter_no)
+    start.wait()
+    with engine.connect() as conn:
+        while True:
+            with conn.begin():
+                if naive:
+                    row = conn.execute(text(_NAIVE_SELECT), {'aid': agency_id, 'dt': params['dt']}).fetchone()
+                    if row:
+                        row = conn.execute(text(_NAIVE_UPDATE),
+                                           {'cnt': counter_no, 'id': row[0]}).fetchone()
+                else:
+                    row = conn.execute(text(sql), params).fetchone()
+            if not row:
+                break
+            claimed.append(row[0])
+            if service_s:
+                time.sleep(service_s)
+
+
+def run_round(engine, counters: int, tickets: int, service_ms: float = 0.0,
+              naive: bool = False) -> dict:
+    """Một vòng: nạp vé, `counters` quầy gọi tới hết, dọn dữ liệu; trả về số liệu."""
+    from sqlalchemy import text
+    from models.queue import _today
+
+    agency_id = f'bench_{uuid.uuid4().hex[:8]}'
+    with engine.begin() as conn:
+        conn.execute(text(_SEED_SQL), {'aid': agency_id, 'n': tickets, 'dt': _today()})
+    claimed, start = [], threading.Barrier(counters + 1)
+    threads = [threading.Thread(target=_claim_loop, daemon=True,
+                                args=(engine, agency_id, c, naive, service_ms / 1000.0, claimed, start))
+               for c in range(1, counters + 1)]
+    try:
+        for t in threads:
+            t.start()
+        start.wait()
+        t0 = time.perf_counter()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text('DELETE FROM public.queue_tickets WHERE agency_id = :aid'),
+                         {'aid': agency_id})
+    unique = len(set(claimed))
+    return {
+        'mode': 'naive' if naive else 'skip_locked',
+        'counters': counters,
+        'tickets': tickets,
+        'claims': len(claimed),
+        'double_called': len(claimed) - unique,
+        'missed': tickets - unique,
+        'elapsed_s': round(elapsed, 3),
+        'tickets_per_s': round(unique / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def run(db_url: str, tickets: int = 2000, max_counters: int = 16,
+        service_ms: float = 5.0, naive: bool = False) -> dict:
+    from sqlalchemy import create_engine
+
+    steps, c = [], 1
+    while c <= max_counters:
+        steps.append(c)
+        c *= 2
+    engine = create_engine(db_url, pool_size=max_counters + 1, max_overflow=0)
+    try:
+        rounds = [run_round(engine, n, tickets, service_ms) for n in steps]
+        if naive:
+            rounds += [run_round(engine, n, tickets, service_ms, naive=True) for n in steps if n > 1]
+    finally:
+        engine.dispose()
+    base = rounds[0]['tickets_per_s'] or 1.0
+    for r in rounds:
+        r['speedup'] = round(r['tickets_per_s'] / base, 2)
+    safe = [r for r in rounds if r['mode'] == 'skip_locked']
+    return {
+        'service_ms': service_ms,
+        'rounds': rounds,
+        'double_called': sum(r['double_called'] for r in safe),
+        'missed': sum(r['missed'] for r in safe),
+    }
+
+
+def main(argv=None):
+    env = Path(__file__).parent.parent / '.env'
+    if env.exists():
+        for l in open(env, encoding='utf-8'):
+            s = l.strip()
+            if s and not s.startswith('#') and '=' in s:
+                k, _, v = s.partition('='); os.environ.setdefault(k.strip(), v.strip().strip('"').strip("'"))
+    from models.db import get_db_url
+
+    p = argparse.ArgumentParser(description='call_next concurrency benchmark')
+    p.add_argument('--tickets', type=int, default=2000)
+    p.add_argument('--max-counters', type=int, default=16)
+    p.add_argument('--service-ms', type=float, default=5.0)
+    p.add_argument('--naive', action='store_true')
+    p.add_argument('--out', default='bench_call_next.json')
+    args = p.parse_args(argv)
+
+    report = run(get_db_url(), args.tickets, args.max_counters, args.service_ms, args.naive)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for r in report['rounds']:
+        print(f"{r['mode']:<12} {r['counters']:>3} quầy · {r['tickets_per_s']:>8} vé/s "
+              f"(x{r['speedup']}) · trùng {r['double_called']} · sót {r['missed']}")
+    print(f'→ {args.out}')
+    sys.exit(1 if report['double_called'] or report['missed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
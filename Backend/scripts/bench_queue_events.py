@@ -0,0 +1,120 @@
+"""
+Đo event bus hàng chờ (services/queue_events.py) giữa nhiều process: mỗi worker LISTEN cùng
+một kênh Postgres riêng cho lần chạy, phát --events event, rồi đếm event nhận được / bị mất
+và độ trễ giao nhận p50/p95/max.
+Chạy:  python -X utf8 -m scripts.bench_queue_events [--workers 4] [--events 200]
+           [--interval-ms 0] [--timeout 30] [--out bench_queue_events.json]
+       (từ Backend/; cần Postgres theo DB_HOST / DB_PORT / DB_NAME / DB_USER / DB_PASSWORD)
+Exit code 1 nếu có event bị mất.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def _worker(dsn, channel, events, interval, workers, ready, results, timeout):
+    from services.queue_events import PgQueueBus
+    bus = PgQueueBus(dsn, channel=channel).start()
+    try:
+        if not bus.wait_ready(10):
+            ready.abort()
+            results.put({'error': 'LISTEN không sẵn sàng'})
+            return
+        try:
+            ready.wait(30)                       # mọi worker đã LISTEN rồi mới phát
+        except threading.BrokenBarrierError:
+            results.put({'error': 'worker khác không khởi động được'})
+            return
+        for _ in range(events):
+            bus.publish('bench', 'bench')
+            if interval:
+                time.sleep(interval)
+        expected = events * (workers - 1)
+        deadline = time.monotonic() + timeout
+        while bus.received < expected and time.monotonic() < deadline:
+            time.sleep(0.01)
+        st = bus.stats()
+        st.update(expected=expected, missing=max(0, expected - bus.received),
+                  latencies=list(bus._latency))
+        results.put(st)
+    finally:
+        bus.stop()
+
+
+def run(dsn: str, workers: int = 4, events: int = 200,
+        interval_ms: float = 0.0, timeout: float = 30.0) -> dict:
+    """Chạy `workers` process cùng phát / nhận; trả về số liệu tổng hợp."""
+    from services.queue_events import _percentile
+
+    ctx = mp.get_context('spawn')
+    channel = f'queue_events_bench_{uuid.uuid4().hex[:8]}'
+    ready, results = ctx.Barrier(workers), ctx.Queue()
+    procs = [ctx.Process(target=_worker, daemon=True,
+                         args=(dsn, channel, events, interval_ms / 1000.0, workers,
+                               ready, results, timeout))
+             for _ in range(workers)]
+    t0 = time.perf_counter()
+    for p in procs:
+        p.start()
+    per_worker = [results.get(timeout=timeout + 60) for _ in procs]
+    for p in procs:
+        p.join(5)
+    elapsed = time.perf_counter() - t0
+
+    errors = [w['error'] for w in per_worker if 'error' in w]
+    ok = [w for w in per_worker if 'error' not in w]
+    lat = [x for w in ok for x in w.pop('latencies')]
+    return {
+        'workers': workers,
+        'events_per_worker': events,
+        'elapsed_s': round(elapsed, 3),
+        'expected': sum(w['expected'] for w in ok),
+        'received': sum(w['received'] for w in ok),
+        'missing': sum(w['missing'] for w in ok),
+        'dropped': sum(w['dropped'] for w in ok),
+        'latency_p50_ms': round(_percentile(lat, 0.50), 2),
+        'latency_p95_ms': round(_percentile(lat, 0.95), 2),
+        'latency_max_ms': round(max(lat), 2) if lat else 0.0,
+        'errors': errors,
+        'per_worker': ok,
+    }
+
+
+def main(argv=None):
+    env = Path(__file__).parent.parent / '.env'
+    if env.exists():
+        for l in open(env, encoding='utf-8'):
+            s = l.strip()
+            if s and not s.startswith('#') and '=' in s:
+                k, _, v = s.partition('='); os.environ.setdefault(k.strip(), v.strip().strip('"').strip("'"))
+    from models.db import get_db_url
+
+    p = argparse.ArgumentParser(description='Queue event bus multi-process benchmark')
+    p.add_argument('--workers', type=int, default=4)
+    p.add_argument('--events', type=int, default=200)
+    p.add_argument('--interval-ms', type=float, default=0.0)
+    p.add_argument('--timeout', type=float, default=30.0)
+    p.add_argument('--out', default='bench_queue_events.json')
+    args = p.parse_args(argv)
+
+    report = run(get_db_url(), args.workers, args.events, args.interval_ms, args.timeout)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"{report['received']}/{report['expected']} event nhận được · mất {report['missing']} "
+          f"(seq gap {report['dropped']}) · p50 {report['latency_p50_ms']} ms · "
+          f"p95 {report['latency_p95_ms']} ms · max {report['latency_max_ms']} ms → {args.out}")
+    for err in report['errors']:
+        print(f'  lỗi worker: {err}')
+    sys.exit(1 if report['missing'] or report['errors'] else 0)
+
+
+if __name__ == '__main__':
+    main()
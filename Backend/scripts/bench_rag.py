@@ -0,0 +1,67 @@
+"""
+Benchmark pipeline RAG (RAG/utils/benchmark.py): replay câu hỏi FAQ ở các chế độ retrieval /
+graph (LLM giả) / cache_hit, ghi p50/p95/p99 theo node, throughput, recall@k/MRR ra JSON.
+Chạy:  python -X utf8 -m scripts.bench_rag [--modes retrieval,graph,cache_hit] [--queries 200]
+           [--threads 4] [--k 5] [--llm-ms 0] [--out bench.json] [--baseline old.json] [--tolerance 0.2]
+       (từ Backend/; cần model embedding + ChromaDB, không cần Gemini / Postgres)
+Exit code 1 nếu có regression so với --baseline.
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def main(argv=None):
+    env = Path(__file__).parent.parent / '.env'
+    if env.exists():
+        for l in open(env, encoding='utf-8'):
+            s = l.strip()
+            if s and not s.startswith('#') and '=' in s:
+                k, _, v = s.partition('='); os.environ.setdefault(k.strip(), v.strip().strip('"').strip("'"))
+    from RAG.utils.benchmark import (
+        BENCH_K, BENCH_LLM_MS, BENCH_QUERIES, BENCH_THREADS, MODES, compare, run_suite,
+    )
+
+    p = argparse.ArgumentParser(description='RAG latency / quality benchmark')
+    p.add_argument('--modes', default=','.join(MODES))
+    p.add_argument('--queries', type=int, default=BENCH_QUERIES)
+    p.add_argument('--threads', type=int, default=BENCH_THREADS)
+    p.add_argument('--k', type=int, default=BENCH_K)
+    p.add_argument('--llm-ms', type=float, default=BENCH_LLM_MS)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--out', default='bench_rag.json')
+    p.add_argument('--baseline', default=None)
+    p.add_argument('--tolerance', type=float, default=0.2)
+    args = p.parse_args(argv)
+
+    result = run_suite(
+        modes=[m.strip() for m in args.modes.split(',') if m.strip()],
+        limit=args.queries, threads=args.threads, k=args.k, llm_ms=args.llm_ms, seed=args.seed,
+    )
+    Path(args.out).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    for mode, r in result['modes'].items():
+        total = r['latency_ms'].get('total', {})
+        print(f"{mode:10s} qps={r['throughput_qps']:<8} p50={total.get('p50')} p95={total.get('p95')} "
+              f"p99={total.get('p99')} ms  {r['quality']}")
+        for step, s in r['latency_ms'].items():
+            if step != 'total':
+                print(f"    {step:14s} p50={s['p50']} p95={s['p95']} p99={s['p99']} ms")
+    print(f'Saved -> {args.out}')
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        problems = compare(result, baseline, tolerance=args.tolerance)
+        for line in problems:
+            print(f'REGRESSION {line}')
+        if problems:
+            sys.exit(1)
+        print(f'Khong co regression so voi {args.baseline} (tolerance {args.tolerance:.0%}).')
+
+
+if __name__ == '__main__':
+    main()
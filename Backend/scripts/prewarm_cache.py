@@ -0,0 +1,38 @@
+"""
+Pre-warm SemanticCache (RAG/cache/prewarm.py) từ lịch sử query_results: gom cụm câu hỏi
+theo embedding, nạp câu đại diện của các cụm phổ biến vào cache (PostgreSQL rag_semantic_cache).
+Chạy:  python -X utf8 -m scripts.prewarm_cache [--refresh] [--days N] [--limit N]
+       (từ Backend/, cần .env + Postgres; --refresh sinh lại câu trả lời cũ qua Gemini)
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def main(argv=None):
+    for l in open(Path(__file__).parent.parent / '.env', encoding='utf-8'):
+        s = l.strip()
+        if s and not s.startswith('#') and '=' in s:
+            k, _, v = s.partition('='); os.environ.setdefault(k.strip(), v.strip().strip('"').strip("'"))
+    from RAG.cache.prewarm import PREWARM_DAYS, PREWARM_LIMIT, run_once
+    from RAG.cache.semantic_cache import get_cache
+
+    p = argparse.ArgumentParser(description='Pre-warm semantic cache')
+    p.add_argument('--days', type=int, default=PREWARM_DAYS)
+    p.add_argument('--limit', type=int, default=PREWARM_LIMIT)
+    p.add_argument('--refresh', action='store_true', help='sinh lại câu trả lời cũ ngay (bỏ qua giờ thấp điểm)')
+    args = p.parse_args(argv)
+
+    cache = get_cache()
+    stats = run_once(cache=cache, refresh=args.refresh or None, days=args.days, limit=args.limit)
+    for k, v in stats.items():
+        print(f'  {k}: {v}')
+    # Entry mới được ghi xuống PostgreSQL bởi WriteBehindQueue (flush lúc thoát — atexit)
+    print(f"Cache: {cache.stats()['entries']} entries.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+Train router chọn tool cục bộ (RAG/agent_core/tool_router.py) từ lịch sử
+query_results.retrieved_docs (output của task_analyzer), lưu RAG/models/tool_router.npz.
+Chạy:  python -X utf8 -m scripts.train_tool_router   (từ Backend/, cần .env + Postgres)
+"""
+import os
+import sys
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def main(limit: int = 20000, with_seed: bool = True):
+    for l in open(Path(__file__).parent.parent / '.env', encoding='utf-8'):
+        s = l.strip()
+        if s and not s.startswith('#') and '=' in s:
+            k, _, v = s.partition('='); os.environ.setdefault(k.strip(), v.strip().strip('"').strip("'"))
+    from RAG.connect_SQL.connect_SQL import connect_sql
+    from RAG.tools.rag import get_embeddings
+    from RAG.agent_core.tool_router import ROUTER_PATH, history_examples, seed_examples, train_router
+
+    engine = connect_sql()
+    examples = history_examples(engine, limit=limit) if engine is not None else []
+    print(f'{len(examples)} mau tu query_results')
+    if with_seed:
+        examples += seed_examples()
+    if not examples:
+        print('Khong co du lieu de train.'); return
+    router = train_router(examples, get_embeddings)
+    router.save(ROUTER_PATH)
+    counts = Counter('+'.join(l) or '(none)' for _, l in examples)
+    for label, n in counts.most_common():
+        print(f'  {label}: {n}')
+    print(f'Saved router -> {ROUTER_PATH} ({len(router.labels)} nhan).')
+
+
+if __name__ == '__main__':
+    main()
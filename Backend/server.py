@@ -128,6 +128,14 @@ if _bp_fail:
     _bp_summary += f' | {RED}✗ failed: {", ".join(_bp_fail)}{RESET}'
 log.info(_bp_summary)
 
+# ── Queue realtime: broadcaster + event bus giữa các worker ──────────────────
+try:
+    from routes.queue_routes import init_queue_realtime
+    _qbus = init_queue_realtime(app)
+    log.debug(f'[Queue] event bus: {_qbus.backend}')
+except Exception as e:
+    log.warning(f'[Queue] event bus init failed (chỉ cập nhật trong process): {e}')
+
 # ── WebSocket (flask-sock) ────────────────────────────────────────────────────
 if _SOCK_AVAILABLE:
     sock = Sock(app)
@@ -153,6 +161,17 @@ def _preload_suggest():
 
 threading.Thread(target=_preload_suggest, daemon=True).start()
 
+# ── Warm local tool router (seed embeddings) in background ────────────────────
+def _warm_tool_router():
+    try:
+        from RAG.agent_core.tool_router import warm_router
+        if warm_router():
+            log.debug('[router] local tool router ready')
+    except Exception as e:
+        log.warning(f'[router] warm-up failed: {e}')
+
+threading.Thread(target=_warm_tool_router, daemon=True).start()
+
 # ── Auto-seed procedures nếu bảng trống ──────────────────────────────────────
 def _auto_seed_procedures():
     """Tự động seed procedures nếu chưa có dữ liệu (fresh deployment)."""
@@ -210,6 +229,19 @@ def _auto_seed_queue_data():
 threading.Thread(target=_auto_seed_queue_data, daemon=True).start()
 
 
+# ── Dựng queue state trong bộ nhớ từ vé hôm nay (models/queue_state.py) ──────
+def _rebuild_queue_state():
+    try:
+        with app.app_context():
+            from models.queue import QueueService
+            n = QueueService.rebuild_state()
+            log.debug(f'[Queue] state rebuilt for {n} agencies')
+    except Exception as e:
+        log.warning(f'[Queue] state rebuild failed (sẽ dựng lười khi cần): {e}')
+
+threading.Thread(target=_rebuild_queue_state, daemon=True).start()
+
+
 # ── RAG session cleanup (chạy mỗi 6 giờ, xóa sessions > 30 ngày) ─────────────
 def _cleanup_rag_sessions():
     while True:
@@ -236,6 +268,15 @@ try:
 except Exception as _e:
     log.warning(f'[notif] không start được scheduler: {_e}')
 
+# ── Pre-warm SemanticCache từ lịch sử query_results (RAG/cache/prewarm.py) ────
+try:
+    from RAG.cache.prewarm import PREWARM_ENABLED, run_prewarm_loop
+    if PREWARM_ENABLED:
+        threading.Thread(target=run_prewarm_loop, daemon=True).start()
+        log.debug('[prewarm] cache warm-up scheduler started')
+except Exception as _e:
+    log.warning(f'[prewarm] không start được scheduler: {_e}')
+
 # ── Rate limiter đơn giản (in-memory, per-IP) ─────────────────────────────────
 from collections import defaultdict
 _rate_store: dict = defaultdict(list)
@@ -0,0 +1,293 @@
+"""
+Queue broadcaster — đẩy summary hàng chờ qua WebSocket, gộp theo cơ quan.
+
+Trước đây mỗi thao tác vé mở một thread riêng: tính lại queue_summary, ghi
+agency_queue_realtime rồi gửi lần lượt cho từng socket — giờ cao điểm có hàng
+chục thread tính cùng một summary, và một socket chậm chặn cả các socket sau.
+
+Ở đây:
+  • notify(agency_id) chỉ đánh dấu cơ quan "bẩn"; một thread dispatcher duy nhất
+    đợi QUEUE_WS_DEBOUNCE_MS sau thay đổi cuối (tối đa QUEUE_WS_MAX_WAIT_MS kể từ
+    thay đổi đầu) rồi tính summary MỘT lần cho cả loạt thay đổi.
+  • Chỉ gửi phần khác so với summary đã phát trước đó:
+        {'type': 'diff', 'seq': n, 'data': {key: giá trị mới}}
+    client ghép vào snapshot đang giữ; lệch seq → client xin snapshot lại.
+  • Mỗi client có hàng đợi gửi riêng (tối đa QUEUE_WS_CLIENT_BUFFER message) và
+    thread gửi riêng; hàng đợi đầy = client quá chậm → bị ngắt, không chặn ai khác.
+  • Mọi worker đều nhận mọi event (services/queue_events.py). Thay đổi từ worker
+    khác (local=False) chỉ tính summary khi worker này có client của cơ quan đó,
+    và on_publish (ghi agency_queue_realtime) chỉ chạy ở worker tạo ra thay đổi —
+    N worker vẫn là một summary + một upsert cho mỗi thay đổi.
+
+Tham số cấu hình (biến môi trường):
+  QUEUE_WS_DEBOUNCE_MS   : int, default 250  — cửa sổ gộp thay đổi
+  QUEUE_WS_MAX_WAIT_MS   : int, default 1000 — độ trễ tối đa khi thay đổi liên tục
+  QUEUE_WS_CLIENT_BUFFER : int, default 32   — số message chờ gửi tối đa mỗi client
+  QUEUE_WS_SNAPSHOT_TTL  : int, default 30   — giây; snapshot cũ hơn được tính lại khi client xin
+"""
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import nullcontext
+
+from logger import get_logger
+
+log = get_logger('queue_broadcast')
+
+QUEUE_WS_DEBOUNCE_MS = int(os.getenv('QUEUE_WS_DEBOUNCE_MS', '250'))
+QUEUE_WS_MAX_WAIT_MS = int(os.getenv('QUEUE_WS_MAX_WAIT_MS', '1000'))
+QUEUE_WS_CLIENT_BUFFER = int(os.getenv('QUEUE_WS_CLIENT_BUFFER', '32'))
+QUEUE_WS_SNAPSHOT_TTL = int(os.getenv('QUEUE_WS_SNAPSHOT_TTL', '30'))
+
+
+def diff_summary(prev: dict, cur: dict) -> dict:
+    """Các key có giá trị khác nhau giữa hai summary; key bị bỏ → None."""
+    if not prev:
+        return dict(cur)
+    out = {k: v for k, v in cur.items() if prev.get(k) != v}
+    out.update({k: None for k in prev if k not in cur})
+    return out
+
+
+def _dumps(payload: dict) -> str:
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+
+
+# ── Client ────────────────────────────────────────────────────────────────────
+
+class WsClient:
+    """Một socket + hàng đợi gửi có giới hạn + thread gửi riêng."""
+
+    def __init__(self, ws, max_buffer: int = QUEUE_WS_CLIENT_BUFFER):
+        self.ws = ws
+        self.closed = False
+        self.sent = 0
+        self._q = queue.Queue(maxsize=max(1, max_buffer))
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def offer(self, msg: str) -> bool:
+        """Xếp message vào hàng đợi; False nếu client đã đóng hoặc hàng đợi đầy."""
+        if self.closed:
+            return False
+        try:
+            self._q.put_nowait(msg)
+            return True
+        except queue.Full:
+            return False
+
+    def send(self, payload: dict) -> bool:
+        return self.offer(_dumps(payload))
+
+    def close(self) -> None:
+        self.closed = True
+        try:
+            self._q.put_nowait(None)
+        except queue.Full:
+            pass                       # thread gửi tự dừng sau lần send đang chạy
+
+    def _run(self):
+        while True:
+            msg = self._q.get()
+            if msg is None or self.closed:
+                break
+            try:
+                self.ws.send(msg)
+                self.sent += 1
+            except Exception:
+                self.closed = True
+                break
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+
+class _Channel:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients: list = []
+        self.last = None              # summary đã phát gần nhất
+        self.last_at = 0.0
+        self.seq = 0
+
+
+# ── Broadcaster ───────────────────────────────────────────────────────────────
+
+class QueueBroadcaster:
+    """
+    summary_fn(agency_id) → dict      : tính summary (chạy trong app context nếu đã bind_app)
+    on_publish(agency_id, summary)    : gọi khi summary đổi do thay đổi cục bộ
+                                        (vd. sync agency_queue_realtime)
+    """
+
+    def __init__(self, summary_fn, on_publish=None,
+                 debounce_ms: int = QUEUE_WS_DEBOUNCE_MS,
+                 max_wait_ms: int = QUEUE_WS_MAX_WAIT_MS,
+                 client_buffer: int = QUEUE_WS_CLIENT_BUFFER,
+                 snapshot_ttl: float = QUEUE_WS_SNAPSHOT_TTL):
+        self._summary_fn = summary_fn
+        self._on_publish = on_publish
+        self._debounce = debounce_ms / 1000.0
+        self._max_wait = max(debounce_ms, max_wait_ms) / 1000.0
+        self._client_buffer = client_buffer
+        self._snapshot_ttl = snapshot_ttl
+        self.app = None
+        self._channels: dict = {}
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._due: dict = {}           # agency_id → [first_at, due_at, local]
+        self._thread = None
+        self.notified = 0
+        self.published = 0
+        self.dropped = 0
+        self.skipped = 0
+
+    def bind_app(self, app) -> None:
+        self.app = app
+
+    def _channel(self, agency_id: str) -> _Channel:
+        with self._lock:
+            return self._channels.setdefault(agency_id, _Channel())
+
+    def _ctx(self):
+        return self.app.app_context() if self.app is not None else nullcontext()
+
+    # ── subscribe ────────────────────────────────────────────────────────────
+
+    def subscribe(self, agency_id: str, ws) -> WsClient:
+        client = WsClient(ws, self._client_buffer)
+        ch = self._channel(agency_id)
+        with ch.lock:
+            self._snapshot_locked(agency_id, ch, client)
+            ch.clients.append(client)
+        return client
+
+    def unsubscribe(self, agency_id: str, client: WsClient) -> None:
+        ch = self._channel(agency_id)
+        with ch.lock:
+            try:
+                ch.clients.remove(client)
+            except ValueError:
+                pass
+        client.close()
+
+    def send_snapshot(self, agency_id: str, client: WsClient) -> None:
+        """Gửi summary đầy đủ kèm seq hiện tại — các diff sau đó ghép khớp với nó."""
+        ch = self._channel(agency_id)
+        with ch.lock:
+            self._snapshot_locked(agency_id, ch, client)
+
+    def _snapshot_locked(self, agency_id: str, ch: _Channel, client: WsClient) -> None:
+        if ch.last is None or time.monotonic() - ch.last_at > self._snapshot_ttl:
+            self._publish_locked(agency_id, ch, sync=False)
+        if ch.last is not None:
+            client.send({'type': 'snapshot', 'seq': ch.seq, 'data': ch.last})
+
+    # ── notify / dispatch ────────────────────────────────────────────────────
+
+    def notify(self, agency_id: str, local: bool = True) -> None:
+        """
+        Đánh dấu cơ quan có thay đổi; summary được đẩy sau cửa sổ gộp.
+        local=False: thay đổi đến từ worker khác — không gọi on_publish.
+        """
+        if not agency_id:
+            return
+        now = time.monotonic()
+        with self._cond:
+            self.notified += 1
+            entry = self._due.get(agency_id)
+            if entry is None:
+                self._due[agency_id] = [now, now + self._debounce, local]
+            else:
+                entry[1] = min(now + self._debounce, entry[0] + self._max_wait)
+                entry[2] = entry[2] or local
+            self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def notify_all(self, local: bool = True) -> None:
+        """Mọi cơ quan đang có client / đã phát — dùng khi state vừa được dựng lại."""
+        with self._lock:
+            agency_ids = list(self._channels)
+        for aid in agency_ids:
+            self.notify(aid, local)
+
+    def flush(self) -> int:
+        """Đẩy ngay mọi cơ quan đang chờ (tắt server / test). Trả về số cơ quan."""
+        with self._cond:
+            pending = [(aid, entry[2]) for aid, entry in self._due.items()]
+            self._due.clear()
+        for aid, local in pending:
+            self.publish(aid, sync=local)
+        return len(pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._due:
+                        self._cond.wait()
+                        continue
+                    aid, (_, due_at, local) = min(self._due.items(), key=lambda kv: kv[1][1])
+                    delay = due_at - time.monotonic()
+                    if delay <= 0:
+                        del self._due[aid]
+                        break
+                    self._cond.wait(delay)
+            self.publish(aid, sync=local)
+
+    def publish(self, agency_id: str, sync: bool = True) -> bool:
+        """Tính summary và đẩy diff; sync=True thì gọi thêm on_publish."""
+        ch = self._channel(agency_id)
+        with ch.lock:
+            if not sync and not ch.clients:
+                # Không ai nghe, không phải thay đổi của worker này → bỏ qua; summary
+                # đã giữ coi như cũ để client kế tiếp nhận snapshot mới
+                ch.last = None
+                self.skipped += 1
+                return False
+            return self._publish_locked(agency_id, ch, sync)
+
+    def _publish_locked(self, agency_id: str, ch: _Channel, sync: bool = True) -> bool:
+        try:
+            with self._ctx():
+                summary = self._summary_fn(agency_id)
+                changes = diff_summary(ch.last, summary)
+                ch.last, ch.last_at = summary, time.monotonic()
+                if not changes:
+                    return False
+                ch.seq += 1
+                self.published += 1
+                if ch.clients:
+                    msg = _dumps({'type': 'diff', 'seq': ch.seq, 'data': changes})
+                    slow = [c for c in ch.clients if not c.offer(msg)]
+                    for c in slow:
+                        ch.clients.remove(c)
+                        c.close()
+                    if slow:
+                        self.dropped += len(slow)
+                        log.info(f'[Queue WS] {agency_id}: ngắt {len(slow)} client chậm')
+                if sync and self._on_publish:
+                    self._on_publish(agency_id, summary)
+                return True
+        except Exception as e:
+            log.error(f'[Queue WS] publish {agency_id} lỗi: {e}')
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            channels = list(self._channels.values())
+        with self._cond:
+            pending = len(self._due)
+        return {
+            'channels': len(channels),
+            'clients': sum(len(ch.clients) for ch in channels),
+            'pending': pending,
+            'notified': self.notified,
+            'published': self.published,
+            'dropped': self.dropped,
+            'skipped': self.skipped,
+        }
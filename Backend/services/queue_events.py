@@ -0,0 +1,297 @@
+"""
+Queue event bus — phát thay đổi hàng chờ tới mọi worker.
+
+Mỗi process (gunicorn worker) có queue state (models/queue_state.py) và
+broadcaster WebSocket (services/queue_broadcast.py) riêng; không có bus thì
+kiosk nối vào worker A không bao giờ thấy vé tạo ở worker B.
+
+  publish(kind, agency_id, ticket)  → gọi handler cục bộ ngay (remote=False) rồi gửi
+                                      sang các process khác
+  subscribe(handler)                → handler(event) nhận cả event cục bộ lẫn từ process khác
+
+Backend:
+  postgres : NOTIFY trên kênh QUEUE_EVENTS_CHANNEL; mỗi process một kết nối LISTEN
+             (thread riêng) + một kết nối autocommit để NOTIFY — không đụng session của request.
+  local    : chỉ trong process (chạy một worker / không có Postgres).
+  auto     : postgres nếu kết nối được lúc khởi tạo, không thì local.
+
+Event: {'kind': 'ticket'|'counter'|'resync', 'agencyId', 'ticket'?, 'ticketId'?,
+        'origin', 'seq', 'ts', 'remote'}
+  • payload NOTIFY tối đa ~8000 byte — vé quá lớn chỉ gửi ticketId, bên nhận tự đọc lại.
+  • seq tăng dần theo origin → bên nhận đếm event bị mất (dropped) khi seq nhảy cóc;
+    mất event hoặc mất kết nối LISTEN → phát event 'resync' để state dựng lại từ DB.
+  • ts (epoch) → độ trễ giao nhận p50/p95 trong stats().
+
+Tham số cấu hình (biến môi trường):
+  QUEUE_EVENTS_BACKEND        : str, default 'auto' — auto | postgres | local
+  QUEUE_EVENTS_CHANNEL        : str, default 'queue_events'
+  QUEUE_EVENTS_RECONNECT_SECS : float, default 5 — chờ trước khi nối lại LISTEN
+"""
+import json
+import os
+import select
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import nullcontext
+
+from logger import get_logger
+
+log = get_logger('queue_events')
+
+QUEUE_EVENTS_BACKEND = os.getenv('QUEUE_EVENTS_BACKEND', 'auto').strip().lower()
+QUEUE_EVENTS_CHANNEL = os.getenv('QUEUE_EVENTS_CHANNEL', 'queue_events').strip()
+QUEUE_EVENTS_RECONNECT_SECS = float(os.getenv('QUEUE_EVENTS_RECONNECT_SECS', '5'))
+
+_MAX_PAYLOAD = 7900
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+# ── Local ─────────────────────────────────────────────────────────────────────
+
+class LocalQueueBus:
+    """Bus trong process; cũng là lớp cơ sở: đánh số, dispatch, đếm mất / độ trễ."""
+
+    backend = 'local'
+
+    def __init__(self, handlers=None, app=None):
+        self.origin = uuid.uuid4().hex[:12]
+        self.app = app
+        self._handlers = handlers if handlers is not None else []
+        self._seq = 0
+        self._seq_lock = threading.Lock()
+        self._last_seq: dict = {}               # origin → seq cuối đã nhận
+        self._latency = deque(maxlen=2000)      # ms
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def subscribe(self, handler) -> None:
+        if handler not in self._handlers:
+            self._handlers.append(handler)
+
+    def publish(self, kind: str, agency_id: str = None, ticket: dict = None) -> dict:
+        with self._seq_lock:
+            self._seq += 1
+            seq = self._seq
+        event = {'kind': kind, 'agencyId': agency_id, 'origin': self.origin,
+                 'seq': seq, 'ts': time.time()}
+        if ticket is not None:
+            event['ticket'] = ticket
+        self.published += 1
+        self._dispatch(dict(event, remote=False))
+        self._send(event)
+        return event
+
+    def _send(self, event: dict) -> None:
+        pass
+
+    def _dispatch(self, event: dict) -> None:
+        for handler in list(self._handlers):
+            try:
+                handler(event)
+            except Exception as e:
+                self.errors += 1
+                log.warning(f'[QueueEvents] handler {getattr(handler, "__name__", handler)} lỗi: {e}')
+
+    def _receive(self, payload: str) -> None:
+        """Nhận một payload từ process khác (bỏ qua event do chính process này phát)."""
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            self.errors += 1
+            return
+        origin, seq = event.get('origin'), event.get('seq', 0)
+        if origin == self.origin:
+            return
+        last = self._last_seq.get(origin)
+        if last is not None and seq <= last:
+            return                               # trùng / đến muộn
+        self._last_seq[origin] = seq
+        self.received += 1
+        if event.get('ts'):
+            self._latency.append((time.time() - event['ts']) * 1000)
+        ctx = self.app.app_context() if self.app is not None else nullcontext()
+        with ctx:
+            if last is not None and seq > last + 1:
+                self.dropped += seq - last - 1
+                log.warning(f'[QueueEvents] mất {seq - last - 1} event từ {origin} → resync')
+                self._dispatch({'kind': 'resync', 'agencyId': None, 'remote': True})
+            self._dispatch(dict(event, remote=True))
+
+    def start(self) -> 'LocalQueueBus':
+        return self
+
+    def stop(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        lat = list(self._latency)
+        return {
+            'backend': self.backend,
+            'origin': self.origin,
+            'published': self.published,
+            'received': self.received,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'latency_p50_ms': round(_percentile(lat, 0.50), 2),
+            'latency_p95_ms': round(_percentile(lat, 0.95), 2),
+        }
+
+
+# ── Postgres LISTEN/NOTIFY ────────────────────────────────────────────────────
+
+class PgQueueBus(LocalQueueBus):
+    """NOTIFY qua kết nối psycopg2 riêng; thread LISTEN gọi _receive cho mỗi notification."""
+
+    backend = 'postgres'
+
+    def __init__(self, dsn: str, channel: str = QUEUE_EVENTS_CHANNEL,
+                 handlers=None, app=None, reconnect_secs: float = QUEUE_EVENTS_RECONNECT_SECS):
+        super().__init__(handlers, app)
+        self.dsn = dsn
+        self.channel = channel
+        self._reconnect = reconnect_secs
+        self._pub_conn = None
+        self._pub_lock = threading.Lock()
+        self._listen_conn = None
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+        self.reconnects = 0
+
+    def _connect(self):
+        import psycopg2
+        conn = psycopg2.connect(self.dsn, connect_timeout=3)
+        conn.autocommit = True
+        return conn
+
+    def _send(self, event: dict) -> None:
+        payload = json.dumps(event, ensure_ascii=False, default=str)
+        if len(payload.encode('utf-8')) > _MAX_PAYLOAD and 'ticket' in event:
+            slim = {k: v for k, v in event.items() if k != 'ticket'}
+            slim['ticketId'] = (event['ticket'] or {}).get('id')
+            payload = json.dumps(slim, ensure_ascii=False, default=str)
+        with self._pub_lock:
+            for attempt in (1, 2):
+                try:
+                    if self._pub_conn is None or self._pub_conn.closed:
+                        self._pub_conn = self._connect()
+                    with self._pub_conn.cursor() as cur:
+                        cur.execute('SELECT pg_notify(%s, %s)', (self.channel, payload))
+                    return
+                except Exception as e:
+                    self._pub_conn = None
+                    if attempt == 2:
+                        self.errors += 1
+                        log.warning(f'[QueueEvents] NOTIFY lỗi: {e}')
+
+    def start(self) -> 'PgQueueBus':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen_loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def wait_ready(self, timeout: float = 5.0) -> bool:
+        return self._ready.wait(timeout)
+
+    def stop(self) -> None:
+        self._stop.set()
+        for conn in (self._listen_conn, self._pub_conn):
+            try:
+                if conn is not None:
+                    conn.close()
+            except Exception:
+                pass
+
+    def _listen_loop(self):
+        first = True
+        while not self._stop.is_set():
+            try:
+                conn = self._listen_conn = self._connect()
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+                if not first:
+                    # Event phát trong lúc mất kết nối không tới được đây → dựng lại state
+                    self.reconnects += 1
+                    self._dispatch({'kind': 'resync', 'agencyId': None, 'remote': True})
+                first = False
+                self._ready.set()
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._receive(conn.notifies.pop(0).payload)
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                log.warning(f'[QueueEvents] LISTEN lỗi, nối lại sau {self._reconnect}s: {e}')
+                self._ready.clear()
+                self._stop.wait(self._reconnect)
+
+    def stats(self) -> dict:
+        return dict(super().stats(), channel=self.channel, reconnects=self.reconnects)
+
+
+# ── Module API ────────────────────────────────────────────────────────────────
+
+_handlers: list = []
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def _create_bus(app=None):
+    backend = QUEUE_EVENTS_BACKEND
+    if backend in ('auto', 'postgres'):
+        try:
+            from models.db import get_db_url
+            bus = PgQueueBus(get_db_url(), handlers=_handlers, app=app)
+            bus._pub_conn = bus._connect()            # kiểm tra kết nối trước khi chọn backend
+            log.info(f'[QueueEvents] dùng Postgres LISTEN/NOTIFY (kênh {bus.channel})')
+            return bus.start()
+        except Exception as e:
+            lvl = log.warning if backend == 'postgres' else log.debug
+            lvl(f'[QueueEvents] Postgres không khả dụng → bus trong process: {e}')
+    return LocalQueueBus(handlers=_handlers, app=app)
+
+
+def get_bus(app=None):
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                _bus = _create_bus(app)
+    if app is not None and _bus.app is None:
+        _bus.app = app
+    return _bus
+
+
+def start(app=None):
+    """Khởi tạo bus (và thread LISTEN) lúc server khởi động."""
+    return get_bus(app)
+
+
+def subscribe(handler) -> None:
+    if handler not in _handlers:
+        _handlers.append(handler)
+
+
+def publish(kind: str, agency_id: str = None, ticket: dict = None) -> None:
+    """Phát event; không bao giờ raise — lỗi bus không được làm hỏng thao tác vé."""
+    try:
+        get_bus().publish(kind, agency_id, ticket)
+    except Exception as e:
+        log.warning(f'[QueueEvents] publish lỗi: {e}')
+
+
+def stats() -> dict:
+    return _bus.stats() if _bus is not None else {'backend': None}
@@ -3,6 +3,7 @@ SuggestService — bridge giữa SuggestProcedure (embedding model) và ServiceR
 
 Cung cấp:
   suggest_with_requirements(query)  → gợi ý thủ tục + giấy tờ kèm theo
+  suggest_with_requirements_batch(queries) → như trên cho N query, một lượt encode
   format_for_voice(suggestions)     → chuỗi hội thoại thân thiện cho voice bot
   format_for_chat(suggestions)      → markdown cho RAG chatbot
 """
@@ -115,10 +116,18 @@ def suggest_with_requirements(
             'query': query,
         }
 
-    enriched: List[Dict] = []
-    req_cache: Dict[str, List[Dict]] = {}  # cache by service_key
+    enriched = _enrich(raw.get('suggestions', []), {}, include_requirements)
+    return _enriched_result(query, enriched)
+
 
-    for s in raw.get('suggestions', []):
+def _enrich(
+    suggestions: List[Dict],
+    req_cache: Dict[str, List[Dict]],
+    include_requirements: bool,
+) -> List[Dict]:
+    """Gắn service_key + requirements; req_cache dùng chung để mỗi key chỉ tra một lần."""
+    enriched: List[Dict] = []
+    for s in suggestions:
         name    = s.get('procedure_name', '')
         svc_key = _name_to_service_key(name)
         requirements: List[Dict] = []
@@ -133,7 +142,10 @@ def suggest_with_requirements(
             'service_key':  svc_key,
             'requirements': requirements,
         })
+    return enriched
 
+
+def _enriched_result(query: str, enriched: List[Dict]) -> Dict[str, Any]:
     explanation = (
         f'Tìm thấy {len(enriched)} thủ tục liên quan đến yêu cầu của bạn.'
         if enriched else
@@ -148,6 +160,50 @@ def suggest_with_requirements(
     }
 
 
+def suggest_with_requirements_batch(
+    queries: List[str],
+    top_k: int = 4,
+    threshold: float = 0.45,
+    include_requirements: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Phiên bản batch của `suggest_with_requirements` cho tool admin / script import.
+
+    Mọi query được encode trong một lượt model và chấm điểm bằng một phép nhân
+    ma trận (xem RAG.tools.suggest.suggest_procedures_batch). Requirements
+    được tra một lần cho mỗi service_key trên toàn batch.
+    Trả về list kết quả cùng thứ tự, mỗi phần tử cùng định dạng bản đơn.
+    """
+    try:
+        from RAG.tools.suggest import suggest_procedures_batch
+    except ImportError as e:
+        return [{
+            'suggestions': [],
+            'explanation': 'Mô-đun gợi ý chưa sẵn sàng.',
+            'error': str(e),
+            'total': 0,
+            'query': q,
+        } for q in queries]
+
+    raws = suggest_procedures_batch(queries, top_k=top_k, threshold=threshold)
+    req_cache: Dict[str, List[Dict]] = {}
+    results: List[Dict[str, Any]] = []
+    for query, raw in zip(queries, raws):
+        if raw.get('error'):
+            results.append({
+                'suggestions': [],
+                'explanation': raw.get('explanation', 'Lỗi gợi ý thủ tục.'),
+                'error': raw['error'],
+                'total': 0,
+                'query': query,
+            })
+            continue
+        enriched = _enrich(raw.get('suggestions', []), req_cache, include_requirements)
+        results.append(_enriched_result(query, enriched))
+    log.info(f'[SuggestService] batch {len(queries)} queries, {len(req_cache)} service keys')
+    return results
+
+
 # ── Formatters ────────────────────────────────────────────────────────────────
 
 def format_for_voice(suggestions: List[Dict], max_procedures: int = 2) -> str:
@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+
+from services.queue_broadcast import QueueBroadcaster, WsClient, diff_summary
+
+
+class FakeWs:
+    def __init__(self, block=None):
+        self.sent = []
+        self.closed = False
+        self._block = block
+
+    def send(self, msg):
+        if self._block is not None:
+            self._block.wait()
+        self.sent.append(json.loads(msg))
+
+    def close(self):
+        self.closed = True
+
+
+def _wait(cond, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not cond() and time.monotonic() < end:
+        time.sleep(0.005)
+    return cond()
+
+
+def test_diff_summary_keeps_only_changes():
+    prev = {'totalWaiting': 3, 'loadLevel': 'low', 'nowServing': [], 'old': 1}
+    cur = {'totalWaiting': 4, 'loadLevel': 'low', 'nowServing': [{'counterNo': 1}]}
+    assert diff_summary(prev, cur) == {'totalWaiting': 4, 'nowServing': [{'counterNo': 1}], 'old': None}
+    assert diff_summary(None, cur) == cur
+
+
+def test_mutation_burst_is_coalesced_into_one_diff():
+    state = {'totalWaiting': 0, 'loadLevel': 'low'}
+    calls, synced = [], []
+
+    def summary(aid):
+        calls.append(aid)
+        return dict(state)
+
+    b = QueueBroadcaster(summary, on_publish=lambda aid, s: synced.append(s),
+                         debounce_ms=30, max_wait_ms=200)
+    ws = FakeWs()
+    b.subscribe('ag1', ws)
+    assert _wait(lambda: len(ws.sent) == 1)
+    assert ws.sent[0] == {'type': 'snapshot', 'seq': 1, 'data': state}
+
+    for i in range(1, 21):
+        state['totalWaiting'] = i
+        b.notify('ag1')
+    assert _wait(lambda: len(ws.sent) == 2)
+    time.sleep(0.1)
+    assert len(calls) == 2 and len(ws.sent) == 2
+    assert ws.sent[1] == {'type': 'diff', 'seq': 2, 'data': {'totalWaiting': 20}}
+    assert synced[-1]['totalWaiting'] == 20
+
+    b.notify('ag1')                           # summary không đổi → không gửi gì
+    assert _wait(lambda: b.stats()['pending'] == 0)
+    time.sleep(0.05)
+    assert len(ws.sent) == 2 and b.stats()['published'] == 2
+
+
+def test_slow_client_is_dropped_without_blocking_others():
+    n = {'v': 0}
+    b = QueueBroadcaster(lambda aid: {'totalWaiting': n['v']}, debounce_ms=0, client_buffer=2)
+    gate = threading.Event()
+    slow, fast = FakeWs(block=gate), FakeWs()
+    slow_client = b.subscribe('ag1', slow)
+    b.subscribe('ag1', fast)
+    for i in range(1, 6):
+        n['v'] = i
+        b.publish('ag1')
+        assert _wait(lambda: len(fast.sent) == i + 1)
+    assert [m['seq'] for m in fast.sent] == [1, 2, 3, 4, 5, 6]
+    assert slow_client.closed and b.stats()['clients'] == 1 and b.stats()['dropped'] == 1
+    gate.set()
+    assert _wait(lambda: slow.closed)
+
+
+def test_client_stops_after_send_error():
+    class Broken(FakeWs):
+        def send(self, msg):
+            raise OSError('reset')
+
+    c = WsClient(Broken(), max_buffer=4)
+    assert c.send({'type': 'ping'})
+    assert _wait(lambda: c.closed)
+    assert not c.send({'type': 'ping'})
+
+
+def test_remote_changes_skip_summary_without_clients_and_never_sync():
+    calls, synced = [], []
+
+    def summary(aid):
+        calls.append(aid)
+        return {'totalWaiting': len(calls)}
+
+    b = QueueBroadcaster(summary, on_publish=lambda aid, s: synced.append(aid), debounce_ms=0)
+    b.notify('ag1', local=False)                   # worker khác đổi, không ai nghe ở đây
+    assert _wait(lambda: b.stats()['skipped'] == 1)
+    assert calls == [] and synced == []
+
+    b.notify('ag1')                                # thay đổi của chính worker này
+    assert _wait(lambda: synced == ['ag1'])
+    ws = FakeWs()
+    b.subscribe('ag1', ws)
+    b.notify('ag1', local=False)                   # có client → vẫn đẩy diff, không sync
+    assert _wait(lambda: len(ws.sent) == 2)
+    assert ws.sent[1]['type'] == 'diff' and synced == ['ag1']
@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+import models.queue as queue
+from services.queue_events import LocalQueueBus, PgQueueBus
+
+
+def _remote(origin, seq, **extra):
+    import time
+    return json.dumps(dict({'kind': 'ticket', 'agencyId': 'ag1', 'origin': origin,
+                            'seq': seq, 'ts': time.time()}, **extra))
+
+
+def test_local_publish_dispatches_synchronously():
+    seen = []
+    bus = LocalQueueBus()
+    bus.subscribe(seen.append)
+    bus.publish('ticket', 'ag1', {'id': 't1'})
+    bus.publish('counter', 'ag1')
+    assert [(e['kind'], e['seq'], e['remote']) for e in seen] == [('ticket', 1, False), ('counter', 2, False)]
+    assert seen[0]['ticket'] == {'id': 't1'} and bus.stats()['published'] == 2
+
+
+def test_receive_counts_gaps_and_ignores_own_and_duplicate_events():
+    seen = []
+    bus = LocalQueueBus([seen.append])
+    bus._receive(_remote(bus.origin, 1))                 # event của chính mình
+    bus._receive(_remote('w2', 1))
+    bus._receive(_remote('w2', 1))                       # trùng
+    bus._receive(_remote('w2', 4))                       # mất seq 2, 3
+    bus._receive('not json')
+    assert [(e['kind'], e.get('seq')) for e in seen] == [('ticket', 1), ('resync', None), ('ticket', 4)]
+    st = bus.stats()
+    assert st['received'] == 2 and st['dropped'] == 2 and st['errors'] == 1
+    assert st['latency_p95_ms'] >= 0
+
+
+def test_oversized_ticket_is_sent_by_id(monkeypatch):
+    sent = []
+
+    class FakeCursor:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *a):
+            return False
+
+        def execute(self, sql, params):
+            sent.append(params)
+
+    class FakeConn:
+        closed = False
+
+        def cursor(self):
+            return FakeCursor()
+
+    bus = PgQueueBus('postgresql://unused', channel='qe_test')
+    monkeypatch.setattr(bus, '_connect', lambda: FakeConn())
+    bus.publish('ticket', 'ag1', {'id': 't1', 'note': 'x' * 9000})
+    bus.publish('ticket', 'ag1', {'id': 't2'})
+    first, second = (json.loads(p[1]) for p in sent)
+    assert sent[0][0] == 'qe_test'
+    assert 'ticket' not in first and first['ticketId'] == 't1'
+    assert second['ticket'] == {'id': 't2'}
+
+
+def test_remote_events_update_queue_state(monkeypatch):
+    queue._engine.clear()
+    monkeypatch.setattr(queue.QueueTicket, '_scan', staticmethod(lambda *a, **k: []))
+    state = queue.queue_state('agR', '2026-01-05')
+    t = {'id': 'r1', 'agencyId': 'agR', 'date': '2026-01-05', 'ticketNumber': 1,
+         'status': 'waiting', 'priority': 0, 'updatedAt': '2026-01-05T08:00:00'}
+
+    queue._on_queue_event({'kind': 'ticket', 'agencyId': 'agR', 'ticket': t, 'remote': False})
+    assert state.count('waiting') == 0                    # cục bộ: _emit đã áp
+    queue._on_queue_event({'kind': 'ticket', 'agencyId': 'agR', 'ticket': t, 'remote': True})
+    assert state.count('waiting') == 1
+    queue._on_queue_event({'kind': 'resync', 'agencyId': None, 'remote': True})
+    assert queue._engine.stats()['states'] == 0
+    queue._engine.clear()
+
+
+def test_multiprocess_delivery_over_postgres():
+    psycopg2 = pytest.importorskip('psycopg2')
+    from models.db import get_db_url
+    try:
+        psycopg2.connect(get_db_url(), connect_timeout=2).close()
+    except Exception:
+        pytest.skip('cần Postgres (DB_HOST / DB_PORT / ...)')
+    from scripts.bench_queue_events import run
+
+    report = run(get_db_url(), workers=3, events=50, timeout=20)
+    assert not report['errors']
+    assert report['received'] == report['expected'] == 300
+    assert report['missing'] == 0 and report['dropped'] == 0
@@ -0,0 +1,33 @@
+import sys
+import types
+
+from services import suggest_service
+
+
+def _fake_batch(queries, top_k=4, threshold=0.45):
+    names = {'kết hôn': ['Đăng ký kết hôn', 'Cấp CCCD'], 'cccd': ['Cấp đổi căn cước']}
+    return [{'suggestions': [{'procedure_name': n} for n in names.get(q, [])]} for q in queries]
+
+
+def test_batch_dedupes_requirements_across_queries(monkeypatch):
+    mod = types.ModuleType('RAG.tools.suggest')
+    mod.suggest_procedures_batch = _fake_batch
+    monkeypatch.setitem(sys.modules, 'RAG.tools.suggest', mod)
+    lookups = []
+    monkeypatch.setattr(suggest_service, '_get_requirements',
+                        lambda key: lookups.append(key) or [{'docName': key, 'isRequired': True}])
+
+    out = suggest_service.suggest_with_requirements_batch(['kết hôn', 'cccd', 'xyz'])
+    assert [r['query'] for r in out] == ['kết hôn', 'cccd', 'xyz']
+    assert [s['service_key'] for s in out[0]['suggestions']] == ['ket_hon', 'cccd']
+    assert out[1]['suggestions'][0]['requirements'] == [{'docName': 'cccd', 'isRequired': True}]
+    assert out[2]['total'] == 0
+    assert sorted(lookups) == ['cccd', 'ket_hon']                 # mỗi key chỉ tra một lần
+
+
+def test_batch_propagates_init_errors(monkeypatch):
+    mod = types.ModuleType('RAG.tools.suggest')
+    mod.suggest_procedures_batch = lambda qs, **kw: [{'error': 'init_failed', 'explanation': 'x'} for _ in qs]
+    monkeypatch.setitem(sys.modules, 'RAG.tools.suggest', mod)
+    out = suggest_service.suggest_with_requirements_batch(['a', 'b'])
+    assert [r['error'] for r in out] == ['init_failed', 'init_failed']
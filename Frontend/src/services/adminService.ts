@@ -134,7 +134,7 @@ export const getQueueList = (agencyId: string) =>
   apiFull(`/queue/list/${agencyId}`);
 
 // counterNo là int (1, 2, 3...) — backend: POST /api/queue/call-next { agencyId, counterNo }
-export const callNextTicket = (data: { agencyId: string; counterNo?: number; serviceId?: string }) =>
+export const callNextTicket = (data: { agencyId: string; counterNo?: number; serviceId?: string; affinity?: string[] }) =>
   apiFull('/queue/call-next', { method: 'POST', body: JSON.stringify(data) });
 
 export const updateQueueTicket = (ticketId: string, status: string) =>
@@ -263,6 +263,7 @@ export interface ChatSessionMessagesResponse {
 export type StreamEvent =
   | { type: 'start' }
   | { type: 'session'; sessionId: string }
+  | { type: 'progress'; stage: string; tools?: string[]; timings?: Array<{ tool_name: string; status: string; ms: number }> }
   | { type: 'chunk'; text: string }
   | { type: 'done'; sessionId: string; latencyMs: number }
   | { type: 'error'; message: string };
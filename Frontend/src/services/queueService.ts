@@ -139,11 +139,12 @@ export function formatWaitTime(seconds: number): string {
 
 // ── WebSocket Client (tối ưu độ trễ) ─────────────────────────────────────────
 
-type WsMessageType = 'snapshot' | 'summary' | 'ping' | 'pong';
+type WsMessageType = 'snapshot' | 'summary' | 'diff' | 'ping' | 'pong';
 
 interface WsMessage {
   type: WsMessageType;
-  data?: QueueSummary;
+  data?: Partial<QueueSummary>;
+  seq?: number;
   ts?:  number;
 }
 
@@ -157,6 +158,8 @@ export class QueueWebSocket {
   private reconnectTimer: ReturnType<typeof setTimeout> | null = null;
   private reconnectDelay = 1000; // ms — exponential backoff
   private destroyed      = false;
+  private summary:       QueueSummary | null = null;
+  private seq            = 0;
 
   constructor(agencyId: string, onUpdate: QueueWsHandler) {
     this.agencyId = agencyId;
@@ -178,7 +181,19 @@ export class QueueWebSocket {
         try {
           const msg: WsMessage = JSON.parse(event.data as string);
           if (msg.type === 'snapshot' || msg.type === 'summary') {
-            if (msg.data) this.onUpdate(msg.data);
+            if (!msg.data) return;
+            this.summary = msg.data as QueueSummary;
+            this.seq     = msg.seq ?? this.seq;
+            this.onUpdate(this.summary);
+          } else if (msg.type === 'diff') {
+            // Server chỉ gửi các trường thay đổi; lệch seq → xin snapshot mới
+            if (!this.summary || msg.seq !== this.seq + 1) {
+              this.refresh();
+              return;
+            }
+            this.summary = { ...this.summary, ...msg.data } as QueueSummary;
+            this.seq     = msg.seq;
+            this.onUpdate(this.summary);
           } else if (msg.type === 'ping') {
             // Server ping → pong ngay lập tức (giảm độ trễ)
             this.ws?.send(JSON.stringify({ type: 'pong', ts: Date.now() }));